@@ -1,12 +1,36 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional
-from uuid import UUID, uuid1
-from datetime import datetime
+from uuid import UUID, uuid4
+from datetime import date, datetime
 from decimal import Decimal
-from cassandra.cluster import Cluster
+from cassandra import ConsistencyLevel
+from cassandra.cluster import EXEC_PROFILE_DEFAULT, Cluster, ExecutionProfile
 from cassandra.auth import PlainTextAuthProvider
+from cassandra.policies import (
+    ConstantSpeculativeExecutionPolicy, DCAwareRoundRobinPolicy, FallthroughRetryPolicy, RetryPolicy, TokenAwarePolicy
+)
+from cassandra.query import tuple_factory
 import uvicorn
+import asyncio
+import logging
+import threading
+import time
+
+from async_db import AsyncExecutor, Saturated
+from cache import LRUCache, NullCache, ReadCache, RedisCache
+from encoding import encode_transaction, encode_transactions
+from export import FORMATS, stream_export
+from metrics import REGISTRY, CountingRetryPolicy, Gauge, MetricsMiddleware, stage
+from paging import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursor, clustering_bounds, encode_cursor
+from repository import (
+    EXEC_PROFILE_EXPORTS, EXEC_PROFILE_POINT_READS, EXEC_PROFILE_RANGE_READS, CassandraRepository, InMemoryRepository
+)
+from rollups import MAX_PERIOD, MIN_PERIOD, period_of
+from sequencer import WriteSequencer
+from singleflight import SingleFlight
+from statements import StatementRegistry
 
 import os
 
@@ -16,34 +40,394 @@ SECURE_CONNECT_BUNDLE = os.getenv('SECURE_CONNECT_BUNDLE', os.path.join(os.path.
 CLIENT_ID = os.getenv('ASTRA_CLIENT_ID', 'bbwbJuXJgYKFCyAgwxXUEFSq')
 CLIENT_SECRET = os.getenv('ASTRA_CLIENT_SECRET', '-vgLr+L6nGPMJBudr8Ldf2dQUP.h,2zSwi691,Zdz-BlZg3,ssnIbffUjOuTMe2+48c2oUZ3CZtjyRuTxe_,a7AwBD7gwbLYGZG3XIZ8vd-SGPZdgNZubsySvXa4gZaJ')
 KEYSPACE = os.getenv('ASTRA_KEYSPACE', 'default')
+# 'cassandra' (Astra) or 'memory' (in-process store for load tests and benchmarks)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'cassandra')
+# Backpressure: queries allowed in flight at once, how long a query may wait
+# for a free slot, and the Retry-After sent with the 503 when none frees up
+MAX_IN_FLIGHT_QUERIES = int(os.getenv('MAX_IN_FLIGHT_QUERIES', 256))
+QUERY_QUEUE_TIMEOUT_MS = int(os.getenv('QUERY_QUEUE_TIMEOUT_MS', 50))
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', 1))
+# Requests arriving before the warmup is done wait this long for it, then get a 503
+STARTUP_WAIT_SECONDS = float(os.getenv('STARTUP_WAIT_SECONDS', 5))
+# Transaction table layout: READ_LAYOUT is 'customer' (bank_transactions) or
+# 'month' (bank_transactions_by_month); WRITE_LAYOUT is either of those or
+# 'both' while migrating from one to the other
+READ_LAYOUT = os.getenv('READ_LAYOUT', 'customer')
+WRITE_LAYOUT = os.getenv('WRITE_LAYOUT', 'customer')
+# Read cache: 'local' (per process LRU), 'redis' (shared by replicas, needs REDIS_URL) or 'none'
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'local')
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', 30))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Driver connection options. Pinning the protocol version skips the
+# negotiation round trips on connect; with protocol v3+ the driver keeps one
+# multiplexed connection per host, so concurrency is bounded by
+# MAX_IN_FLIGHT_QUERIES above rather than a connection count.
+CASSANDRA_PROTOCOL_VERSION = os.getenv('CASSANDRA_PROTOCOL_VERSION', '4')
+CASSANDRA_CONNECT_TIMEOUT = float(os.getenv('CASSANDRA_CONNECT_TIMEOUT', 5))
+CASSANDRA_CONTROL_CONNECTION_TIMEOUT = float(os.getenv('CASSANDRA_CONTROL_CONNECTION_TIMEOUT', 2))
+CASSANDRA_EXECUTOR_THREADS = int(os.getenv('CASSANDRA_EXECUTOR_THREADS', 2))
+CASSANDRA_IDLE_HEARTBEAT_INTERVAL = int(os.getenv('CASSANDRA_IDLE_HEARTBEAT_INTERVAL', 30))
+# Schema metadata fetched by the driver: 'full' (every keyspace and table,
+# kept refreshed), 'keyspace' (only KEYSPACE's replication, enough for
+# token-aware routing) or 'none'
+CASSANDRA_SCHEMA_METADATA = os.getenv('CASSANDRA_SCHEMA_METADATA', 'keyspace')
+PREPARE_PARALLELISM = int(os.getenv('PREPARE_PARALLELISM', 8))
+# Load balancing: token-aware over the nodes of CASSANDRA_LOCAL_DC (by
+# default the DC of the contact points)
+CASSANDRA_LOCAL_DC = os.getenv('CASSANDRA_LOCAL_DC') or None
+# Reads of each kind of endpoint run under their own execution profile:
+# point reads (one transaction, a balance), range reads (lists, search,
+# summaries) and exports, each with a client timeout in seconds and a
+# consistency level. Writes use WRITE_TIMEOUT and stay at LOCAL_QUORUM.
+POINT_READ_TIMEOUT = float(os.getenv('POINT_READ_TIMEOUT', 2))
+RANGE_READ_TIMEOUT = float(os.getenv('RANGE_READ_TIMEOUT', 5))
+EXPORT_READ_TIMEOUT = float(os.getenv('EXPORT_READ_TIMEOUT', 30))
+WRITE_TIMEOUT = float(os.getenv('WRITE_TIMEOUT', 10))
+POINT_READ_CONSISTENCY = os.getenv('POINT_READ_CONSISTENCY', 'LOCAL_QUORUM')
+RANGE_READ_CONSISTENCY = os.getenv('RANGE_READ_CONSISTENCY', 'LOCAL_QUORUM')
+EXPORT_CONSISTENCY = os.getenv('EXPORT_CONSISTENCY', 'LOCAL_QUORUM')
+# Point and range reads not answered within SPECULATIVE_DELAY_MS are also
+# sent to the next replica, up to SPECULATIVE_MAX_ATTEMPTS extra times, and
+# the first answer wins (0 disables). READ_RETRY_POLICY is 'default' (the
+# driver's: retry once where it can help) or 'fallthrough' (never retry,
+# leaving the tail to speculation).
+SPECULATIVE_DELAY_MS = float(os.getenv('SPECULATIVE_DELAY_MS', 50))
+SPECULATIVE_MAX_ATTEMPTS = int(os.getenv('SPECULATIVE_MAX_ATTEMPTS', 1))
+READ_RETRY_POLICY = os.getenv('READ_RETRY_POLICY', 'default')
+# Observability: fraction of queries sent with tracing on, and the thresholds
+# above which slow queries (with their trace) and slow requests are logged
+QUERY_TRACE_SAMPLE_RATE = float(os.getenv('QUERY_TRACE_SAMPLE_RATE', 0))
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 500))
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 1000))
+# Batch writes: items accepted per request, and items written per logged batch
+MAX_BATCH_ITEMS = int(os.getenv('MAX_BATCH_ITEMS', 1000))
+BATCH_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', 50))
+# Write sequencer: workers customers are sharded over, transactions one
+# worker commits together at most, writes queued per worker before they get
+# a 503, and how long a committed balance is reused before the next write
+# reads it back
+WRITE_SHARDS = int(os.getenv('WRITE_SHARDS', 16))
+WRITE_GROUP_MAX = int(os.getenv('WRITE_GROUP_MAX', 500))
+WRITE_QUEUE_MAX = int(os.getenv('WRITE_QUEUE_MAX', 1000))
+WRITE_BALANCE_TTL_SECONDS = float(os.getenv('WRITE_BALANCE_TTL_SECONDS', 2))
+# How often a running instance refreshes its api_instances row; the row
+# expires three intervals after the last refresh
+API_HEARTBEAT_SECONDS = float(os.getenv('API_HEARTBEAT_SECONDS', 10))
+# Exports: rows per driver page, partitions read at once for a
+# multi-customer export, and customers one export may ask for
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', 1000))
+EXPORT_CONCURRENCY = int(os.getenv('EXPORT_CONCURRENCY', 4))
+EXPORT_MAX_CUSTOMERS = int(os.getenv('EXPORT_MAX_CUSTOMERS', 1000))
+
+logger = logging.getLogger('bank_api')
 
 app = FastAPI(title="Bank Transactions API")
+app.add_middleware(MetricsMiddleware, slow_request_ms=SLOW_REQUEST_MS)
 
 # Database Connection
 cluster = None
 session = None
+statements = None
+executor = None
+repository = None
+cache = None
+sequencer = None
+# Identical reads in flight at the same time share one database call
+flights = SingleFlight()
+_session_lock = threading.Lock()
+
+# Warmup state reported by /ready: timings in seconds per startup phase
+startup_timings = {}
+warmup_task = None
+warmup_error = None
+ready = False
+# This instance's api_instances row, kept while it serves writes
+INSTANCE_ID = uuid4()
+heartbeat_task = None
+
+def cluster_options():
+    options = {
+        'connect_timeout': CASSANDRA_CONNECT_TIMEOUT,
+        'control_connection_timeout': CASSANDRA_CONTROL_CONNECTION_TIMEOUT,
+        'executor_threads': CASSANDRA_EXECUTOR_THREADS,
+        'idle_heartbeat_interval': CASSANDRA_IDLE_HEARTBEAT_INTERVAL,
+        'schema_metadata_enabled': CASSANDRA_SCHEMA_METADATA == 'full',
+    }
+    if CASSANDRA_PROTOCOL_VERSION != 'auto':
+        options['protocol_version'] = int(CASSANDRA_PROTOCOL_VERSION)
+    return options
+
+def _load_balancing_policy():
+    return TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=CASSANDRA_LOCAL_DC))
+
+READ_RETRY_POLICIES = {'default': RetryPolicy, 'fallthrough': FallthroughRetryPolicy}
+
+def _read_profile(timeout, consistency, speculative):
+    retry_policy = READ_RETRY_POLICIES[READ_RETRY_POLICY]()
+    if speculative and SPECULATIVE_DELAY_MS > 0:
+        speculation = ConstantSpeculativeExecutionPolicy(SPECULATIVE_DELAY_MS / 1000, SPECULATIVE_MAX_ATTEMPTS)
+    else:
+        speculation = None
+    return ExecutionProfile(
+        load_balancing_policy=_load_balancing_policy(),
+        # Wrapped so driver retries show up on /metrics
+        retry_policy=CountingRetryPolicy(retry_policy),
+        consistency_level=ConsistencyLevel.name_to_value[consistency],
+        request_timeout=timeout,
+        row_factory=tuple_factory,
+        speculative_execution_policy=speculation,
+    )
+
+def execution_profiles():
+    # The driver only speculates on statements marked idempotent (see
+    # statements.py); exports are long paged scans and never speculate
+    return {
+        EXEC_PROFILE_DEFAULT: ExecutionProfile(
+            load_balancing_policy=_load_balancing_policy(),
+            retry_policy=CountingRetryPolicy(),
+            consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+            request_timeout=WRITE_TIMEOUT,
+        ),
+        EXEC_PROFILE_POINT_READS: _read_profile(POINT_READ_TIMEOUT, POINT_READ_CONSISTENCY, speculative=True),
+        EXEC_PROFILE_RANGE_READS: _read_profile(RANGE_READ_TIMEOUT, RANGE_READ_CONSISTENCY, speculative=True),
+        EXEC_PROFILE_EXPORTS: _read_profile(EXPORT_READ_TIMEOUT, EXPORT_CONSISTENCY, speculative=False),
+    }
 
 def get_session():
-    global cluster, session
+    global cluster, session, statements
     if session is None:
-        cloud_config = {
-            'secure_connect_bundle': SECURE_CONNECT_BUNDLE
-        }
-        auth_provider = PlainTextAuthProvider(CLIENT_ID, CLIENT_SECRET)
-        cluster = Cluster(cloud=cloud_config, auth_provider=auth_provider)
-        session = cluster.connect()
-        session.set_keyspace(KEYSPACE)
+        # Only called from the warmup thread, never from a request on the event loop
+        with _session_lock:
+            if session is None:
+                start = time.perf_counter()
+                cloud_config = {
+                    'secure_connect_bundle': SECURE_CONNECT_BUNDLE
+                }
+                auth_provider = PlainTextAuthProvider(CLIENT_ID, CLIENT_SECRET)
+                cluster = Cluster(
+                    cloud=cloud_config, auth_provider=auth_provider,
+                    execution_profiles=execution_profiles(), **cluster_options()
+                )
+                try:
+                    new_session = cluster.connect(KEYSPACE, wait_for_all_pools=True)
+                    if CASSANDRA_SCHEMA_METADATA == 'keyspace':
+                        cluster.refresh_keyspace_metadata(KEYSPACE)
+                    startup_timings['connect'] = time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    statements = StatementRegistry(new_session)
+                    statements.configure('select_transactions_range', fetch_size=EXPORT_FETCH_SIZE)
+                    statements.configure('select_bucket_range', fetch_size=EXPORT_FETCH_SIZE)
+                    # Shared with balances.py, which reads it at LOCAL_QUORUM; the API
+                    # reads it at the point-read level, or LOCAL_QUORUM before a write
+                    statements.configure('select_balance', consistency_level=None)
+                    statements.prepare_all(parallelism=PREPARE_PARALLELISM)
+                    startup_timings['prepare'] = time.perf_counter() - start
+                except Exception:
+                    # Don't leak the cluster's threads and connections when the next call retries
+                    cluster.shutdown()
+                    cluster = None
+                    raise
+                session = new_session
     return session
 
+def get_statements():
+    get_session()
+    return statements
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = AsyncExecutor(
+            get_statements(),
+            max_in_flight=MAX_IN_FLIGHT_QUERIES,
+            queue_timeout=QUERY_QUEUE_TIMEOUT_MS / 1000,
+            retry_after=RETRY_AFTER_SECONDS,
+            trace_sample_rate=QUERY_TRACE_SAMPLE_RATE,
+            slow_query_ms=SLOW_QUERY_MS
+        )
+    return executor
+
+def get_repository():
+    global repository
+    if repository is None:
+        if STORAGE_BACKEND == 'memory':
+            repository = InMemoryRepository(page_size=EXPORT_FETCH_SIZE)
+        else:
+            repository = CassandraRepository(get_executor(), read_layout=READ_LAYOUT, write_layout=WRITE_LAYOUT)
+    return repository
+
+def get_cache():
+    global cache
+    if cache is None:
+        if CACHE_BACKEND == 'redis':
+            backend = RedisCache(REDIS_URL)
+        elif CACHE_BACKEND == 'local':
+            backend = LRUCache(max_entries=CACHE_MAX_ENTRIES)
+        else:
+            backend = NullCache()
+        cache = ReadCache(backend, ttl=CACHE_TTL_SECONDS)
+    return cache
+
+def _customer_flight(customer_id):
+    # Flight keys are (kind, customer_id, ...)
+    return lambda key: key[1] == customer_id
+
+async def _writes_committed(customer_id, balance, rows):
+    # Reads still in flight may predate the write, so later ones don't join them
+    flights.forget(_customer_flight(customer_id))
+    await get_cache().customer_written(
+        customer_id, balance, [(row.transaction_id, encode_transaction(row)) for row in rows]
+    )
+
+async def _writes_failed(customer_id):
+    flights.forget(_customer_flight(customer_id))
+    await get_cache().customer_invalidated(customer_id)
+
+def get_sequencer():
+    global sequencer
+    if sequencer is None:
+        sequencer = WriteSequencer(
+            get_repository(),
+            shards=WRITE_SHARDS,
+            max_group=WRITE_GROUP_MAX,
+            chunk_size=BATCH_CHUNK_SIZE,
+            balance_ttl=WRITE_BALANCE_TTL_SECONDS,
+            max_queued=WRITE_QUEUE_MAX,
+            retry_after=RETRY_AFTER_SECONDS,
+            on_commit=_writes_committed,
+            on_failure=_writes_failed
+        )
+    return sequencer
+
+REGISTRY.register(Gauge(
+    'bank_api_startup_seconds', "Time spent per startup phase (connect, prepare, total).",
+    lambda: {(phase,): seconds for phase, seconds in startup_timings.items()},
+    labelnames=('phase',),
+))
+REGISTRY.register(Gauge(
+    'bank_api_queries_in_flight', "CQL queries currently in flight.",
+    lambda: {(): executor.in_flight if executor else 0},
+))
+REGISTRY.register(Gauge(
+    'bank_api_cache_events_total', "Read cache hits, misses, evictions and expirations.",
+    lambda: {(event,): value for event, value in get_cache().stats().items() if event != 'size'},
+    labelnames=('event',), metric_type='counter',
+))
+REGISTRY.register(Gauge(
+    'bank_api_singleflight_calls_total',
+    "Reads that went to the database (leader) or shared an identical read already in flight (merged).",
+    lambda: {**flights.stats(), **(statements.flights.stats() if statements else {})},
+    labelnames=('kind', 'outcome'), metric_type='counter',
+))
+REGISTRY.register(Gauge(
+    'bank_api_cache_entries', "Entries held by the local read cache.",
+    lambda: {(): get_cache().stats()['size']} if 'size' in get_cache().stats() else {},
+))
+
+def warm_up():
+    # Everything the first request would otherwise pay for: connecting,
+    # fetching metadata and preparing every statement
+    start = time.perf_counter()
+    get_repository()
+    get_cache()
+    startup_timings['total'] = time.perf_counter() - start
+
+async def run_warmup():
+    global ready, warmup_error
+    warmup_error = None
+    try:
+        await asyncio.to_thread(warm_up)
+    except Exception as e:
+        warmup_error = f"{type(e).__name__}: {e}"
+        logger.exception("Warmup failed")
+        return
+    ready = True
+    logger.info("Ready: %s", ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in startup_timings.items()))
+    start_heartbeat()
+
+async def heartbeat():
+    # Keeps this instance listed in api_instances while it is up, so
+    # rollups.py and balances.py --fix refuse to run next to it
+    started_at = datetime.now()
+    ttl = int(API_HEARTBEAT_SECONDS * 3)
+    while True:
+        try:
+            await get_executor().execute('upsert_api_instance', (INSTANCE_ID, started_at, datetime.now(), ttl))
+        except Exception:
+            logger.exception("Heartbeat failed")
+        await asyncio.sleep(API_HEARTBEAT_SECONDS)
+
+def start_heartbeat():
+    global heartbeat_task
+    if STORAGE_BACKEND != 'memory' and (heartbeat_task is None or heartbeat_task.done()):
+        heartbeat_task = asyncio.create_task(heartbeat())
+
+def start_warmup():
+    global warmup_task
+    # A task left by another event loop (e.g. a restarted test client) can't be awaited here
+    if warmup_task is None or warmup_task.done() or warmup_task.get_loop() is not asyncio.get_running_loop():
+        warmup_task = asyncio.create_task(run_warmup())
+
+class NotReady(Exception):
+    pass
+
+async def wait_until_ready():
+    # Dependency of every data endpoint: requests that arrive during the
+    # warmup wait for it on the event loop instead of connecting themselves,
+    # and get a 503 if it takes too long or fails
+    if ready:
+        return
+    start_warmup()
+    try:
+        await asyncio.wait_for(asyncio.shield(warmup_task), STARTUP_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        raise NotReady("Starting up")
+    if not ready:
+        raise NotReady(f"Warmup failed: {warmup_error}")
+
 @app.on_event("startup")
 async def startup_event():
-    get_session()
+    # The warmup runs in the background so the port opens right away and
+    # /ready can answer the startup probe while the connection is set up
+    start_warmup()
+
+@app.exception_handler(Saturated)
+async def saturated_handler(request: Request, exc: Saturated):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(NotReady)
+async def not_ready_handler(request: Request, exc: NotReady):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    global cluster
+    global cluster, session, statements, executor, repository, sequencer, warmup_task, heartbeat_task, ready
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    if sequencer:
+        await sequencer.close()
+    if heartbeat_task:
+        heartbeat_task.cancel()
+        try:
+            await executor.execute('delete_api_instance', (INSTANCE_ID,))
+        except Exception:
+            # The row expires on its own
+            logger.exception("Failed to remove the api_instances row")
     if cluster:
         cluster.shutdown()
+    # Everything built on the closed connection goes, so a restarted app connects again
+    cluster = session = statements = executor = repository = sequencer = warmup_task = heartbeat_task = None
+    ready = False
 
 # Pydantic Models
 class Transaction(BaseModel):
@@ -71,143 +455,363 @@ class TransactionCreate(BaseModel):
     description: str
     status: str
 
+class TransactionBatch(BaseModel):
+    transactions: List[TransactionCreate] = Field(..., min_length=1, max_length=MAX_BATCH_ITEMS)
+
+class BatchItemResult(BaseModel):
+    index: int
+    status: str
+    transaction: Optional[Transaction] = None
+    error: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    created: int
+    failed: int
+    balance: Decimal
+    currency: str
+    results: List[BatchItemResult]
+
 class BalanceResponse(BaseModel):
     customer_id: UUID
     balance: Decimal
     currency: str
 
+class SpendingTotal(BaseModel):
+    period: str
+    merchant_name: str
+    transaction_type: str
+    total: Decimal
+    count: int
+
+class SummaryResponse(BaseModel):
+    customer_id: UUID
+    granularity: str
+    total_credits: Decimal
+    total_debits: Decimal
+    totals: List[SpendingTotal]
+
+def transaction_from_row(row):
+    return Transaction(
+        customer_id=row.customer_id,
+        transaction_id=row.transaction_id,
+        amount=row.amount,
+        currency=row.currency,
+        transaction_type=row.transaction_type,
+        merchant_name=row.merchant_name,
+        description=row.description,
+        status=row.status,
+        balance_snapshot=row.balance_snapshot,
+        transaction_timestamp=row.transaction_timestamp
+    )
+
 # Endpoints
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Bank Transactions API"}
 
-@app.get("/customers/{customer_id}/transactions", response_model=List[Transaction])
-def get_customer_transactions(customer_id: UUID):
-    session = get_session()
-    query = """
-    SELECT customer_id, transaction_id, amount, currency, transaction_type, 
-           merchant_name, description, status, balance_snapshot, transaction_timestamp
-    FROM bank_transactions
-    WHERE customer_id = %s
-    """
-    rows = session.execute(query, (customer_id,))
-    
-    transactions = []
-    for row in rows:
-        transactions.append(Transaction(
-            customer_id=row.customer_id,
-            transaction_id=row.transaction_id,
-            amount=row.amount,
-            currency=row.currency,
-            transaction_type=row.transaction_type,
-            merchant_name=row.merchant_name,
-            description=row.description,
-            status=row.status,
-
-            balance_snapshot=row.balance_snapshot,
-            transaction_timestamp=row.transaction_timestamp
-        ))
-    
-    return transactions
-
-@app.get("/customers/{customer_id}/transactions/{transaction_id}", response_model=Transaction)
-def get_transaction(customer_id: UUID, transaction_id: UUID):
-    session = get_session()
-    query = """
-    SELECT customer_id, transaction_id, amount, currency, transaction_type, 
-           merchant_name, description, status, balance_snapshot, transaction_timestamp
-    FROM bank_transactions
-    WHERE customer_id = %s AND transaction_id = %s
-    """
-    row = session.execute(query, (customer_id, transaction_id)).one()
-    
-    if row:
-        return Transaction(
-            customer_id=row.customer_id,
-            transaction_id=row.transaction_id,
-            amount=row.amount,
-            currency=row.currency,
-            transaction_type=row.transaction_type,
-            merchant_name=row.merchant_name,
-            description=row.description,
-            status=row.status,
-            balance_snapshot=row.balance_snapshot,
-            transaction_timestamp=row.transaction_timestamp
-        )
+@app.get("/ready", include_in_schema=False)
+async def readiness():
+    # 200 once connected with every statement prepared; 503 until then.
+    # A failed warmup is retried on the next probe.
+    timings = {phase: round(seconds, 3) for phase, seconds in startup_timings.items()}
+    if ready:
+        return {"status": "ready", "startup_seconds": timings}
+    if warmup_error is not None:
+        content = {"status": "failed", "error": warmup_error}
+        start_warmup()
     else:
-        raise HTTPException(status_code=404, detail="Transaction not found")
-
-@app.get("/customers/{customer_id}/balance", response_model=BalanceResponse)
-def get_customer_balance(customer_id: UUID):
-    session = get_session()
-    query = """
-    SELECT amount, transaction_type, currency
-    FROM bank_transactions
-    WHERE customer_id = %s
-    """
-    rows = session.execute(query, (customer_id,))
-    
-    balance = Decimal(0)
-    currency = "USD" 
-    
-    for row in rows:
-        if row.currency:
-            currency = row.currency
-            
-        t_type = row.transaction_type.upper() if row.transaction_type else 'CREDIT'
-        if t_type == 'CREDIT':
-            balance += row.amount
-        elif t_type == 'DEBIT':
-            balance -= row.amount
-            
+        content = {"status": "starting", "startup_seconds": timings}
+    return JSONResponse(status_code=503, content=content)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# Conditional GETs: list and balance responses carry a strong ETag derived
+# from the customer's newest transaction_id, which customer_balances keeps
+# and every write updates, so a client polling with If-None-Match gets a 304
+# after a single-row read (or none, while the balance is cached) instead of
+# a page read and encoding. Transactions never change, so their own
+# transaction_id is their ETag.
+
+def etag(*parts):
+    return '"' + '-'.join(str(part) for part in parts) + '"'
+
+def not_modified(request, tag):
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return tag in (candidate.strip().removeprefix('W/') for candidate in header.split(','))
+
+async def customer_state(customer_id):
+    # (balance, currency, last_transaction_id): cached, else one single-row read
+    cache = get_cache()
+    key, hit, state = await cache.get_balance(customer_id)
+    if not hit:
+        async def load():
+            state = await get_repository().load_balance(customer_id)
+            await cache.set(key, state)
+            return state
+
+        state = await flights.do(('balance', customer_id), load)
+    return state
+
+def customer_version(state):
+    # The newest transaction_id; None before the customer's first transaction
+    last_transaction_id = state[2]
+    return last_transaction_id.hex if last_transaction_id else 0
+
+async def transaction_page(request, customer_id, kind, params, fetch):
+    # A page response of the list or search endpoint for the cache key params,
+    # with fetch() reading its rows. The version is read before the rows, so
+    # the ETag stored with a page is never newer than the page itself.
+    tag = etag(customer_version(await customer_state(customer_id)))
+    if not_modified(request, tag):
+        return Response(status_code=304, headers={'ETag': tag})
+
+    # Responses are encoded straight from the rows (see encoding.py); the
+    # response_model of the endpoints only documents the format
+    cache = get_cache()
+    key, hit, page = await cache.get_list(customer_id, (kind,) + params)
+    if not hit:
+        async def load():
+            rows, limit = await fetch()
+            with stage('encode'):
+                body = encode_transactions(rows)
+            # transaction_id is the second column
+            next_cursor = encode_cursor(rows[-1][1]) if len(rows) == limit else None
+            await cache.set(key, (body, next_cursor, tag))
+            return body, next_cursor, tag
+
+        page = await flights.do((kind, customer_id) + params, load)
+
+    body, next_cursor, tag = page
+    headers = {'ETag': tag}
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/customers/{customer_id}/transactions", response_model=List[Transaction], dependencies=[Depends(wait_until_ready)])
+async def get_customer_transactions(
+    request: Request,
+    customer_id: UUID,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    # Newest first, one page at a time. When the page is full the cursor for
+    # the next page is returned in the X-Next-Cursor header; pass it back
+    # with the same since/until to continue.
+    try:
+        lower, upper = clustering_bounds(since, until, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def fetch():
+        return await get_repository().list_page(customer_id, lower, upper, limit), limit
+
+    return await transaction_page(request, customer_id, 'transactions', (limit, lower, upper), fetch)
+
+# Declared before the single-transaction route so "search" isn't taken for a transaction_id
+@app.get("/customers/{customer_id}/transactions/search", response_model=List[Transaction], dependencies=[Depends(wait_until_ready)])
+async def search_customer_transactions(
+    request: Request,
+    customer_id: UUID,
+    merchant: Optional[str] = None,
+    description: Optional[str] = None,
+    status: Optional[str] = None,
+    transaction_type: Optional[str] = Query(None, pattern='^(?i:credit|debit)$'),
+    min_amount: Optional[Decimal] = None,
+    max_amount: Optional[Decimal] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    # Matching transactions, newest first and paged like the list endpoint.
+    # merchant and status match case-insensitively, description by word; the
+    # filters and the since/until range are all applied by the database's
+    # indexes rather than by fetching the history.
+    try:
+        lower, upper = clustering_bounds(since, until, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filters = {
+        'merchant_name': merchant,
+        'description': description,
+        'status': status,
+        'transaction_type': transaction_type.upper() if transaction_type else None,
+        'min_amount': min_amount,
+        'max_amount': max_amount,
+    }
+    filters = {field: value for field, value in filters.items() if value is not None}
+
+    async def fetch():
+        repository = get_repository()
+        if filters:
+            return await repository.search(customer_id, lower, upper, filters, limit), limit
+        return await repository.list_page(customer_id, lower, upper, limit), limit
+
+    params = (limit, lower, upper) + tuple(filters.items())
+    return await transaction_page(request, customer_id, 'search', params, fetch)
+
+@app.get("/customers/{customer_id}/transactions/{transaction_id}", response_model=Transaction, dependencies=[Depends(wait_until_ready)])
+async def get_transaction(request: Request, customer_id: UUID, transaction_id: UUID):
+    cache = get_cache()
+    hit, body = await cache.get_transaction(customer_id, transaction_id)
+    if not hit:
+        async def load():
+            row = await get_repository().get(customer_id, transaction_id)
+            if not row:
+                return None
+            with stage('encode'):
+                body = encode_transaction(row)
+            await cache.set_transaction(customer_id, transaction_id, body)
+            return body
+
+        body = await flights.do(('transaction', customer_id, transaction_id), load)
+        if body is None:
+            raise HTTPException(status_code=404, detail="Transaction not found")
+
+    # Transactions never change, but a 304 still needs one that exists and
+    # belongs to the customer, so the tag is only compared after the read
+    tag = etag(transaction_id.hex)
+    if not_modified(request, tag):
+        return Response(status_code=304, headers={'ETag': tag})
+    return Response(content=body, media_type="application/json", headers={'ETag': tag})
+
+@app.get("/customers/{customer_id}/balance", response_model=BalanceResponse, dependencies=[Depends(wait_until_ready)])
+async def get_customer_balance(request: Request, response: Response, customer_id: UUID):
+    state = await customer_state(customer_id)
+    balance, currency, _ = state
+    # The balance is part of the tag too: balances.py --fix can correct it
+    # without a new transaction
+    tag = etag(customer_version(state), balance)
+    if not_modified(request, tag):
+        return Response(status_code=304, headers={'ETag': tag})
+    response.headers['ETag'] = tag
     return BalanceResponse(
         customer_id=customer_id,
         balance=balance,
         currency=currency
     )
 
-@app.post("/customers/{customer_id}/transactions", response_model=Transaction)
-def create_transaction(customer_id: UUID, transaction: TransactionCreate):
-    session = get_session()
-    
-    # Calculate current balance to determine snapshot
-    # We reuse the existing logic to get the current balance
-    current_balance_response = get_customer_balance(customer_id)
-    current_balance = current_balance_response.balance
-    
-    t_type = transaction.transaction_type.upper()
-    if t_type == 'CREDIT':
-        new_balance = current_balance + transaction.amount
-    else:
-        new_balance = current_balance - transaction.amount
-        
-    transaction_id = uuid1()
-    timestamp = datetime.now()
-    
-    query = """
-    INSERT INTO bank_transactions (
-        customer_id, transaction_id, amount, currency, transaction_type, 
-        merchant_name, description, status, balance_snapshot, transaction_timestamp
-    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """
-    
-    session.execute(query, (
-        customer_id, transaction_id, transaction.amount, transaction.currency, 
-        t_type, transaction.merchant_name, transaction.description, 
-        transaction.status, new_balance, timestamp
-    ))
-    
-    return Transaction(
-        customer_id=customer_id,
-        transaction_id=transaction_id,
-        amount=transaction.amount,
-        currency=transaction.currency,
-        transaction_type=t_type,
-        merchant_name=transaction.merchant_name,
-        description=transaction.description,
-        status=transaction.status,
-        balance_snapshot=new_balance,
-        transaction_timestamp=timestamp
+@app.get("/customers/{customer_id}/summary", response_model=SummaryResponse, dependencies=[Depends(wait_until_ready)])
+async def get_customer_summary(
+    customer_id: UUID,
+    granularity: str = Query('month', pattern='^(day|month)$'),
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    merchant: Optional[str] = None,
+):
+    # CREDIT/DEBIT totals per period and merchant, served from the spending
+    # rollups; since/until are inclusive and widen to whole periods
+    lower = period_of(since, granularity) if since else MIN_PERIOD
+    upper = period_of(until, granularity) if until else MAX_PERIOD
+
+    cache = get_cache()
+    key, hit, summary = await cache.get_summary(customer_id, (granularity, lower, upper, merchant))
+    if not hit:
+        async def load():
+            rows = await get_repository().load_rollups(customer_id, granularity, lower, upper)
+            totals = [
+                SpendingTotal(period=period, merchant_name=merchant_name, transaction_type=t_type, total=total, count=count)
+                for period, merchant_name, t_type, total, count in rows
+                if merchant is None or merchant_name == merchant
+            ]
+            summary = SummaryResponse(
+                customer_id=customer_id,
+                granularity=granularity,
+                total_credits=sum((t.total for t in totals if t.transaction_type == 'CREDIT'), Decimal(0)),
+                total_debits=sum((t.total for t in totals if t.transaction_type == 'DEBIT'), Decimal(0)),
+                totals=totals
+            )
+            await cache.set(key, summary)
+            return summary
+
+        summary = await flights.do(('summary', customer_id, granularity, lower, upper, merchant), load)
+    return summary
+
+def export_response(customer_ids, since, until, fmt, gzip, name):
+    # Full history between since and until, newest first within each
+    # customer, streamed page by page and never cached
+    lower, upper = clustering_bounds(since, until, None)
+    media_type, _ = FORMATS[fmt]
+    filename = f"{name}.{fmt}"
+    if gzip:
+        media_type = 'application/gzip'
+        filename += '.gz'
+    body = stream_export(
+        get_repository(), customer_ids, lower, upper,
+        fmt=fmt, compress=gzip, concurrency=EXPORT_CONCURRENCY
+    )
+    return StreamingResponse(
+        body, media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/customers/{customer_id}/export", dependencies=[Depends(wait_until_ready)])
+async def export_customer_transactions(
+    customer_id: UUID,
+    format: str = Query('ndjson', pattern='^(ndjson|csv)$'),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    gzip: bool = False,
+):
+    return export_response([customer_id], since, until, format, gzip, f"transactions-{customer_id}")
+
+@app.get("/export", dependencies=[Depends(wait_until_ready)])
+async def export_transactions(
+    customer_id: List[UUID] = Query(...),
+    format: str = Query('ndjson', pattern='^(ndjson|csv)$'),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    gzip: bool = False,
+):
+    # customer_id is repeated once per customer; they are written in that order
+    customer_ids = list(dict.fromkeys(customer_id))
+    if len(customer_ids) > EXPORT_MAX_CUSTOMERS:
+        raise HTTPException(status_code=400, detail=f"At most {EXPORT_MAX_CUSTOMERS} customers per export")
+    return export_response(customer_ids, since, until, format, gzip, "transactions")
+
+@app.post("/customers/{customer_id}/transactions", response_model=Transaction, dependencies=[Depends(wait_until_ready)])
+async def create_transaction(customer_id: UUID, transaction: TransactionCreate):
+    # Applied by the write sequencer after any earlier writes of the
+    # customer, from the balance they left
+    result = await get_sequencer().submit(customer_id, [transaction])
+    return transaction_from_row(result.rows[0])
+
+@app.post("/customers/{customer_id}/transactions/batch", response_model=BatchResponse, dependencies=[Depends(wait_until_ready)])
+async def create_transactions_batch(customer_id: UUID, batch: TransactionBatch):
+    # Every snapshot is computed from the previous one, in request order,
+    # starting from the balance left by earlier writes. Rows are written in
+    # chunks of BATCH_CHUNK_SIZE, one logged batch each, one chunk after
+    # another: if a chunk fails, it and every later item are reported as
+    # failed and the stored balance is the last written item's snapshot.
+    # Nothing written fails the request as a whole so it can be retried.
+    result = await get_sequencer().submit(customer_id, batch.transactions)
+    rows, written = result.rows, result.written
+    error = f"{type(result.error).__name__}: {result.error}" if result.error else None
+
+    results = [
+        BatchItemResult(index=i, status='created', transaction=transaction_from_row(row))
+        for i, row in enumerate(rows[:written])
+    ]
+    results.extend(
+        BatchItemResult(index=i, status='failed', error=error)
+        for i in range(written, len(rows))
+    )
+    return BatchResponse(
+        created=written,
+        failed=len(rows) - written,
+        balance=rows[written - 1].balance_snapshot,
+        currency=result.currency,
+        results=results
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import random
+import time
+
+from metrics import PROFILE_LATENCY, QUERY_ERRORS, QUERY_EXTRA_ATTEMPTS, QUERY_LATENCY, QUERY_ROWS, add_stage
+
+# asyncio adapter over the driver's execute_async(). The driver resolves a
+# ResponseFuture on its own event thread; callbacks hand the rows back to the
+# asyncio loop, so handlers await queries without pinning a worker thread.
+# The number of queries in flight is bounded: when the limit is reached a
+# query waits up to queue_timeout for a slot and then fails with Saturated,
+# which the API turns into a 503 with Retry-After.
+
+logger = logging.getLogger('bank_api.db')
+
+
+class Saturated(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Too many requests in flight")
+        self.retry_after = retry_after
+
+
+class _AsyncResponse:
+    # Wraps one ResponseFuture. The driver keeps registered callbacks for
+    # every page it fetches, so they are added once and each page gets a
+    # fresh asyncio future to resolve.
+
+    def __init__(self, response_future, loop, profile='default'):
+        self.response_future = response_future
+        self.profile = profile
+        self._loop = loop
+        self._waiter = loop.create_future()
+        self.traced = False
+        # Hosts tried so far, so each page's extra attempts can be counted
+        self.attempts = 0
+        response_future.add_callbacks(self._on_result, self._on_error)
+
+    def _on_result(self, rows):
+        self._loop.call_soon_threadsafe(self._resolve, rows, None)
+
+    def _on_error(self, exc):
+        self._loop.call_soon_threadsafe(self._resolve, None, exc)
+
+    def _resolve(self, rows, exc):
+        if self._waiter.done():
+            return
+        if exc is not None:
+            self._waiter.set_exception(exc)
+        else:
+            self._waiter.set_result(rows)
+
+    def page(self):
+        return self._waiter
+
+    @property
+    def has_more_pages(self):
+        return self.response_future.has_more_pages
+
+    def fetch_next_page(self):
+        self._waiter = self._loop.create_future()
+        self.response_future.start_fetching_next_page()
+        return self._waiter
+
+
+class AsyncExecutor:
+    def __init__(self, statements, max_in_flight=256, queue_timeout=0.05, retry_after=1,
+                 trace_sample_rate=0.0, slow_query_ms=None):
+        self.statements = statements
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        # A sampled fraction of queries is sent with tracing on; the trace of
+        # those slower than slow_query_ms is fetched and logged
+        self.trace_sample_rate = trace_sample_rate
+        self.slow_query_ms = slow_query_ms
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    async def _acquire(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise Saturated(self.retry_after)
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def _start(self, statement, kwargs):
+        traced = bool(self.trace_sample_rate) and random.random() < self.trace_sample_rate
+        if traced:
+            kwargs = dict(kwargs, trace=True)
+        response_future = self.statements.session.execute_async(statement, **kwargs)
+        profile = kwargs.get('execution_profile')
+        response = _AsyncResponse(
+            response_future, asyncio.get_running_loop(),
+            profile if isinstance(profile, str) else 'default'
+        )
+        response.traced = traced
+        return response
+
+    async def _wait(self, response, waiter, label):
+        # Awaits one page, recording latency, rows and errors for the statement
+        start = time.perf_counter()
+        try:
+            rows = await waiter
+        except Exception as e:
+            QUERY_ERRORS.inc(label, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            QUERY_LATENCY.observe(elapsed, label)
+            PROFILE_LATENCY.observe(elapsed, response.profile)
+            add_stage('database', elapsed)
+            attempts = len(response.response_future.attempted_hosts)
+            if attempts > response.attempts + 1:
+                QUERY_EXTRA_ATTEMPTS.inc(response.profile, amount=attempts - response.attempts - 1)
+            response.attempts = attempts
+        QUERY_ROWS.observe(len(rows), label)
+        if (response.traced and self.slow_query_ms is not None
+                and elapsed * 1000 >= self.slow_query_ms):
+            asyncio.get_running_loop().create_task(self._log_trace(response.response_future, label, elapsed))
+        return rows
+
+    async def _log_trace(self, response_future, label, elapsed):
+        try:
+            # Fetching the trace polls system_traces with blocking reads
+            trace = await asyncio.to_thread(response_future.get_query_trace, 2.0)
+        except Exception as e:
+            logger.warning("Slow query %s (%.1f ms), trace unavailable: %s", label, elapsed * 1000, e)
+            return
+        events = '; '.join(
+            f"{event.source_elapsed} {event.source}: {event.description}" for event in trace.events
+        )
+        logger.warning(
+            "Slow query %s (%.1f ms) coordinator %s duration %s: %s",
+            label, elapsed * 1000, trace.coordinator, trace.duration, events
+        )
+
+    async def execute_statement(self, statement, label='statement', **kwargs):
+        # First page of rows for an already bound (or batch) statement
+        await self._acquire()
+        try:
+            response = self._start(statement, kwargs)
+            return await self._wait(response, response.page(), label)
+        finally:
+            self._release()
+
+    async def execute(self, name, params=(), **kwargs):
+        return await self.execute_statement(self.statements.bind(name, params), label=name, **kwargs)
+
+    async def execute_one(self, name, params=(), **kwargs):
+        rows = await self.execute(name, params, **kwargs)
+        return rows[0] if rows else None
+
+    async def pages(self, name, params=(), **kwargs):
+        # Yields one page of rows at a time; a slot is held only while a page is being fetched
+        await self._acquire()
+        try:
+            response = self._start(self.statements.bind(name, params), kwargs)
+            rows = await self._wait(response, response.page(), name)
+        finally:
+            self._release()
+        yield rows
+
+        while response.has_more_pages:
+            await self._acquire()
+            try:
+                rows = await self._wait(response, response.fetch_next_page(), name)
+            finally:
+                self._release()
+            yield rows
+
+    async def fetch_all(self, name, params=(), **kwargs):
+        rows = []
+        async for page in self.pages(name, params, **kwargs):
+            rows.extend(page)
+        return rows
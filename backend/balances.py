@@ -0,0 +1,159 @@
+import argparse
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+
+from cassandra.concurrent import execute_concurrent_with_args
+
+from history import scan_histories
+from paging import timeuuid_key
+from statements import StatementRegistry
+
+# fixed: whether --fix replaced the stored balance; False when fixing was
+# not asked for or a transaction was written in the meantime
+Drift = namedtuple('Drift', ['customer_id', 'stored', 'computed', 'currency', 'fixed'], defaults=(False,))
+
+
+def sum_transactions(rows):
+    # Balance as the API defines it: CREDITs minus DEBITs over the whole history.
+    # Returns (balance, currency, newest transaction_id); rows arrive newest first.
+    balance = Decimal(0)
+    currency = "USD"
+    last_transaction_id = None
+
+    for row in rows:
+        if last_transaction_id is None:
+            last_transaction_id = row.transaction_id
+        if row.currency:
+            currency = row.currency
+
+        t_type = row.transaction_type.upper() if row.transaction_type else 'CREDIT'
+        if t_type == 'CREDIT':
+            balance += row.amount
+        elif t_type == 'DEBIT':
+            balance -= row.amount
+
+    return balance, currency, last_transaction_id
+
+
+def _newer(transaction_id, than):
+    if transaction_id is None:
+        return False
+    return than is None or timeuuid_key(transaction_id) > timeuuid_key(than)
+
+
+def _check_chunk(statements, chunk, fix, concurrency, report):
+    # Returns how many customers were skipped because they were written after their history was scanned
+    stored = execute_concurrent_with_args(
+        statements.session, statements.get('select_balance'),
+        [(customer_id,) for customer_id, _ in chunk],
+        concurrency=concurrency, raise_on_first_error=True
+    )
+    skipped = 0
+    drifts = []
+    inserts = []
+    updates = []
+    for (customer_id, (balance, currency, last_transaction_id)), (_, rows) in zip(chunk, stored):
+        row = rows.one()
+        if row is not None:
+            if _newer(row.last_transaction_id, last_transaction_id):
+                # The scan and this read aren't atomic: the stored balance
+                # includes transactions the scan didn't see
+                skipped += 1
+                continue
+            if row.balance == balance and row.last_transaction_id == last_transaction_id:
+                continue
+        drift = Drift(customer_id, row.balance if row else None, balance, currency)
+        if row is None:
+            inserts.append((drift, (customer_id, balance, currency, last_transaction_id, datetime.now())))
+        else:
+            updates.append((drift, (balance, currency, last_transaction_id, datetime.now(), customer_id, row.last_transaction_id)))
+        drifts.append(drift)
+
+    if not fix:
+        report.extend(drifts)
+        return skipped
+
+    # Conditional writes catch a transaction committed since the read above
+    # by a writer that is still running. They don't make fixing safe next to
+    # the API: its balance writes are plain upserts, and Cassandra doesn't
+    # order LWTs against plain writes to the same row.
+    applied = {}
+    for name, writes in (('insert_balance_if_missing', inserts), ('update_balance_if_unchanged', updates)):
+        if not writes:
+            continue
+        results = execute_concurrent_with_args(
+            statements.session, statements.get(name), [params for _, params in writes],
+            concurrency=concurrency, raise_on_first_error=True
+        )
+        for (drift, _), (_, result) in zip(writes, results):
+            applied[drift.customer_id] = result.was_applied
+    report.extend(drift._replace(fixed=applied[drift.customer_id]) for drift in drifts)
+    return skipped
+
+
+def reconcile(statements, customer_ids=None, fix=False, concurrency=50, chunk_size=500):
+    """Recompute balances from transaction history and compare them with customer_balances.
+
+    Scans the given customers, or the whole table when ``customer_ids`` is None.
+    Returns the list of customers whose stored balance or last_transaction_id
+    is missing or different; with ``fix=True`` the stored balance is replaced
+    with the computed one unless a transaction was written in the meantime.
+    Customers written after their history was scanned are skipped. Fix only
+    while writes are stopped; the command line refuses while the API is up.
+    """
+    computed = scan_histories(
+        statements, 'select_all_balance_rows', 'select_balance_rows', sum_transactions,
+        customer_ids, concurrency
+    )
+
+    report = []
+    checked = 0
+    skipped = 0
+    chunk = []
+    for entry in computed:
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            skipped += _check_chunk(statements, chunk, fix, concurrency, report)
+            checked += len(chunk)
+            chunk = []
+    if chunk:
+        skipped += _check_chunk(statements, chunk, fix, concurrency, report)
+        checked += len(chunk)
+
+    print(f"Checked {checked} customers, {len(report)} with balance drift, "
+          f"{skipped} skipped because they were written during the check.")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute customer balances from transaction history and report drift.")
+    parser.add_argument('--customer', action='append', help="Customer ID to check (repeatable). Defaults to all customers.")
+    parser.add_argument('--fix', action='store_true',
+                        help="Overwrite drifted balances with the recomputed value. Only while writes are stopped: "
+                             "refuses to run while API instances are up.")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--force', action='store_true', help="Fix even though API instances are up.")
+    args = parser.parse_args()
+
+    # insert_transactions imports this module, so its connection helper is imported here
+    from insert_transactions import KEYSPACE, create_connection, live_api_instances, require_customer_layout
+
+    require_customer_layout()
+    cluster, session = create_connection(KEYSPACE)
+    try:
+        statements = StatementRegistry(session)
+        if args.fix and not args.force:
+            live = live_api_instances(statements)
+            if live:
+                parser.error(f"{len(live)} API instance(s) are running; stop writes before --fix (or pass --force).")
+        customer_ids = [uuid.UUID(c) for c in args.customer] if args.customer else None
+        drifts = reconcile(statements, customer_ids, fix=args.fix, concurrency=args.concurrency)
+        for drift in drifts:
+            print(f"{drift.customer_id}: stored={drift.stored} computed={drift.computed} {drift.currency}")
+        if args.fix and drifts:
+            fixed = sum(drift.fixed for drift in drifts)
+            print(f"Fixed {fixed} balances; {len(drifts) - fixed} were written during the fix, run again to check them.")
+    finally:
+        cluster.shutdown()
@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+from insert_transactions import generate_transactions
+from metrics import REQUEST_LATENCY
+from stats import LatencyRecorder
+
+# Load generator for the Bank Transactions API.
+#
+# By default the API runs in process on the in-memory storage backend,
+# seeded with generate_transactions() partitions of the requested sizes, so
+# the numbers are API overhead only. It is served by uvicorn on a thread
+# with its own event loop, so client latencies don't include time spent
+# queued behind the load generator on a shared loop; the handler times the
+# metrics middleware measured are reported next to them. With --url it
+# drives a running server instead (pass the customers to use with
+# --customer).
+#
+#   python benchmark.py --mix list-heavy --partition-sizes 100,10000 --output before.json
+
+MIXES = {
+    # operation -> weight
+    'list-heavy': {'list': 80, 'get': 10, 'balance': 10},
+    'balance-heavy': {'balance': 80, 'list': 10, 'get': 10},
+    'write-burst': {'create': 100},
+}
+
+
+def _percentiles_ms(recorder):
+    p = recorder.percentiles((50, 95, 99))
+    return {f'p{k}': round(v * 1000, 3) for k, v in p.items()}
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Workload:
+    def __init__(self, mix, customers, transaction_ids, seed):
+        self.weights = MIXES[mix]
+        self.customers = customers
+        self.transaction_ids = transaction_ids
+        self.rng = random.Random(seed)
+        # Writes all go to one hot customer
+        self.hot_customer = customers[0]
+
+    def next_request(self):
+        op = self.rng.choices(list(self.weights), weights=list(self.weights.values()))[0]
+        customer_id = self.rng.choice(self.customers)
+        if op == 'list':
+            return op, 'GET', f'/customers/{customer_id}/transactions', None
+        if op == 'get':
+            transaction_id = self.rng.choice(self.transaction_ids[customer_id])
+            return op, 'GET', f'/customers/{customer_id}/transactions/{transaction_id}', None
+        if op == 'balance':
+            return op, 'GET', f'/customers/{customer_id}/balance', None
+        body = {
+            'amount': f"{self.rng.uniform(1, 200):.2f}",
+            'currency': 'USD',
+            'transaction_type': self.rng.choice(['CREDIT', 'DEBIT']),
+            'merchant_name': 'Benchmark',
+            'description': 'Benchmark write',
+            'status': 'COMPLETED',
+        }
+        return op, 'POST', f'/customers/{self.hot_customer}/transactions', body
+
+
+async def run_load(client, workload, requests, concurrency):
+    latencies = {op: LatencyRecorder() for op in workload.weights}
+    errors = {op: 0 for op in workload.weights}
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            op, method, path, body = workload.next_request()
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies[op].record(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors[op] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': requests,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 1),
+        'operations': {
+            op: {
+                'count': latencies[op].count,
+                'errors': errors[op],
+                'mean_ms': round(latencies[op].mean * 1000, 3),
+                **_percentiles_ms(latencies[op]),
+            }
+            for op in workload.weights
+        },
+    }
+
+
+async def measure_allocations(client, workload, requests):
+    # Sequential pass under tracemalloc: peak bytes allocated while serving one request
+    peaks = {op: [] for op in workload.weights}
+    tracemalloc.start()
+    try:
+        for _ in range(requests):
+            op, method, path, body = workload.next_request()
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await client.request(method, path, json=body)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks[op].append(peak - before)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        op: {'peak_bytes_per_request': int(sum(peaks[op]) / len(peaks[op])) if peaks[op] else 0}
+        for op in workload.weights
+    }
+
+
+def seed_in_process(customers_count, partition_size, seed):
+    # Importing api after setting STORAGE_BACKEND keeps it off the network
+    import api
+
+    random.seed(seed)
+    customers = [uuid.UUID(int=random.getrandbits(128), version=4) for _ in range(customers_count)]
+    repository = api.get_repository()
+    repository.bulk_load(generate_transactions(customers, partition_size))
+    transaction_ids = {customer_id: repository.transaction_ids(customer_id) for customer_id in customers}
+    return api.app, customers, transaction_ids
+
+
+class ServerThread:
+    """Serves app with uvicorn on 127.0.0.1 from a thread with its own event loop."""
+
+    def __init__(self, app):
+        import uvicorn
+
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level='warning', access_log=False))
+        self.socket = socket.socket()
+        # Accepted connections inherit this; without it Nagle's algorithm adds ~40ms per response
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.bind(('127.0.0.1', 0))
+        self.url = 'http://127.0.0.1:%d' % self.socket.getsockname()[1]
+        self.thread = threading.Thread(target=self.server.run, kwargs={'sockets': [self.socket]}, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("The API server failed to start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+        self.socket.close()
+
+
+def server_timings(before, after):
+    # Mean handler time per route from the API's request latency histogram,
+    # over the requests served between the two totals() snapshots
+    timings = {}
+    for (method, route, status), (total, count) in sorted(after.items()):
+        prev_total, prev_count = before.get((method, route, status), (0.0, 0))
+        if count > prev_count:
+            timings[f'{method} {route} {status}'] = {
+                'count': count - prev_count,
+                'mean_ms': round((total - prev_total) / (count - prev_count) * 1000, 3),
+            }
+    return timings
+
+
+async def discover(client, customers):
+    transaction_ids = {}
+    for customer_id in customers:
+        response = await client.get(f'/customers/{customer_id}/transactions')
+        response.raise_for_status()
+        transaction_ids[customer_id] = [t['transaction_id'] for t in response.json()]
+    return transaction_ids
+
+
+async def run_scenario(args, partition_size, url, customers, transaction_ids=None):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        if transaction_ids is None:
+            transaction_ids = await discover(client, customers)
+        workload = Workload(args.mix, customers, transaction_ids, args.seed)
+        if args.warmup:
+            await run_load(client, workload, args.warmup, args.concurrency)
+
+        before = REQUEST_LATENCY.totals()
+        result = await run_load(client, workload, args.requests, args.concurrency)
+        if not args.url:
+            result['server'] = server_timings(before, REQUEST_LATENCY.totals())
+        if args.allocations and not args.url:
+            # tracemalloc is process-wide, so this includes the server thread
+            result['allocations'] = await measure_allocations(client, workload, args.allocations)
+
+    result['partition_size'] = partition_size
+    return result
+
+
+def run_in_process(args, partition_size):
+    app, customers, transaction_ids = seed_in_process(args.customers, partition_size, args.seed)
+    with ServerThread(app) as server:
+        return asyncio.run(run_scenario(args, partition_size, server.url, customers, transaction_ids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Bank Transactions API.")
+    parser.add_argument('--mix', choices=sorted(MIXES), default='list-heavy')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--customers', type=int, default=10, help="Customers to seed (in-process mode).")
+    parser.add_argument('--partition-sizes', default='100,1000',
+                        help="Comma-separated transactions per customer; one run per size (in-process mode).")
+    parser.add_argument('--allocations', type=int, default=200,
+                        help="Requests to replay under tracemalloc after the timed run (0 to skip).")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--url', help="Benchmark a running server instead of the in-process API.")
+    parser.add_argument('--customer', action='append', default=[], help="Customer ID to use with --url (repeatable).")
+    parser.add_argument('--output', help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    if args.url and not args.customer:
+        parser.error("--url requires at least one --customer")
+    if not args.url:
+        os.environ['STORAGE_BACKEND'] = 'memory'
+
+    sizes = [None] if args.url else [int(s) for s in args.partition_sizes.split(',')]
+    runs = []
+    for partition_size in sizes:
+        print(f"Running {args.mix} with partition size {partition_size}...", file=sys.stderr)
+        if args.url:
+            customers = [uuid.UUID(c) for c in args.customer]
+            runs.append(asyncio.run(run_scenario(args, partition_size, args.url, customers)))
+        else:
+            runs.append(run_in_process(args, partition_size))
+            # Next size gets a fresh in-memory store and cache
+            import api
+            api.repository = None
+            api.cache = None
+            api.sequencer = None
+
+    results = {
+        'benchmark': 'bank-transactions-api',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_revision': _git_revision(),
+        'python': sys.version.split()[0],
+        'config': {
+            'mix': args.mix,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'target': args.url or 'in-process',
+            'customers': len(args.customer) if args.url else args.customers,
+            'cache_backend': os.getenv('CACHE_BACKEND', 'local'),
+            'seed': args.seed,
+        },
+        'runs': runs,
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
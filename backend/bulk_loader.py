@@ -0,0 +1,131 @@
+import threading
+import time
+
+from cassandra.query import BatchStatement, BatchType
+
+from stats import LatencyRecorder
+
+
+class BulkLoader:
+    """Writes a stream of rows with a bounded number of async requests in flight.
+
+    ``rows`` are parameter tuples for one prepared statement whose first
+    parameter is the partition key. With ``batch_size`` > 1, consecutive rows
+    of the same partition are grouped into UNLOGGED batches (single-partition
+    batches are applied as one mutation, so they are cheap for the
+    coordinator). Failed writes are retried with exponential backoff; the
+    writes are idempotent since every row carries its own primary key.
+    """
+
+    def __init__(self, session, statement, concurrency=100, batch_size=1,
+                 max_retries=3, retry_backoff=0.1, report_interval=5.0):
+        self.session = session
+        self.statement = statement
+        self.concurrency = concurrency
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.report_interval = report_interval
+
+        self.latency = LatencyRecorder()
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.retries = 0
+        self.errors = []
+
+        self._slots = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._done = threading.Condition(self._lock)
+        self._started = None
+        self._last_report = None
+
+    def load(self, rows):
+        self._started = self._last_report = time.perf_counter()
+        for group in self._group(rows):
+            self._slots.acquire()
+            with self._lock:
+                self._pending += 1
+            self._submit(group, attempt=0)
+            self._maybe_report()
+
+        with self._done:
+            while self._pending:
+                self._done.wait(self.report_interval)
+                if self._pending:
+                    self._report()
+        self._report(final=True)
+        return self
+
+    def _group(self, rows):
+        group = []
+        for row in rows:
+            if group and (len(group) >= self.batch_size or row[0] != group[0][0]):
+                yield group
+                group = []
+            group.append(row)
+        if group:
+            yield group
+
+    def _build(self, group):
+        if len(group) == 1:
+            return self.statement.bind(group[0])
+        batch = BatchStatement(batch_type=BatchType.UNLOGGED, consistency_level=self.statement.consistency_level)
+        for row in group:
+            batch.add(self.statement, row)
+        return batch
+
+    def _submit(self, group, attempt):
+        start = time.perf_counter()
+        future = self.session.execute_async(self._build(group))
+        future.add_callbacks(
+            self._on_success, self._on_error,
+            callback_args=(group, start), errback_args=(group, attempt)
+        )
+
+    def _on_success(self, _, group, start):
+        self.latency.record(time.perf_counter() - start)
+        with self._lock:
+            self.rows_written += len(group)
+        self._finish()
+
+    def _on_error(self, exc, group, attempt):
+        if attempt < self.max_retries:
+            with self._lock:
+                self.retries += 1
+            # Retry off the driver's event thread; the slot stays held meanwhile
+            timer = threading.Timer(self.retry_backoff * (2 ** attempt), self._submit, (group, attempt + 1))
+            timer.daemon = True
+            timer.start()
+            return
+        with self._lock:
+            self.rows_failed += len(group)
+            if len(self.errors) < 10:
+                self.errors.append(exc)
+        self._finish()
+
+    def _finish(self):
+        self._slots.release()
+        with self._done:
+            self._pending -= 1
+            if not self._pending:
+                self._done.notify_all()
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.perf_counter() - self._started
+        return self.rows_written / elapsed if elapsed > 0 else 0.0
+
+    def _maybe_report(self):
+        if time.perf_counter() - self._last_report >= self.report_interval:
+            self._report()
+
+    def _report(self, final=False):
+        self._last_report = time.perf_counter()
+        p = self.latency.percentiles()
+        prefix = "Loaded" if final else "Inserted"
+        print(
+            f"{prefix} {self.rows_written} rows ({self.rows_per_second:.0f} rows/sec, "
+            f"p50 {p[50] * 1000:.1f} ms, p95 {p[95] * 1000:.1f} ms, p99 {p[99] * 1000:.1f} ms, "
+            f"{self.retries} retries, {self.rows_failed} failed)"
+        )
@@ -0,0 +1,216 @@
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Read-through cache for the transaction and balance endpoints.
+#
+# Backends implement a small async key/value interface so the same
+# ReadCache works against an in-process LRU or a store shared by several
+# replicas (Redis). Entries of a customer's transaction lists, summaries and
+# balance embed the customer's cache generation, so a write invalidates all
+# of them by replacing one key. A write stores its new balance under a fresh
+# generation; a read that was in flight during the write stores what it read
+# under the old one, where nobody looks any more. Single transactions never
+# change once written.
+
+
+class CacheBackend:
+    async def get(self, key):
+        # Returns (hit, value)
+        raise NotImplementedError
+
+    async def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+    async def add(self, key, value, ttl):
+        # Stores value unless the key is already set; returns the value the key holds
+        hit, current = await self.get(key)
+        if hit:
+            return current
+        await self.set(key, value, ttl)
+        return value
+
+    def stats(self):
+        return {}
+
+
+class NullCache(CacheBackend):
+    # Used when caching is disabled: every read is a miss
+    async def get(self, key):
+        return False, None
+
+    async def set(self, key, value, ttl):
+        pass
+
+    async def delete(self, key):
+        pass
+
+    async def add(self, key, value, ttl):
+        return value
+
+
+class LRUCache(CacheBackend):
+    """Bounded in-process LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    async def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    async def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    async def add(self, key, value, ttl):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= time.monotonic():
+                return entry[0]
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return value
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'size': len(self._entries),
+        }
+
+
+class RedisCache(CacheBackend):
+    """Cache shared between replicas. Requires the optional ``redis`` package."""
+
+    def __init__(self, url, prefix='bank-api:'):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package (pip install redis)")
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return self.prefix + ':'.join(str(part) for part in key)
+
+    async def get(self, key):
+        raw = await self.client.get(self._key(key))
+        if raw is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, pickle.loads(raw)
+
+    async def set(self, key, value, ttl):
+        await self.client.set(self._key(key), pickle.dumps(value), px=int(ttl * 1000))
+
+    async def delete(self, key):
+        await self.client.delete(self._key(key))
+
+    async def add(self, key, value, ttl):
+        if await self.client.set(self._key(key), pickle.dumps(value), px=int(ttl * 1000), nx=True):
+            return value
+        raw = await self.client.get(self._key(key))
+        # Expired in between: fall back to the caller's value
+        return pickle.loads(raw) if raw is not None else value
+
+    def stats(self):
+        # Evictions happen inside Redis and are reported by its own INFO stats
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class ReadCache:
+    def __init__(self, backend, ttl=30.0):
+        self.backend = backend
+        self.ttl = ttl
+
+    async def _generation(self, customer_id):
+        key = ('generation', customer_id)
+        hit, generation = await self.backend.get(key)
+        if not hit:
+            # A fresh random generation makes any surviving entries unreachable.
+            # Set only if absent, so a write's generation is never replaced.
+            generation = await self.backend.add(key, uuid.uuid4().hex, self.ttl * 2)
+        return generation
+
+    async def _get_generational(self, kind, customer_id, params):
+        generation = await self._generation(customer_id)
+        key = (kind, customer_id, generation) + tuple(params)
+        hit, value = await self.backend.get(key)
+        return key, hit, value
+
+    async def get_list(self, customer_id, params):
+        return await self._get_generational('transactions', customer_id, params)
+
+    async def get_summary(self, customer_id, params):
+        # Summaries are derived from the whole history, so they go stale with the lists
+        return await self._get_generational('summary', customer_id, params)
+
+    async def get_transaction(self, customer_id, transaction_id):
+        return await self.backend.get(('transaction', customer_id, transaction_id))
+
+    async def set_transaction(self, customer_id, transaction_id, value):
+        await self.backend.set(('transaction', customer_id, transaction_id), value, self.ttl)
+
+    async def get_balance(self, customer_id):
+        # Returns (key, hit, value); store a value read on a miss with set(key, value)
+        return await self._get_generational('balance', customer_id, ())
+
+    async def set(self, key, value):
+        await self.backend.set(key, value, self.ttl)
+
+    async def customer_written(self, customer_id, balance, transactions=()):
+        # Called after a write: the customer moves to a new generation holding
+        # the new balance, so every cached list and older balance goes stale,
+        # and the new (transaction_id, value) entries are cached
+        generation = uuid.uuid4().hex
+        await self.backend.set(('balance', customer_id, generation), balance, self.ttl)
+        await self.backend.set(('generation', customer_id), generation, self.ttl * 2)
+        for transaction_id, value in transactions:
+            await self.set_transaction(customer_id, transaction_id, value)
+
+    async def customer_invalidated(self, customer_id):
+        # For writes whose outcome is unknown: drop the balance and the lists
+        await self.backend.delete(('generation', customer_id))
+
+    def stats(self):
+        return self.backend.stats()
@@ -11,11 +11,16 @@ echo "Deploying to Project: $PROJECT_ID"
 gcloud builds submit --tag gcr.io/$PROJECT_ID/$APP_NAME
 
 # Deploy to Cloud Run using env_vars.yaml to avoid special character issues
+# (CPU boost speeds up the connection warmup on cold starts; the startup
+# probe keeps traffic away from an instance until /ready answers 200, for up
+# to 60s before the instance is restarted)
 gcloud run deploy $APP_NAME \
   --image gcr.io/$PROJECT_ID/$APP_NAME \
   --platform managed \
   --region $REGION \
   --allow-unauthenticated \
+  --cpu-boost \
+  --startup-probe httpGet.path=/ready,initialDelaySeconds=0,periodSeconds=2,timeoutSeconds=1,failureThreshold=30 \
   --env-vars-file env_vars.yaml
 
 echo "Deployment complete."
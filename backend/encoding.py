@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+from repository import TRANSACTION_FIELDS
+
+# Fast path for transaction responses: rows (tuples in TRANSACTION_FIELDS
+# order, as returned by the repository) are encoded straight to JSON bytes,
+# without building a Transaction model per row or re-validating the list
+# against the response model. The output is byte-for-byte what FastAPI
+# produces for the Transaction model: UUIDs and Decimals as strings,
+# datetimes in ISO 8601.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(content):
+        # orjson encodes UUID and datetime natively; Decimal goes through str()
+        return orjson.dumps(content, default=str)
+else:
+    def dumps(content):
+        return json.dumps(
+            content, default=_default, ensure_ascii=False, allow_nan=False, separators=(',', ':')
+        ).encode('utf-8')
+
+
+def encode_transaction(row):
+    return dumps(dict(zip(TRANSACTION_FIELDS, row)))
+
+
+def encode_transactions(rows):
+    return dumps([dict(zip(TRANSACTION_FIELDS, row)) for row in rows])
+
+
+def encode_ndjson(rows):
+    # One JSON object per line, same fields and formats as the API responses
+    return b''.join(dumps(dict(zip(TRANSACTION_FIELDS, row))) + b'\n' for row in rows)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+CSV_HEADER = (','.join(TRANSACTION_FIELDS) + '\r\n').encode('utf-8')
+
+
+def encode_csv(rows):
+    # Rows only; CSV_HEADER goes once at the top of the file
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode('utf-8')
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import zlib
+
+from encoding import CSV_HEADER, encode_csv, encode_ndjson
+from metrics import stage
+
+# Streaming exports of transaction history. Rows are read one driver page at
+# a time and written out as soon as they are encoded, so an export of years
+# of history holds a few pages in memory rather than the whole result.
+#
+# Multi-customer exports read up to `concurrency` partitions at once. Each
+# partition being read has a small queue of pages in front of it and the
+# output is written customer by customer, in the order requested: a
+# partition that is ahead of the writer waits on its full queue instead of
+# buffering.
+
+logger = logging.getLogger('bank_api.export')
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', encode_ndjson),
+    'csv': ('text/csv; charset=utf-8', encode_csv),
+}
+
+# Pages buffered per partition being read
+QUEUE_PAGES = 2
+
+_DONE = object()
+
+
+async def _read_partition(repository, customer_id, lower, upper, queue):
+    try:
+        async for page in repository.iter_pages(customer_id, lower, upper):
+            await queue.put(page)
+    except Exception as e:
+        await queue.put(e)
+        return
+    await queue.put(_DONE)
+
+
+async def iter_rows(repository, customer_ids, lower, upper, concurrency=4):
+    """Yield pages of rows for each customer in turn, newest first within a customer."""
+    pending = list(customer_ids)
+    reading = []
+
+    def start_next():
+        customer_id = pending.pop(0)
+        queue = asyncio.Queue(maxsize=QUEUE_PAGES)
+        task = asyncio.create_task(_read_partition(repository, customer_id, lower, upper, queue))
+        reading.append((customer_id, queue, task))
+
+    try:
+        while pending and len(reading) < concurrency:
+            start_next()
+        while reading:
+            customer_id, queue, task = reading[0]
+            while True:
+                page = await queue.get()
+                if page is _DONE:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+            reading.pop(0)
+            if pending:
+                start_next()
+    finally:
+        # The client went away or a read failed: stop the partitions still being read
+        for _, _, task in reading:
+            task.cancel()
+
+
+async def stream_export(repository, customer_ids, lower, upper, fmt='ndjson', compress=False, concurrency=4):
+    """Yield the encoded export as byte chunks, gzip-compressed when compress is set."""
+    _, encode = FORMATS[fmt]
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def output(chunk):
+        return compressor.compress(chunk) if compressor else chunk
+
+    rows = 0
+    try:
+        if fmt == 'csv':
+            yield output(CSV_HEADER)
+        async for page in iter_rows(repository, customer_ids, lower, upper, concurrency):
+            with stage('encode'):
+                chunk = output(encode(page))
+            rows += len(page)
+            # The compressor holds back small outputs until it has a block
+            if chunk:
+                yield chunk
+        if compressor:
+            yield compressor.flush()
+    except Exception:
+        # Headers are already sent, so the stream is cut short instead: the
+        # client sees an incomplete response (and, when gzipped, a truncated file)
+        logger.exception("Export failed after %d rows", rows)
+        raise
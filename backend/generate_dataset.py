@@ -0,0 +1,457 @@
+import argparse
+import gzip
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import numpy as np
+
+from insert_transactions import MERCHANTS
+from repository import TRANSACTION_FIELDS
+
+# Synthetic dataset generator for scale tests.
+#
+# Produces the same kind of history as insert_transactions.generate_transactions
+# (60% CREDITs of 100-1000, DEBITs of 10-200, a random opening balance, and a
+# last row forced to a CREDIT when a customer's debits would reach their
+# credits), but samples whole chunks of rows at once with NumPy and streams
+# them to CSV, Parquet or the database, so memory stays flat however many
+# rows are generated. Each customer's transactions are spread over the
+# --days window in time order, with transaction_ids built from those times.
+#
+#   python generate_dataset.py --customers 1000000 --transactions 100 --output transactions.parquet
+#   python generate_dataset.py --customers 10 --transactions 1000000 --size-distribution fixed --database
+#
+# The same arguments (seed, sizes, --end and --chunk-rows) give the same rows.
+
+CURRENCY = 'USD'
+STATUSES = ['COMPLETED', 'PENDING', 'FAILED']
+CREDIT_PROBABILITY = 0.6
+# Customer attributes are drawn this many customers at a time
+CUSTOMER_BLOCK = 65536
+
+# 100 ns intervals between the UUID epoch (1582-10-15) and the Unix epoch
+UUID_EPOCH_OFFSET = 0x01B21DD213814000
+TICKS_PER_MS = 10000
+HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+# Where the 32 hex digits go in the 36 character UUID string
+UUID_HEX_POSITIONS = np.array(
+    list(range(0, 8)) + list(range(9, 13)) + list(range(14, 18)) + list(range(19, 23)) + list(range(24, 36))
+)
+
+
+def _random_u64(rng, n):
+    return rng.integers(0, 2 ** 64, size=n, dtype=np.uint64)
+
+
+def _cents(rng, low, high, n):
+    # Uniform amounts rounded half-even to cents, like Decimal.quantize
+    return np.rint(rng.uniform(low, high, n) * 100).astype(np.int64)
+
+
+class CustomerBlock:
+    """Customer attributes for ``CUSTOMER_BLOCK`` consecutive customers.
+
+    Drawn from their own generator, so they don't depend on how the rows
+    are chunked (and can be regenerated to find the customers again).
+    """
+
+    def __init__(self, rng, n, transactions, distribution, sigma, max_transactions):
+        # uuid4: random bits with the version and variant set
+        self.id_hi = (_random_u64(rng, n) & np.uint64(0xFFFFFFFFFFFF0FFF)) | np.uint64(0x4000)
+        self.id_lo = (_random_u64(rng, n) & np.uint64(0x3FFFFFFFFFFFFFFF)) | np.uint64(0x8000000000000000)
+        if distribution == 'lognormal':
+            # Heavy tailed partition sizes with the requested mean
+            mu = np.log(transactions) - sigma ** 2 / 2
+            counts = np.rint(rng.lognormal(mu, sigma, n)).astype(np.int64)
+        else:
+            counts = np.full(n, transactions, dtype=np.int64)
+        self.counts = np.clip(counts, 1, max_transactions)
+        self.opening = _cents(rng, 1000, 10000, n)
+
+    def customer_ids(self):
+        return [uuid.UUID(int=(int(hi) << 64) | int(lo)) for hi, lo in zip(self.id_hi, self.id_lo)]
+
+
+def customer_blocks(seed, customers, transactions, distribution='fixed', sigma=1.0, max_transactions=None):
+    rng = np.random.default_rng(np.random.SeedSequence(seed).spawn(2)[0])
+    max_transactions = max_transactions or np.iinfo(np.int64).max
+    for start in range(0, customers, CUSTOMER_BLOCK):
+        n = min(CUSTOMER_BLOCK, customers - start)
+        yield CustomerBlock(rng, n, transactions, distribution, sigma, max_transactions)
+
+
+class _Carry:
+    # State of a customer whose rows continue in the next chunk
+    def __init__(self):
+        self.rows_done = 0
+        self.credits = 0
+        self.debits = 0
+        self.balance = 0
+        self.log_gap = 0.0
+
+
+def _segment_sum(values, starts, lengths):
+    # Sum of each segment, and the running sum within each segment
+    cumulative = np.cumsum(values)
+    before = np.repeat(cumulative[starts] - values[starts], lengths)
+    running = cumulative - before
+    return running[starts + lengths - 1], running
+
+
+def generate_chunks(seed, customers, transactions, chunk_rows=500000, days=30, end=None,
+                    distribution='fixed', sigma=1.0, max_transactions=None):
+    """Yields dicts of column arrays, at most ``chunk_rows`` rows each.
+
+    Rows come one customer after another, oldest first. Amounts and balances
+    are int64 cents, times int64 milliseconds since the Unix epoch and UUIDs
+    pairs of uint64 halves. ``last`` marks each customer's final row.
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(seed).spawn(2)[1])
+    if end is None:
+        end = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    window_ticks = days * 86400 * 1000 * TICKS_PER_MS
+    start_ticks = int(end.timestamp() * 1000) * TICKS_PER_MS + UUID_EPOCH_OFFSET - window_ticks
+    # One random node for the whole dataset, multicast bit set as for non-MAC nodes
+    node = int(_random_u64(rng, 1)[0]) & 0xFFFFFFFFFFFF | 0x010000000000
+
+    blocks = customer_blocks(seed, customers, transactions, distribution, sigma, max_transactions)
+    block = next(blocks, None)
+    index = 0
+    carry = _Carry()
+
+    while block is not None:
+        # Take customers (the last one possibly only in part) until the chunk is full
+        seg_customer = []
+        seg_offset = []
+        seg_length = []
+        rows = 0
+        while block is not None and rows < chunk_rows:
+            remaining = int(block.counts[index]) - (carry.rows_done if not seg_customer else 0)
+            take = min(remaining, chunk_rows - rows)
+            seg_customer.append((block, index))
+            seg_offset.append(carry.rows_done if len(seg_customer) == 1 else 0)
+            seg_length.append(take)
+            rows += take
+            if take < remaining:
+                break
+            index += 1
+            if index == len(block.counts):
+                block = next(blocks, None)
+                index = 0
+
+        yield _chunk(rng, seg_customer, seg_offset, seg_length, carry, start_ticks, window_ticks, node)
+
+
+def _chunk(rng, seg_customer, seg_offset, seg_length, carry, start_ticks, window_ticks, node):
+    lengths = np.array(seg_length, dtype=np.int64)
+    offsets = np.array(seg_offset, dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    n = int(lengths.sum())
+    seg_of_row = np.repeat(np.arange(len(lengths)), lengths)
+    position = np.arange(n) - np.repeat(starts, lengths) + np.repeat(offsets, lengths)
+
+    id_hi = np.array([b.id_hi[i] for b, i in seg_customer], dtype=np.uint64)
+    id_lo = np.array([b.id_lo[i] for b, i in seg_customer], dtype=np.uint64)
+    counts = np.array([b.counts[i] for b, i in seg_customer], dtype=np.int64)
+    opening = np.array([b.opening[i] for b, i in seg_customer], dtype=np.int64)
+    ends = offsets + lengths == counts
+    continued = offsets > 0
+
+    # Credit bias and amounts, as in generate_transactions
+    credit = rng.random(n) < CREDIT_PROBABILITY
+    amount = np.where(credit, _cents(rng, 100, 1000, n), _cents(rng, 10, 200, n))
+
+    base_credits = np.zeros(len(lengths), dtype=np.int64)
+    base_debits = np.zeros(len(lengths), dtype=np.int64)
+    base_balance = opening.copy()
+    base_log = np.zeros(len(lengths))
+    if continued[0]:
+        base_credits[0] = carry.credits
+        base_debits[0] = carry.debits
+        base_balance[0] = carry.balance
+        base_log[0] = carry.log_gap
+
+    # Last row correction: a customer whose credits don't exceed their debits
+    # gets a final CREDIT covering the difference plus 50-150
+    credit_sums, _ = _segment_sum(np.where(credit, amount, 0), starts, lengths)
+    debit_sums, _ = _segment_sum(np.where(credit, 0, amount), starts, lengths)
+    credits = base_credits + credit_sums
+    debits = base_debits + debit_sums
+    last_rows = starts + lengths - 1
+    fix = ends & (credits <= debits)
+    if fix.any():
+        rows_to_fix = last_rows[fix]
+        credits_before = credits[fix] - np.where(credit[rows_to_fix], amount[rows_to_fix], 0)
+        debits_before = debits[fix] - np.where(credit[rows_to_fix], 0, amount[rows_to_fix])
+        amount[rows_to_fix] = debits_before - credits_before + _cents(rng, 50, 150, len(rows_to_fix))
+        credit[rows_to_fix] = True
+        credits[fix] = credits_before + amount[rows_to_fix]
+        debits[fix] = debits_before
+
+    signed = np.where(credit, amount, -amount)
+    _, running = _segment_sum(signed, starts, lengths)
+    balance = running + np.repeat(base_balance, lengths)
+
+    # Sorted uniform times without sorting: the k-th smallest of m uniforms
+    # follows 1 - x_k = prod_{j<=k} U_j ** (1 / (m - j + 1)), a running sum of logs
+    remaining = np.repeat(counts, lengths) - position
+    log_steps = np.log(1.0 - rng.random(n)) / remaining
+    _, log_running = _segment_sum(log_steps, starts, lengths)
+    log_running += np.repeat(base_log, lengths)
+    fraction = -np.expm1(log_running)
+    # Adding the row's position keeps ticks strictly increasing within a customer
+    ticks = start_ticks + np.floor(fraction * window_ticks).astype(np.int64) + position
+
+    # TIMEUUIDs: the tick count split into the time fields, version 1, random clock sequence
+    t = ticks.astype(np.uint64)
+    tid_hi = (
+        ((t & np.uint64(0xFFFFFFFF)) << np.uint64(32))
+        | (((t >> np.uint64(32)) & np.uint64(0xFFFF)) << np.uint64(16))
+        | np.uint64(0x1000)
+        | ((t >> np.uint64(48)) & np.uint64(0x0FFF))
+    )
+    clock_seq = rng.integers(0, 0x4000, n, dtype=np.uint64)
+    tid_lo = np.uint64(0x8000000000000000) | (clock_seq << np.uint64(48)) | np.uint64(node)
+
+    # State of the customer continuing in the next chunk
+    if not ends[-1]:
+        carry.rows_done = int(offsets[-1] + lengths[-1])
+        carry.credits = int(credits[-1])
+        carry.debits = int(debits[-1])
+        carry.balance = int(balance[-1])
+        carry.log_gap = float(log_running[-1])
+    else:
+        carry.__init__()
+
+    last = np.zeros(n, dtype=bool)
+    last[last_rows[ends]] = True
+    return {
+        'customer_hi': id_hi[seg_of_row],
+        'customer_lo': id_lo[seg_of_row],
+        'transaction_hi': tid_hi,
+        'transaction_lo': tid_lo,
+        'amount': amount,
+        'credit': credit,
+        'merchant': rng.integers(0, len(MERCHANTS), n),
+        'status': rng.integers(0, len(STATUSES), n),
+        'balance': balance,
+        'timestamp_ms': (ticks - UUID_EPOCH_OFFSET) // TICKS_PER_MS,
+        'last': last,
+    }
+
+
+def _uuid_strings(hi, lo):
+    # Formats UUIDs without a Python loop: 16 bytes -> 32 hex digits -> dashed string
+    raw = np.empty((len(hi), 16), dtype=np.uint8)
+    raw[:, :8] = hi.astype('>u8').view(np.uint8).reshape(-1, 8)
+    raw[:, 8:] = lo.astype('>u8').view(np.uint8).reshape(-1, 8)
+    digits = np.empty((len(hi), 32), dtype=np.uint8)
+    digits[:, 0::2] = HEX_DIGITS[raw >> 4]
+    digits[:, 1::2] = HEX_DIGITS[raw & 15]
+    text = np.full((len(hi), 36), ord('-'), dtype=np.uint8)
+    text[:, UUID_HEX_POSITIONS] = digits
+    return text.view('S36').ravel().astype('U36')
+
+
+def _decimal_strings(cents):
+    whole = np.abs(cents) // 100
+    fraction = np.char.zfill((np.abs(cents) % 100).astype('U2'), 2)
+    sign = np.where(cents < 0, '-', '')
+    return np.char.add(np.char.add(sign, whole.astype('U')), np.char.add('.', fraction))
+
+
+def _text_columns(chunk):
+    merchants = np.array(MERCHANTS)[chunk['merchant']]
+    timestamps = np.datetime_as_string(chunk['timestamp_ms'].astype('datetime64[ms]'), unit='ms')
+    return {
+        'customer_id': _uuid_strings(chunk['customer_hi'], chunk['customer_lo']),
+        'transaction_id': _uuid_strings(chunk['transaction_hi'], chunk['transaction_lo']),
+        'amount': _decimal_strings(chunk['amount']),
+        'currency': np.full(len(merchants), CURRENCY),
+        'transaction_type': np.where(chunk['credit'], 'CREDIT', 'DEBIT'),
+        'merchant_name': merchants,
+        'description': np.char.add('Transaction at ', merchants),
+        'status': np.array(STATUSES)[chunk['status']],
+        'balance_snapshot': _decimal_strings(chunk['balance']),
+        'transaction_timestamp': np.char.add(timestamps, 'Z'),
+    }
+
+
+class CsvWriter:
+    # Header row with the table's column names; gzipped when the path ends in .gz
+    # (at the fastest level: these are transient bulk load files)
+    def __init__(self, path):
+        if path.endswith('.gz'):
+            self.file = gzip.open(path, 'wt', compresslevel=1, newline='')
+        else:
+            self.file = open(path, 'w', newline='')
+        self.file.write(','.join(TRANSACTION_FIELDS) + '\n')
+
+    def write(self, chunk):
+        # None of the generated values contain commas, quotes or newlines, so
+        # lines are joined directly instead of going through csv quoting
+        columns = _text_columns(chunk)
+        lines = map(','.join, zip(*(columns[field].tolist() for field in TRANSACTION_FIELDS)))
+        self.file.write('\n'.join(lines) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """One row group per chunk. Requires the optional ``pyarrow`` package."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet output requires the 'pyarrow' package (pip install pyarrow)")
+        self.pa = pa
+        self.decimal = pa.decimal128(18, 2)
+        self.schema = pa.schema([
+            ('customer_id', pa.string()),
+            ('transaction_id', pa.string()),
+            ('amount', self.decimal),
+            ('currency', pa.string()),
+            ('transaction_type', pa.string()),
+            ('merchant_name', pa.string()),
+            ('description', pa.string()),
+            ('status', pa.string()),
+            ('balance_snapshot', self.decimal),
+            ('transaction_timestamp', pa.timestamp('ms', tz='UTC')),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def _decimals(self, cents):
+        # decimal128 values are 16 byte little-endian integers of the unscaled value
+        words = np.empty((len(cents), 2), dtype=np.int64)
+        words[:, 0] = cents
+        words[:, 1] = cents >> 63
+        return self.pa.Array.from_buffers(self.decimal, len(cents), [None, self.pa.py_buffer(words.tobytes())])
+
+    def write(self, chunk):
+        columns = _text_columns(chunk)
+        arrays = [
+            self.pa.array(columns['customer_id']),
+            self.pa.array(columns['transaction_id']),
+            self._decimals(chunk['amount']),
+            self.pa.array(columns['currency']),
+            self.pa.array(columns['transaction_type']),
+            self.pa.array(columns['merchant_name']),
+            self.pa.array(columns['description']),
+            self.pa.array(columns['status']),
+            self._decimals(chunk['balance']),
+            self.pa.array(chunk['timestamp_ms'], type=self.pa.timestamp('ms', tz='UTC')),
+        ]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def insert_rows(chunk):
+    # insert_transaction parameter tuples, for BulkLoader
+    hundredth = Decimal('0.01')
+    customers = [uuid.UUID(int=(hi << 64) | lo) for hi, lo in zip(chunk['customer_hi'].tolist(), chunk['customer_lo'].tolist())]
+    transactions = [uuid.UUID(int=(hi << 64) | lo) for hi, lo in zip(chunk['transaction_hi'].tolist(), chunk['transaction_lo'].tolist())]
+    amounts = [Decimal(c) * hundredth for c in chunk['amount'].tolist()]
+    balances = [Decimal(c) * hundredth for c in chunk['balance'].tolist()]
+    timestamps = chunk['timestamp_ms'].astype('datetime64[ms]').astype(object).tolist()
+    merchants = [MERCHANTS[m] for m in chunk['merchant'].tolist()]
+    types = ['CREDIT' if c else 'DEBIT' for c in chunk['credit'].tolist()]
+    statuses = [STATUSES[s] for s in chunk['status'].tolist()]
+    for row in zip(customers, transactions, amounts, types, merchants, statuses, balances, timestamps):
+        customer_id, transaction_id, amount, t_type, merchant, status, balance, timestamp = row
+        yield (
+            customer_id, transaction_id, amount, CURRENCY, t_type,
+            merchant, f"Transaction at {merchant}", status, balance, timestamp
+        )
+
+
+def write_files(chunks, path):
+    writer = ParquetWriter(path) if path.endswith('.parquet') else CsvWriter(path)
+    rows = 0
+    start = time.perf_counter()
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+            rows += len(chunk['amount'])
+            print(f"Wrote {rows} rows ({rows / (time.perf_counter() - start):.0f} rows/sec)")
+    finally:
+        writer.close()
+
+
+def write_database(chunks, args):
+    from balances import reconcile
+    from bulk_loader import BulkLoader
+    from insert_transactions import create_connection, require_customer_layout, setup_schema
+    from rollups import backfill
+    from statements import StatementRegistry
+
+    require_customer_layout()
+    cluster, session = create_connection()
+    try:
+        setup_schema(session)
+        statements = StatementRegistry(session)
+        loader = BulkLoader(
+            session, statements.get('insert_transaction'),
+            concurrency=args.concurrency, batch_size=args.batch_size
+        )
+        loader.load(row for chunk in chunks for row in insert_rows(chunk))
+        if loader.rows_failed:
+            print(f"Failed to insert {loader.rows_failed} transactions, last errors: {loader.errors}")
+
+        if args.skip_derived:
+            return
+        # Customers are regenerated from the seed rather than kept in memory
+        print("Updating materialized balances and spending rollups...")
+        for block in customer_blocks(args.seed, args.customers, args.transactions,
+                                     args.size_distribution, args.size_sigma, args.max_transactions):
+            customer_ids = block.customer_ids()
+            reconcile(statements, customer_ids, fix=True, concurrency=args.concurrency)
+            backfill(statements, customer_ids, concurrency=args.concurrency)
+    finally:
+        cluster.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a large synthetic transactions dataset.")
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=100, help="Transactions per customer (the mean with lognormal sizes).")
+    parser.add_argument('--size-distribution', choices=['fixed', 'lognormal'], default='lognormal')
+    parser.add_argument('--size-sigma', type=float, default=1.0, help="Spread of lognormal partition sizes.")
+    parser.add_argument('--max-transactions', type=int, help="Upper bound on one customer's transactions.")
+    parser.add_argument('--days', type=int, default=30, help="Transactions fall in the last this many days before --end.")
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        help="End of the time window (ISO date or datetime, UTC). Defaults to the start of today.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-rows', type=int, default=500000, help="Rows generated and written at a time.")
+    parser.add_argument('--output', help="Write to a .csv, .csv.gz or .parquet file.")
+    parser.add_argument('--database', action='store_true', help="Insert into the database configured in env_vars.yaml.")
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--skip-derived', action='store_true',
+                        help="With --database, don't rebuild balances and rollups after loading.")
+    args = parser.parse_args()
+
+    if bool(args.output) == args.database:
+        parser.error("pass exactly one of --output or --database")
+    end = args.end
+    if end is not None and end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+
+    chunks = generate_chunks(
+        args.seed, args.customers, args.transactions, chunk_rows=args.chunk_rows, days=args.days, end=end,
+        distribution=args.size_distribution, sigma=args.size_sigma, max_transactions=args.max_transactions
+    )
+    if args.database:
+        write_database(chunks, args)
+    else:
+        write_files(chunks, args.output)
+
+
+if __name__ == "__main__":
+    main()
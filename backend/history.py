@@ -0,0 +1,52 @@
+from cassandra.concurrent import execute_concurrent_with_args
+
+# Per-customer scans of transaction history for the offline tools
+# (balances.py, rollups.py): every history is read and reduced to one value
+# per customer as it arrives, so memory doesn't grow with the table.
+
+# Customers whose transaction histories are read at once when scanning a list of customers
+SCAN_CHUNK = 200
+
+
+def _scan_all(statements, all_rows_statement, compute):
+    # A full table scan returns each partition's rows contiguously, so
+    # customers can be reduced one at a time with constant memory
+    customer_id = None
+    rows = []
+    for row in statements.execute(all_rows_statement):
+        if row.customer_id != customer_id:
+            if rows:
+                yield customer_id, compute(rows)
+            customer_id = row.customer_id
+            rows = []
+        rows.append(row)
+    if rows:
+        yield customer_id, compute(rows)
+
+
+def _scan_customers(statements, customer_statement, compute, customer_ids, concurrency, scan_chunk):
+    # Histories are read scan_chunk customers at a time and each one is
+    # consumed as its result arrives, so at most one chunk of first pages is
+    # held in memory however many customers are scanned
+    for start in range(0, len(customer_ids), scan_chunk):
+        chunk = customer_ids[start:start + scan_chunk]
+        results = execute_concurrent_with_args(
+            statements.session, statements.get(customer_statement),
+            [(customer_id,) for customer_id in chunk],
+            concurrency=concurrency, raise_on_first_error=True, results_generator=True
+        )
+        for customer_id, (_, rows) in zip(chunk, results):
+            yield customer_id, compute(rows)
+
+
+def scan_histories(statements, all_rows_statement, customer_statement, compute,
+                   customer_ids=None, concurrency=50, scan_chunk=SCAN_CHUNK):
+    """Yield (customer_id, compute(rows)) for each customer's history, rows newest first.
+
+    Scans the given customers with ``customer_statement`` (bound to a
+    customer_id), or the whole table with ``all_rows_statement`` when
+    ``customer_ids`` is None.
+    """
+    if customer_ids is None:
+        return _scan_all(statements, all_rows_statement, compute)
+    return _scan_customers(statements, customer_statement, compute, list(customer_ids), concurrency, scan_chunk)
@@ -1,6 +1,5 @@
 import uuid
 import random
-import time
 import yaml
 import os
 
@@ -9,9 +8,17 @@ from datetime import datetime, timedelta
 from cassandra.cluster import Cluster
 from cassandra.auth import PlainTextAuthProvider
 
+from balances import reconcile
+from bulk_loader import BulkLoader
+from rollups import backfill
+from statements import SCHEMA, StatementRegistry
+
 # Configuration
 def load_config():
     config_path = os.path.join(os.path.dirname(__file__), 'env_vars.yaml')
+    # Missing config is allowed so the data generators can be imported on their own
+    if not os.path.exists(config_path):
+        return {}
     with open(config_path, 'r') as f:
         return yaml.safe_load(f)
 
@@ -21,57 +28,54 @@ CLIENT_ID = config.get('ASTRA_CLIENT_ID')
 CLIENT_SECRET = config.get('ASTRA_CLIENT_SECRET')
 CUSTOMER_ID = config.get('CUSTOMER_ID')
 NUM_OF_TRANSACTIONS = int(config.get('NUM_OF_TRANSACTIONS', 100))
+# Bulk load tuning: async writes in flight, and rows per single-partition UNLOGGED batch
+CONCURRENCY = int(config.get('CONCURRENCY', 100))
+BATCH_SIZE = int(config.get('BATCH_SIZE', 20))
 KEYSPACE = 'default' 
+# Layout the API writes, from the environment or the env_vars.yaml it is deployed with
+WRITE_LAYOUT = os.getenv('WRITE_LAYOUT') or config.get('WRITE_LAYOUT', 'customer')
 
-def create_connection():
+def create_connection(keyspace=None):
+    # Shared by the offline tools; they pass KEYSPACE, the loaders set it after creating the schema
     cloud_config = {
         'secure_connect_bundle': SECURE_CONNECT_BUNDLE
     }
     auth_provider = PlainTextAuthProvider(CLIENT_ID, CLIENT_SECRET)
     cluster = Cluster(cloud=cloud_config, auth_provider=auth_provider)
-    session = cluster.connect()
+    session = cluster.connect(keyspace)
     return cluster, session
 
+def require_customer_layout():
+    # The loaders, balances.py and rollups.py only read and write
+    # bank_transactions, which stops getting new transactions once the API
+    # writes the month layout alone: their balances and rollups would leave
+    # those out, so they stop here instead
+    if WRITE_LAYOUT == 'month':
+        raise SystemExit(
+            "WRITE_LAYOUT=month: bank_transactions no longer has every transaction, and this tool "
+            "only reads and writes that table. Run it before the cutover, or with WRITE_LAYOUT=both."
+        )
+
+def live_api_instances(statements):
+    # API instances whose api_instances heartbeat hasn't expired yet
+    return list(statements.execute('select_api_instances'))
+
 def setup_schema(session):
-    print(f"Creating table in keyspace '{KEYSPACE}'...")
+    print(f"Creating tables in keyspace '{KEYSPACE}'...")
     session.set_keyspace(KEYSPACE)
     
-    create_table_query = """
-    CREATE TABLE IF NOT EXISTS bank_transactions (
-        customer_id UUID,
-        transaction_id TIMEUUID,
-        amount decimal,
-        currency text,
-        transaction_type text,
-        merchant_name text,
-        description text,
-        status text,
-
-        balance_snapshot decimal,
-        transaction_timestamp timestamp,
-        PRIMARY KEY ((customer_id), transaction_id)
-    ) 
-    WITH CLUSTERING ORDER BY (transaction_id DESC);
-    """
-    session.execute(create_table_query)
-    print("Table created or already exists.")
-
-def generate_data(customer_id_str=None, transactions_count=100):
-    if customer_id_str:
-        customers = [uuid.UUID(customer_id_str)]
-        print(f"Using provided customer ID: {customer_id_str}")
-    else:
-        customers = [uuid.uuid4() for _ in range(10)]
-        print(f"Generating random customers...")
-        
+    for create_table_query in SCHEMA:
+        session.execute(create_table_query)
+    print("Tables created or already exist.")
+
+MERCHANTS = ['Amazon', 'Uber', 'Starbucks', 'Walmart', 'Target', 'Netflix', 'Spotify']
+
+def generate_transactions(customers, transactions_count=100):
+    # Yields insert_transaction parameter tuples, one customer's rows after another
     currencies = ['USD']
-    merchants = ['Amazon', 'Uber', 'Starbucks', 'Walmart', 'Target', 'Netflix', 'Spotify']
+    merchants = MERCHANTS
     statuses = ['COMPLETED', 'PENDING', 'FAILED']
-    
-    print(f"Generating {transactions_count} transactions per customer...")
-    
-    total_inserted = 0
-    
+
     for customer_id in customers:
         balance = Decimal(random.uniform(1000, 10000)).quantize(Decimal("0.01"))
         
@@ -117,25 +121,42 @@ def generate_data(customer_id_str=None, transactions_count=100):
             seconds_ago = random.randint(0, 86400)
             timestamp = datetime.now() - timedelta(days=days_ago, seconds=seconds_ago)
             
-            query = """
-            INSERT INTO bank_transactions (
-                customer_id, transaction_id, amount, currency, transaction_type, 
-                merchant_name, description, status, balance_snapshot, transaction_timestamp
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            
-            session.execute(query, (
+            yield (
                 customer_id, transaction_id, amount, currency, transaction_type,
                 merchant, description, status, balance, timestamp
-            ))
-            total_inserted += 1
-            
-            if total_inserted % 100 == 0:
-                print(f"Inserted {total_inserted} transactions...")
+            )
+
+def generate_data(session, customer_id_str=None, transactions_count=100,
+                  concurrency=CONCURRENCY, batch_size=BATCH_SIZE):
+    if customer_id_str:
+        customers = [uuid.UUID(customer_id_str)]
+        print(f"Using provided customer ID: {customer_id_str}")
+    else:
+        customers = [uuid.uuid4() for _ in range(10)]
+        print(f"Generating random customers...")
+    
+    print(f"Generating {transactions_count} transactions per customer "
+          f"(concurrency {concurrency}, batch size {batch_size})...")
+
+    statements = StatementRegistry(session)
+    loader = BulkLoader(
+        session, statements.get('insert_transaction'),
+        concurrency=concurrency, batch_size=batch_size
+    )
+    loader.load(generate_transactions(customers, transactions_count))
+
+    if loader.rows_failed:
+        print(f"Failed to insert {loader.rows_failed} transactions, last errors: {loader.errors}")
+    print(f"Successfully inserted {loader.rows_written} transactions.")
+
+    print("Updating materialized balances...")
+    reconcile(statements, customers, fix=True)
 
-    print(f"Successfully inserted {total_inserted} transactions.")
+    print("Building spending rollups...")
+    backfill(statements, customers)
 
 if __name__ == "__main__":
+    require_customer_layout()
     cluster = None
     try:
         cluster, session = create_connection()
@@ -145,7 +166,7 @@ if __name__ == "__main__":
         # print("Available keyspaces:", [row.keyspace_name for row in rows])
         
         setup_schema(session)
-        generate_data(customer_id_str=CUSTOMER_ID, transactions_count=NUM_OF_TRANSACTIONS)
+        generate_data(session, customer_id_str=CUSTOMER_ID, transactions_count=NUM_OF_TRANSACTIONS)
         
     except Exception as e:
         print(f"An error occurred: {e}")
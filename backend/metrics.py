@@ -0,0 +1,270 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from cassandra.policies import RetryPolicy
+
+# Minimal Prometheus instrumentation for the API: counters, histograms and
+# scrape-time gauges rendered in the text exposition format on /metrics.
+#
+# Each request also carries a breakdown of where its time went. Code that
+# runs on behalf of a request adds to the current request's stages
+# ("database", "encode", ...) and the middleware records whatever is left of
+# the total as "framework" (request parsing, validation and sending).
+
+logger = logging.getLogger('bank_api.metrics')
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def totals(self):
+        # {labelvalues: (sum, count)}, e.g. for a benchmark to diff before and after a run
+        with self._lock:
+            return {labelvalues: (total, count) for labelvalues, (_, total, count) in self._series.items()}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labelvalues, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, labelvalues, [('le', repr(float(bound)))])
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.labelnames, labelvalues, [('le', '+Inf')])
+                lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _format_labels(self.labelnames, labelvalues)
+                lines.append(f'{self.name}_sum{labels} {total}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge:
+    # Value read at scrape time; collect() returns {labelvalues: value}
+    def __init__(self, name, documentation, collect, labelnames=(), metric_type='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+        self.metric_type = metric_type
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        try:
+            values = self.collect()
+        except Exception:
+            logger.exception("Failed to collect %s", self.name)
+            values = {}
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {value}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'bank_api_request_duration_seconds', "HTTP request latency by route.",
+    ('method', 'route', 'status'),
+))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    'bank_api_request_stage_duration_seconds',
+    "Time spent per request stage (database, encode, framework).",
+    ('route', 'stage'),
+))
+QUERY_LATENCY = REGISTRY.register(Histogram(
+    'bank_api_query_duration_seconds', "CQL statement latency by statement name.",
+    ('statement',),
+))
+QUERY_ROWS = REGISTRY.register(Histogram(
+    'bank_api_query_rows', "Rows returned per CQL statement page.",
+    ('statement',), buckets=ROW_BUCKETS,
+))
+PROFILE_LATENCY = REGISTRY.register(Histogram(
+    'bank_api_profile_query_duration_seconds', "CQL statement latency by execution profile.",
+    ('profile',),
+))
+# Compare against the profile's latency tail to see whether speculative
+# execution (or retrying elsewhere) pays off
+QUERY_EXTRA_ATTEMPTS = REGISTRY.register(Counter(
+    'bank_api_query_extra_attempts_total',
+    "Additional hosts a CQL statement page was sent to (speculative executions and retries), by execution profile.",
+    ('profile',),
+))
+QUERY_ERRORS = REGISTRY.register(Counter(
+    'bank_api_query_errors_total', "CQL statements that failed, by error type.",
+    ('statement', 'error'),
+))
+WRITE_GROUP_SIZE = REGISTRY.register(Histogram(
+    'bank_api_write_group_size', "Transactions committed together per customer by the write sequencer.",
+    buckets=ROW_BUCKETS,
+))
+
+DRIVER_RETRY_DECISIONS = REGISTRY.register(Counter(
+    'bank_api_driver_retry_decisions_total',
+    "Retry policy decisions taken by the driver after a failed attempt.",
+    ('cause', 'decision'),
+))
+
+_DECISIONS = {
+    RetryPolicy.RETRY: 'retry',
+    RetryPolicy.RETHROW: 'rethrow',
+    RetryPolicy.IGNORE: 'ignore',
+    RetryPolicy.RETRY_NEXT_HOST: 'retry_next_host',
+}
+
+
+class CountingRetryPolicy(RetryPolicy):
+    """Delegates to another retry policy and counts its decisions."""
+
+    def __init__(self, policy=None):
+        self.policy = policy or RetryPolicy()
+
+    def _count(self, cause, result):
+        DRIVER_RETRY_DECISIONS.inc(cause, _DECISIONS.get(result[0], str(result[0])))
+        return result
+
+    def on_read_timeout(self, *args, **kwargs):
+        return self._count('read_timeout', self.policy.on_read_timeout(*args, **kwargs))
+
+    def on_write_timeout(self, *args, **kwargs):
+        return self._count('write_timeout', self.policy.on_write_timeout(*args, **kwargs))
+
+    def on_unavailable(self, *args, **kwargs):
+        return self._count('unavailable', self.policy.on_unavailable(*args, **kwargs))
+
+    def on_request_error(self, *args, **kwargs):
+        return self._count('request_error', self.policy.on_request_error(*args, **kwargs))
+
+
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+
+def add_stage(stage, seconds):
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and the stage breakdown.
+
+    Routes are labelled by their path template, never the raw path, to keep
+    label cardinality bounded. Requests slower than ``slow_request_ms`` are
+    logged with their stage breakdown.
+    """
+
+    def __init__(self, app, slow_request_ms=None):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        stages = {}
+        token = _request_stages.set(stages)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stages.reset(token)
+            route = scope.get('route')
+            route_path = getattr(route, 'path', 'unmatched')
+            REQUEST_LATENCY.observe(elapsed, scope['method'], route_path, status['code'])
+            for name, seconds in stages.items():
+                STAGE_LATENCY.observe(seconds, route_path, name)
+            STAGE_LATENCY.observe(max(0.0, elapsed - sum(stages.values())), route_path, 'framework')
+            if self.slow_request_ms is not None and elapsed * 1000 >= self.slow_request_ms:
+                logger.warning(
+                    "Slow request %s %s: %.1f ms (%s)", scope['method'], scope['path'], elapsed * 1000,
+                    ', '.join(f'{name} {seconds * 1000:.1f} ms' for name, seconds in stages.items())
+                )
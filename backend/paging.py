@@ -0,0 +1,67 @@
+import base64
+import binascii
+from datetime import datetime, timezone
+from uuid import UUID
+
+from cassandra.util import datetime_from_uuid1, max_uuid_from_time, min_uuid_from_time
+
+# Transaction lists are paged by keyset on the transaction_id TIMEUUID
+# clustering key (stored DESC): the cursor is the last transaction_id of the
+# previous page and the next page continues strictly below it. Time filters
+# become clustering-key bounds, the same values CQL's minTimeuuid()/maxTimeuuid()
+# produce, so every page is a single clustering-range slice of the partition.
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+MIN_TIMEUUID = min_uuid_from_time(0)
+MAX_TIMEUUID = max_uuid_from_time(datetime(4000, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(transaction_id):
+    return base64.urlsafe_b64encode(transaction_id.bytes).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        transaction_id = UUID(bytes=raw)
+    except (binascii.Error, ValueError):
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    if transaction_id.version != 1:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    return transaction_id
+
+
+def _epoch_seconds(value):
+    # Naive datetimes are taken as UTC, like Cassandra timestamps
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def timeuuid_key(transaction_id):
+    # Sort key matching Cassandra's TIMEUUID ordering (time first)
+    return transaction_id.time, transaction_id.bytes
+
+
+def clustering_bounds(since=None, until=None, cursor=None):
+    """Return (lower, upper) transaction_id bounds for ``>= lower AND < upper``."""
+    lower = min_uuid_from_time(_epoch_seconds(since)) if since else MIN_TIMEUUID
+    upper = max_uuid_from_time(_epoch_seconds(until)) if until else MAX_TIMEUUID
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        if timeuuid_key(after) < timeuuid_key(upper):
+            upper = after
+    return lower, upper
+
+
+def bucket_of(transaction_id):
+    # Month bucket ('YYYY-MM', UTC) of the bucketed layout a TIMEUUID falls in.
+    # Taken from the TIMEUUID rather than transaction_timestamp so clustering
+    # bounds map to the same buckets the rows were written to.
+    return datetime_from_uuid1(transaction_id).strftime('%Y-%m')
@@ -0,0 +1,375 @@
+import asyncio
+import bisect
+import re
+import threading
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+
+from cassandra.cluster import EXEC_PROFILE_DEFAULT
+
+from balances import sum_transactions
+from paging import bucket_of, timeuuid_key
+from rollups import compute_rollups, rollup_cells
+from statements import SEARCH_PREDICATES, search_statement_name
+
+# Storage behind the API endpoints. CassandraRepository is the production
+# implementation; InMemoryRepository keeps the same partition/clustering
+# semantics (one partition per customer_id, rows ordered by transaction_id
+# DESC) in process, so the API can be load tested and profiled without a
+# database and benchmark numbers show API overhead only.
+
+TRANSACTION_FIELDS = (
+    'customer_id', 'transaction_id', 'amount', 'currency', 'transaction_type',
+    'merchant_name', 'description', 'status', 'balance_snapshot', 'transaction_timestamp',
+)
+
+TransactionRow = namedtuple('TransactionRow', TRANSACTION_FIELDS)
+
+# Execution profiles of the API's reads, one per kind of endpoint so each
+# has its own timeout, consistency level and speculative execution (see
+# api.execution_profiles). They return plain tuples: rows are read
+# positionally (transactions in TRANSACTION_FIELDS order), so the driver
+# doesn't need to build a namedtuple class for every result page. Writes run
+# under the default profile.
+EXEC_PROFILE_POINT_READS = 'point_reads'  # one row: a transaction, a balance
+EXEC_PROFILE_RANGE_READS = 'range_reads'  # one page: lists, search, summaries
+EXEC_PROFILE_EXPORTS = 'exports'  # whole histories, page by page
+
+# Table layouts transactions are read from and written to: 'customer' is
+# bank_transactions (one partition per customer), 'month' is
+# bank_transactions_by_month (one partition per customer and month). Writing
+# 'both' during a migration keeps the two in step while history is copied
+# over (see update_schema.py).
+READ_LAYOUTS = ('customer', 'month')
+WRITE_LAYOUTS = {'customer': ('customer',), 'month': ('month',), 'both': ('customer', 'month')}
+
+
+class TransactionRepository:
+    # Transaction rows are returned as tuples in TRANSACTION_FIELDS order
+
+    async def list_page(self, customer_id, lower, upper, limit):
+        # Rows with lower <= transaction_id < upper, newest first, at most limit
+        raise NotImplementedError
+
+    async def iter_pages(self, customer_id, lower, upper):
+        # Async iterator over pages of rows with lower <= transaction_id < upper,
+        # newest first; only one page is held at a time
+        raise NotImplementedError
+
+    async def search(self, customer_id, lower, upper, filters, limit):
+        # Like list_page, keeping only rows that match every filter:
+        # {SEARCH_PREDICATES key: value}
+        raise NotImplementedError
+
+    async def get(self, customer_id, transaction_id):
+        raise NotImplementedError
+
+    async def load_balance(self, customer_id, for_write=False):
+        # (balance, currency, last_transaction_id); last_transaction_id is None
+        # for a customer with no history. for_write is set when the balance is
+        # the base of the next write, which must not read a stale one.
+        raise NotImplementedError
+
+    async def load_rollups(self, customer_id, granularity, lower, upper):
+        # Rollup rows (period, merchant_name, transaction_type, total, txn_count)
+        # with lower <= period <= upper, ordered by period
+        raise NotImplementedError
+
+    async def insert(self, row, currency):
+        # Writes the transaction row, makes row.balance_snapshot the customer's
+        # balance and adds the row to its spending rollups
+        await self.insert_many([row], currency)
+
+    async def insert_many(self, rows, currency):
+        # Same as insert for several rows of one customer, in order, applied
+        # together; the last row's balance_snapshot becomes the balance
+        raise NotImplementedError
+
+
+class CassandraRepository(TransactionRepository):
+    def __init__(self, db, read_layout='customer', write_layout='customer'):
+        if read_layout not in READ_LAYOUTS:
+            raise ValueError(f"Unknown read layout {read_layout!r}")
+        if write_layout not in WRITE_LAYOUTS:
+            raise ValueError(f"Unknown write layout {write_layout!r}")
+        if read_layout not in WRITE_LAYOUTS[write_layout]:
+            # New transactions would not be visible to reads
+            raise ValueError(f"Reading the {read_layout!r} layout requires writing it too")
+        self.db = db
+        self.read_layout = read_layout
+        self.write_layouts = WRITE_LAYOUTS[write_layout]
+
+    async def _buckets(self, customer_id, lower, upper, profile=EXEC_PROFILE_RANGE_READS):
+        # Months of the customer between the bounds that have rows, newest first
+        rows = await self.db.fetch_all(
+            'select_buckets', (customer_id, bucket_of(lower), bucket_of(upper)),
+            execution_profile=profile
+        )
+        return [month for month, in rows]
+
+    async def list_page(self, customer_id, lower, upper, limit):
+        if self.read_layout == 'customer':
+            return await self.db.execute(
+                'select_transactions_page', (customer_id, lower, upper, limit),
+                execution_profile=EXEC_PROFILE_RANGE_READS
+            )
+
+        # Walk the buckets newest first and stop as soon as the page is full
+        rows = []
+        for month in await self._buckets(customer_id, lower, upper):
+            rows.extend(await self.db.execute(
+                'select_bucket_page', (customer_id, month, lower, upper, limit - len(rows)),
+                execution_profile=EXEC_PROFILE_RANGE_READS
+            ))
+            if len(rows) >= limit:
+                break
+        return rows
+
+    async def iter_pages(self, customer_id, lower, upper):
+        if self.read_layout == 'customer':
+            async for page in self.db.pages(
+                'select_transactions_range', (customer_id, lower, upper),
+                execution_profile=EXEC_PROFILE_EXPORTS
+            ):
+                yield page
+            return
+
+        for month in await self._buckets(customer_id, lower, upper, EXEC_PROFILE_EXPORTS):
+            async for page in self.db.pages(
+                'select_bucket_range', (customer_id, month, lower, upper),
+                execution_profile=EXEC_PROFILE_EXPORTS
+            ):
+                if page:
+                    yield page
+
+    async def search(self, customer_id, lower, upper, filters, limit):
+        fields = [f for f in SEARCH_PREDICATES if f in filters]
+        values = tuple(filters[f] for f in fields)
+        bucketed = self.read_layout == 'month'
+        name = search_statement_name(fields, bucketed)
+        if not bucketed:
+            return await self.db.execute(
+                name, (customer_id, lower, upper) + values + (limit,),
+                execution_profile=EXEC_PROFILE_RANGE_READS
+            )
+
+        rows = []
+        for month in await self._buckets(customer_id, lower, upper):
+            rows.extend(await self.db.execute(
+                name, (customer_id, month, lower, upper) + values + (limit - len(rows),),
+                execution_profile=EXEC_PROFILE_RANGE_READS
+            ))
+            if len(rows) >= limit:
+                break
+        return rows
+
+    async def get(self, customer_id, transaction_id):
+        if self.read_layout == 'month':
+            return await self.db.execute_one(
+                'select_bucket_transaction', (customer_id, bucket_of(transaction_id), transaction_id),
+                execution_profile=EXEC_PROFILE_POINT_READS
+            )
+        return await self.db.execute_one(
+            'select_transaction', (customer_id, transaction_id),
+            execution_profile=EXEC_PROFILE_POINT_READS
+        )
+
+    async def load_balance(self, customer_id, for_write=False):
+        # Read from the materialized customer_balances row. Customers written
+        # before the table existed are computed from history once and seeded.
+        # Reads for a write go through the default profile, at LOCAL_QUORUM
+        # whatever POINT_READ_CONSISTENCY relaxes the GET endpoints to.
+        profile = EXEC_PROFILE_DEFAULT if for_write else EXEC_PROFILE_POINT_READS
+        row = await self.db.execute_one('select_balance', (customer_id,), execution_profile=profile)
+        if row:
+            balance, currency, last_transaction_id = row
+            return balance, currency, last_transaction_id
+
+        rows = await self.db.fetch_all('select_balance_rows', (customer_id,))
+        balance, currency, last_transaction_id = sum_transactions(rows)
+        if last_transaction_id is not None:
+            await self.db.execute('insert_balance_if_missing', (
+                customer_id, balance, currency, last_transaction_id, datetime.now()
+            ))
+        return balance, currency, last_transaction_id
+
+    async def load_rollups(self, customer_id, granularity, lower, upper):
+        return await self.db.fetch_all(
+            'select_rollups', (customer_id, granularity, lower, upper),
+            execution_profile=EXEC_PROFILE_RANGE_READS
+        )
+
+    async def insert_many(self, rows, currency):
+        # The rollup cells the rows fall in are read first (concurrently, one
+        # read per distinct cell) and rewritten with the new totals. Logged
+        # batch so the transactions, the materialized balance and the rollups
+        # are applied together. That read-modify-write is only correct with
+        # one writer per customer: the write sequencer of a single process,
+        # and no rollups.py backfill running alongside. Counters can't hold
+        # decimals or join this batch, and an LWT can't span its partitions.
+        customer_id = rows[0].customer_id
+        cells = list(dict.fromkeys(cell for row in rows for cell in rollup_cells(row)))
+        current = await asyncio.gather(*(
+            self.db.execute_one('select_rollup', (customer_id,) + cell) for cell in cells
+        ))
+        totals = {
+            cell: [existing.total, existing.txn_count] if existing else [Decimal(0), 0]
+            for cell, existing in zip(cells, current)
+        }
+        compute_rollups(rows, totals)
+
+        last = rows[-1]
+        entries = []
+        if 'customer' in self.write_layouts:
+            entries.extend(('insert_transaction', tuple(row)) for row in rows)
+        if 'month' in self.write_layouts:
+            months = [bucket_of(row.transaction_id) for row in rows]
+            entries.extend(('insert_bucket_transaction', tuple(row) + (month,)) for row, month in zip(rows, months))
+            entries.extend(('insert_bucket', (customer_id, month)) for month in dict.fromkeys(months))
+        entries.append(('upsert_balance', (
+            customer_id, last.balance_snapshot, currency,
+            last.transaction_id, last.transaction_timestamp
+        )))
+        for cell, (total, count) in totals.items():
+            entries.append(('upsert_rollup', (customer_id,) + cell + (total, count)))
+        await self.db.execute_statement(self.db.statements.batch(entries), label='insert_transaction_batch')
+
+
+def _words(text):
+    # Roughly what the 'standard' analyzer indexes: lowercased word tokens
+    return re.findall(r'\w+', text.lower()) if text else []
+
+
+def _matches(row, filters):
+    # In-process equivalent of the search indexes (see statements.SEARCH_INDEXES)
+    for field, value in filters.items():
+        if field == 'merchant_name' or field == 'status':
+            if (getattr(row, field) or '').casefold() != value.casefold():
+                return False
+        elif field == 'description':
+            if not set(_words(value)) <= set(_words(row.description)):
+                return False
+        elif field == 'transaction_type':
+            if row.transaction_type != value:
+                return False
+        elif field == 'min_amount':
+            if row.amount < value:
+                return False
+        elif field == 'max_amount':
+            if row.amount > value:
+                return False
+    return True
+
+
+class _Partition:
+    # Rows kept in ascending clustering order alongside their sort keys;
+    # reads walk the slice backwards to return newest first
+    def __init__(self):
+        self.keys = []
+        self.rows = []
+
+    def put(self, row):
+        key = timeuuid_key(row.transaction_id)
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            self.rows[i] = row
+        else:
+            self.keys.insert(i, key)
+            self.rows.insert(i, row)
+
+
+class InMemoryRepository(TransactionRepository):
+    def __init__(self, page_size=1000):
+        self.page_size = page_size
+        self._partitions = {}
+        self._balances = {}
+        self._rollups = {}
+        self._lock = threading.Lock()
+
+    def bulk_load(self, rows):
+        # Seeds the store from insert_transaction parameter tuples, then
+        # derives balances from history the way balances.reconcile does
+        touched = set()
+        with self._lock:
+            for values in rows:
+                row = TransactionRow(*values)
+                self._partitions.setdefault(row.customer_id, _Partition()).put(row)
+                touched.add(row.customer_id)
+            for customer_id in touched:
+                rows = self._partitions[customer_id].rows
+                self._balances[customer_id] = sum_transactions(reversed(rows))
+                self._rollups[customer_id] = compute_rollups(rows)
+
+    def transaction_ids(self, customer_id):
+        partition = self._partitions.get(customer_id)
+        return [row.transaction_id for row in partition.rows] if partition else []
+
+    async def list_page(self, customer_id, lower, upper, limit):
+        partition = self._partitions.get(customer_id)
+        if partition is None:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(partition.keys, timeuuid_key(lower))
+            stop = bisect.bisect_left(partition.keys, timeuuid_key(upper))
+            return partition.rows[max(start, stop - limit):stop][::-1]
+
+    async def iter_pages(self, customer_id, lower, upper):
+        # Pages are sliced below the last row returned, like driver paging
+        while True:
+            page = await self.list_page(customer_id, lower, upper, self.page_size)
+            if page:
+                yield page
+            if len(page) < self.page_size:
+                return
+            upper = page[-1][1]
+
+    async def search(self, customer_id, lower, upper, filters, limit):
+        # Scans the range; the in-memory store has no indexes to use
+        partition = self._partitions.get(customer_id)
+        if partition is None:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(partition.keys, timeuuid_key(lower))
+            stop = bisect.bisect_left(partition.keys, timeuuid_key(upper))
+            rows = []
+            for row in reversed(partition.rows[start:stop]):
+                if _matches(row, filters):
+                    rows.append(row)
+                    if len(rows) == limit:
+                        break
+            return rows
+
+    async def get(self, customer_id, transaction_id):
+        partition = self._partitions.get(customer_id)
+        if partition is None:
+            return None
+        key = timeuuid_key(transaction_id)
+        with self._lock:
+            i = bisect.bisect_left(partition.keys, key)
+            if i < len(partition.keys) and partition.keys[i] == key:
+                return partition.rows[i]
+        return None
+
+    async def load_balance(self, customer_id, for_write=False):
+        with self._lock:
+            return self._balances.get(customer_id, (Decimal(0), "USD", None))
+
+    async def load_rollups(self, customer_id, granularity, lower, upper):
+        with self._lock:
+            rollups = self._rollups.get(customer_id, {})
+            return [
+                (period, merchant_name, transaction_type, total, count)
+                for (cell_granularity, period, merchant_name, transaction_type), (total, count) in sorted(rollups.items())
+                if cell_granularity == granularity and lower <= period <= upper
+            ]
+
+    async def insert_many(self, rows, currency):
+        rows = [TransactionRow(*row) for row in rows]
+        customer_id = rows[0].customer_id
+        with self._lock:
+            partition = self._partitions.setdefault(customer_id, _Partition())
+            for row in rows:
+                partition.put(row)
+            self._balances[customer_id] = (rows[-1].balance_snapshot, currency, rows[-1].transaction_id)
+            compute_rollups(rows, self._rollups.setdefault(customer_id, {}))
@@ -0,0 +1,114 @@
+import argparse
+import uuid
+from decimal import Decimal
+
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.util import datetime_from_uuid1
+
+from history import scan_histories
+from statements import StatementRegistry
+
+# Spending rollups: per customer, the total and count of transactions for
+# every (granularity, period, merchant_name, transaction_type) cell. The API
+# updates the two cells a new transaction falls in (its day and its month);
+# this module computes them from history for the backfill.
+
+GRANULARITIES = ('day', 'month')
+PERIOD_FORMATS = {'day': '%Y-%m-%d', 'month': '%Y-%m'}
+# Bounds for an open-ended period range
+MIN_PERIOD = ''
+MAX_PERIOD = '9999-12-31'
+
+
+def period_of(value, granularity):
+    # value is a date or datetime
+    return value.strftime(PERIOD_FORMATS[granularity])
+
+
+def rollup_cells(row):
+    # The (granularity, period, merchant_name, transaction_type) cells a
+    # transaction counts towards. Rows written before transaction_timestamp
+    # existed fall back to the time in their TIMEUUID.
+    timestamp = row.transaction_timestamp or datetime_from_uuid1(row.transaction_id)
+    merchant_name = row.merchant_name or ''
+    t_type = row.transaction_type.upper() if row.transaction_type else 'CREDIT'
+    return [(granularity, period_of(timestamp, granularity), merchant_name, t_type) for granularity in GRANULARITIES]
+
+
+def compute_rollups(rows, rollups=None):
+    # Returns {cell: [total, count]}, adding to rollups when given
+    if rollups is None:
+        rollups = {}
+    for row in rows:
+        for cell in rollup_cells(row):
+            entry = rollups.get(cell)
+            if entry is None:
+                entry = rollups[cell] = [Decimal(0), 0]
+            entry[0] += row.amount
+            entry[1] += 1
+    return rollups
+
+
+def _write(statements, params, concurrency):
+    execute_concurrent_with_args(
+        statements.session, statements.get('upsert_rollup'), params,
+        concurrency=concurrency, raise_on_first_error=True
+    )
+
+
+def backfill(statements, customer_ids=None, concurrency=50, chunk_size=5000):
+    """Rebuild spending_rollups from transaction history.
+
+    Scans the given customers, or the whole table when ``customer_ids`` is
+    None, and overwrites their rollup cells with the recomputed totals.
+    Meant for history loaded outside the API: the API maintains the cells
+    by read-modify-write, so a transaction it creates while its customer is
+    being rebuilt can be lost from the totals. The command line refuses to
+    run while an API instance is up. Returns the number of cells written.
+    """
+    computed = scan_histories(
+        statements, 'select_all_rollup_source_rows', 'select_rollup_source_rows', compute_rollups,
+        customer_ids, concurrency
+    )
+
+    customers = 0
+    written = 0
+    params = []
+    for customer_id, rollups in computed:
+        customers += 1
+        for cell, (total, count) in rollups.items():
+            params.append((customer_id,) + cell + (total, count))
+        if len(params) >= chunk_size:
+            _write(statements, params, concurrency)
+            written += len(params)
+            params = []
+    if params:
+        _write(statements, params, concurrency)
+        written += len(params)
+
+    print(f"Rebuilt {written} rollup cells for {customers} customers.")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild spending rollups from transaction history.")
+    parser.add_argument('--customer', action='append', help="Customer ID to rebuild (repeatable). Defaults to all customers.")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--force', action='store_true',
+                        help="Run even though API instances are up (their writes may be lost from the rollups).")
+    args = parser.parse_args()
+
+    # insert_transactions imports this module, so its connection helper is imported here
+    from insert_transactions import KEYSPACE, create_connection, live_api_instances, require_customer_layout
+
+    require_customer_layout()
+    cluster, session = create_connection(KEYSPACE)
+    try:
+        statements = StatementRegistry(session)
+        live = live_api_instances(statements)
+        if live and not args.force:
+            parser.error(f"{len(live)} API instance(s) are running; stop them first (or pass --force).")
+        customer_ids = [uuid.UUID(c) for c in args.customer] if args.customer else None
+        backfill(statements, customer_ids, concurrency=args.concurrency)
+    finally:
+        cluster.shutdown()
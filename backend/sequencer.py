@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from uuid import uuid1
+
+from async_db import Saturated
+from metrics import WRITE_GROUP_SIZE
+from repository import TransactionRow
+
+# Writes for one customer are applied one group at a time by a single
+# worker, so two concurrent POSTs can no longer both read the same balance
+# and write conflicting snapshots. Customers are sharded over a fixed set of
+# workers by customer_id. While a worker is committing, new writes queue up
+# behind it; the next round takes everything queued (up to max_group items)
+# and commits each customer's share with one balance computation and one
+# repository.insert_many() per chunk. The balance each commit leaves is kept
+# in memory for balance_ttl seconds, so a busy account doesn't re-read it on
+# every write. The TTL bounds how long a balance changed behind the
+# sequencer's back (balances.py --fix, another replica) can be overwritten;
+# the write itself can't be made conditional because its logged batch spans
+# several partitions. Each worker queues at most max_queued writes; beyond
+# that submit() raises Saturated, answered with a 503 and Retry-After like
+# reads that find no free query slot.
+#
+# The ordering guarantee holds within one process: replicas writing the same
+# customer still need to route that customer's writes to one of them.
+
+logger = logging.getLogger('bank_api.sequencer')
+
+# rows: the job's rows in order; written: how many of them were stored;
+# error: why the rest were not
+WriteResult = namedtuple('WriteResult', ['rows', 'written', 'error', 'currency'])
+
+
+def new_transaction_row(customer_id, transaction, current_balance):
+    # The row for a new transaction, with the balance it leaves the customer at
+    t_type = transaction.transaction_type.upper()
+    if t_type == 'CREDIT':
+        new_balance = current_balance + transaction.amount
+    else:
+        new_balance = current_balance - transaction.amount
+
+    return TransactionRow(
+        customer_id=customer_id,
+        transaction_id=uuid1(),
+        amount=transaction.amount,
+        currency=transaction.currency,
+        transaction_type=t_type,
+        merchant_name=transaction.merchant_name,
+        description=transaction.description,
+        status=transaction.status,
+        balance_snapshot=new_balance,
+        transaction_timestamp=datetime.now()
+    )
+
+
+class _Job:
+    def __init__(self, customer_id, transactions, future):
+        self.customer_id = customer_id
+        self.transactions = transactions
+        self.future = future
+
+
+class WriteSequencer:
+    """Per-customer write ordering with group commit.
+
+    ``on_commit(customer_id, balance, rows)`` is awaited after each
+    successful commit with the customer's new (balance, currency,
+    last_transaction_id); ``on_failure(customer_id)`` after a commit that
+    failed part way, whose outcome is unknown.
+    """
+
+    def __init__(self, repository, shards=16, max_group=500, chunk_size=50,
+                 max_balances=100000, balance_ttl=2.0, max_queued=1000, retry_after=1,
+                 on_commit=None, on_failure=None):
+        self.repository = repository
+        self.shards = shards
+        self.max_group = max_group
+        self.chunk_size = chunk_size
+        self.max_balances = max_balances
+        self.balance_ttl = balance_ttl
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.on_commit = on_commit
+        self.on_failure = on_failure
+        self._balances = OrderedDict()
+        self._queues = None
+        self._workers = []
+        self._loop = None
+
+    def _start(self, loop):
+        # Workers belong to the loop that started them; a new loop (e.g. a
+        # test client or a benchmark run) gets fresh ones
+        self._loop = loop
+        self._queues = [asyncio.Queue(maxsize=self.max_queued) for _ in range(self.shards)]
+        self._workers = [loop.create_task(self._run(queue)) for queue in self._queues]
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queues = None
+        self._loop = None
+
+    async def submit(self, customer_id, transactions):
+        """Create the transactions, in order, after any earlier writes of the customer.
+
+        Returns a WriteResult. Raises the write error when none of the
+        transactions were stored, and Saturated when the customer's worker
+        already has max_queued writes waiting.
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._start(loop)
+        future = loop.create_future()
+        queue = self._queues[hash(customer_id) % self.shards]
+        try:
+            queue.put_nowait(_Job(customer_id, list(transactions), future))
+        except asyncio.QueueFull:
+            raise Saturated(self.retry_after)
+        return await future
+
+    async def _run(self, queue):
+        while True:
+            jobs = [await queue.get()]
+            items = len(jobs[0].transactions)
+            while items < self.max_group and not queue.empty():
+                job = queue.get_nowait()
+                jobs.append(job)
+                items += len(job.transactions)
+
+            # Different customers commit concurrently, each customer's jobs in arrival order
+            groups = {}
+            for job in jobs:
+                groups.setdefault(job.customer_id, []).append(job)
+            await asyncio.gather(*(self._commit(customer_id, group) for customer_id, group in groups.items()))
+
+    async def _load_balance(self, customer_id):
+        entry = self._balances.get(customer_id)
+        if entry is not None:
+            state, expires_at = entry
+            if expires_at >= time.monotonic():
+                self._balances.move_to_end(customer_id)
+                return state
+            del self._balances[customer_id]
+        return await self.repository.load_balance(customer_id, for_write=True)
+
+    def _remember(self, customer_id, state):
+        self._balances[customer_id] = (state, time.monotonic() + self.balance_ttl)
+        self._balances.move_to_end(customer_id)
+        while len(self._balances) > self.max_balances:
+            self._balances.popitem(last=False)
+
+    async def _commit(self, customer_id, jobs):
+        try:
+            await self._commit_group(customer_id, jobs)
+        except Exception as e:
+            # Anything not settled yet (e.g. the balance read failed) fails as a whole
+            for job in jobs:
+                if not job.future.done():
+                    job.future.set_exception(e)
+
+    async def _commit_group(self, customer_id, jobs):
+        balance, currency, last_transaction_id = await self._load_balance(customer_id)
+        if last_transaction_id is None:
+            currency = jobs[0].transactions[0].currency
+
+        job_rows = []
+        rows = []
+        for job in jobs:
+            start = len(rows)
+            for transaction in job.transactions:
+                row = new_transaction_row(customer_id, transaction, balance)
+                balance = row.balance_snapshot
+                rows.append(row)
+            job_rows.append(rows[start:])
+        WRITE_GROUP_SIZE.observe(len(rows))
+
+        written = 0
+        error = None
+        for start in range(0, len(rows), self.chunk_size):
+            try:
+                await self.repository.insert_many(rows[start:start + self.chunk_size], currency)
+            except Exception as e:
+                error = e
+                break
+            written = min(start + self.chunk_size, len(rows))
+
+        if error is None:
+            last = rows[-1]
+            state = (last.balance_snapshot, currency, last.transaction_id)
+            self._remember(customer_id, state)
+            await self._notify(self.on_commit, customer_id, state, rows)
+        else:
+            # The failed chunk may still have been applied (e.g. on a timeout),
+            # so the next write reads the balance back from the database
+            self._balances.pop(customer_id, None)
+            await self._notify(self.on_failure, customer_id)
+
+        offset = 0
+        for job, own_rows in zip(jobs, job_rows):
+            job_written = max(0, min(written - offset, len(own_rows)))
+            offset += len(own_rows)
+            if job.future.done():
+                # The request went away while it was queued; its rows are written regardless
+                continue
+            if job_written == 0 and error is not None:
+                job.future.set_exception(error)
+            else:
+                job_error = None if job_written == len(own_rows) else error
+                job.future.set_result(WriteResult(own_rows, job_written, job_error, currency))
+
+    async def _notify(self, callback, *args):
+        if callback is None:
+            return
+        try:
+            await callback(*args)
+        except Exception:
+            logger.exception("Write sequencer callback failed for customer %s", args[0])
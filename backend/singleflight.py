@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from functools import partial
+
+# Request coalescing: identical reads that arrive while one is already in
+# flight wait for it and share its result instead of going to the database
+# themselves. Keys are tuples starting with the kind of read (e.g.
+# ('balance', customer_id)); callers put everything that affects the result
+# in the key. Nothing is kept once the call finishes, so this only merges
+# concurrent calls; caching results is the read cache's job.
+
+
+class _Flights:
+    def __init__(self):
+        self._counts = {}
+        self._counts_lock = threading.Lock()
+
+    def _count(self, key, outcome):
+        kind = key[0] if isinstance(key, tuple) else key
+        with self._counts_lock:
+            self._counts[(kind, outcome)] = self._counts.get((kind, outcome), 0) + 1
+
+    def stats(self):
+        # {(kind, 'leader' | 'merged'): calls}; 'merged' calls were served by a leader's result
+        with self._counts_lock:
+            return dict(self._counts)
+
+
+class SingleFlight(_Flights):
+    """Coalesces concurrent coroutine calls with the same key."""
+
+    def __init__(self):
+        super().__init__()
+        self._calls = {}
+
+    async def do(self, key, fn):
+        # fn is a coroutine function called with no arguments by the first caller
+        task = self._calls.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(partial(self._finished, key))
+            self._count(key, 'leader')
+        else:
+            self._count(key, 'merged')
+        # Shielded so a caller that goes away doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    def forget(self, match):
+        # Calls whose key matches stop taking new waiters, e.g. after a write
+        # that a read already in flight may not see; their current waiters
+        # still get the result
+        for key in [key for key in self._calls if match(key)]:
+            del self._calls[key]
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Retrieved here so a failure nobody waited for isn't logged as unhandled
+            task.exception()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SyncSingleFlight(_Flights):
+    """Coalesces concurrent blocking calls with the same key across threads."""
+
+    def __init__(self):
+        super().__init__()
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        self._count(key, 'leader' if leader else 'merged')
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
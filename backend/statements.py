@@ -0,0 +1,566 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+
+from cassandra import ConsistencyLevel
+from cassandra.query import BatchStatement, BatchType
+
+from singleflight import SyncSingleFlight
+
+# Every CQL statement the backend sends is declared here once, by name.
+# The registry prepares them against a session so the coordinator does not
+# re-parse the query on every request and the driver can route by the
+# customer_id partition key (token-aware routing needs bound routing keys).
+#
+# consistency_level None leaves it to the execution profile the statement runs
+# under: the API's reads take it from their per-endpoint profile (see
+# api.execution_profiles). idempotent statements can safely be sent more than
+# once, so the driver may retry them or run them speculatively on another
+# replica; everything here is except the lightweight transaction.
+StatementDef = namedtuple('StatementDef', ['cql', 'consistency_level', 'fetch_size', 'idempotent'], defaults=(False,))
+
+TRANSACTION_COLUMNS = """customer_id, transaction_id, amount, currency, transaction_type,
+           merchant_name, description, status, balance_snapshot, transaction_timestamp"""
+
+# Tables the statements below run against, created by setup/migration scripts
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS bank_transactions (
+        customer_id UUID,
+        transaction_id TIMEUUID,
+        amount decimal,
+        currency text,
+        transaction_type text,
+        merchant_name text,
+        description text,
+        status text,
+        balance_snapshot decimal,
+        transaction_timestamp timestamp,
+        PRIMARY KEY ((customer_id), transaction_id)
+    )
+    WITH CLUSTERING ORDER BY (transaction_id DESC);
+    """,
+    # Running balance per customer, maintained on every insert so balance
+    # reads don't have to scan the customer's transaction history
+    """
+    CREATE TABLE IF NOT EXISTS customer_balances (
+        customer_id UUID PRIMARY KEY,
+        balance decimal,
+        currency text,
+        last_transaction_id TIMEUUID,
+        updated_at timestamp
+    );
+    """,
+    # CREDIT/DEBIT totals per merchant and day/month bucket, maintained on
+    # every insert (see rollups.py) so summaries are a single partition slice
+    """
+    CREATE TABLE IF NOT EXISTS spending_rollups (
+        customer_id UUID,
+        granularity text,
+        period text,
+        merchant_name text,
+        transaction_type text,
+        total decimal,
+        txn_count int,
+        PRIMARY KEY ((customer_id), granularity, period, merchant_name, transaction_type)
+    );
+    """,
+    # Bucketed layout: the same rows partitioned by customer and month (of
+    # the transaction_id time, see paging.bucket_of), so no partition grows
+    # without limit. transaction_buckets lists the months a customer has
+    # rows in, newest first, for reads that walk the buckets.
+    """
+    CREATE TABLE IF NOT EXISTS bank_transactions_by_month (
+        customer_id UUID,
+        month text,
+        transaction_id TIMEUUID,
+        amount decimal,
+        currency text,
+        transaction_type text,
+        merchant_name text,
+        description text,
+        status text,
+        balance_snapshot decimal,
+        transaction_timestamp timestamp,
+        PRIMARY KEY ((customer_id, month), transaction_id)
+    )
+    WITH CLUSTERING ORDER BY (transaction_id DESC);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS transaction_buckets (
+        customer_id UUID,
+        month text,
+        PRIMARY KEY ((customer_id), month)
+    )
+    WITH CLUSTERING ORDER BY (month DESC);
+    """,
+    # Segments of the token ring already copied by a resumable migration
+    """
+    CREATE TABLE IF NOT EXISTS migration_progress (
+        migration text,
+        segment int,
+        rows_copied bigint,
+        completed_at timestamp,
+        PRIMARY KEY ((migration), segment)
+    );
+    """,
+    # One row per running API instance, refreshed with a TTL while it is up,
+    # so offline tools that must not run next to the API can tell
+    """
+    CREATE TABLE IF NOT EXISTS api_instances (
+        instance_id UUID PRIMARY KEY,
+        started_at timestamp,
+        heartbeat_at timestamp
+    );
+    """,
+]
+
+# Storage-attached indexes behind transaction search, on both layouts. A
+# search always restricts the partition, so it reads only the index entries
+# of that partition (and clustering range): cost follows the matches, not
+# the size of the account. Merchant and status match case-insensitively;
+# description is tokenized and matched by word with the ':' operator.
+SEARCH_INDEXES = [
+    ('merchant_name', "{'case_sensitive': 'false', 'normalize': 'true'}"),
+    ('description', "{'index_analyzer': 'standard'}"),
+    ('status', "{'case_sensitive': 'false'}"),
+    ('transaction_type', None),
+    ('amount', None),
+]
+
+SCHEMA += [
+    f"CREATE CUSTOM INDEX IF NOT EXISTS {table}_{column}_idx ON {table} ({column}) "
+    f"USING 'StorageAttachedIndex'" + (f" WITH OPTIONS = {options}" if options else "")
+    for table in ('bank_transactions', 'bank_transactions_by_month')
+    for column, options in SEARCH_INDEXES
+]
+
+# Search filters and the predicate each adds; a search statement has the
+# filters it uses in this order
+SEARCH_PREDICATES = {
+    'merchant_name': 'merchant_name = ?',
+    'description': 'description : ?',
+    'status': 'status = ?',
+    'transaction_type': 'transaction_type = ?',
+    'min_amount': 'amount >= ?',
+    'max_amount': 'amount <= ?',
+}
+
+STATEMENTS = {
+    # One page of a customer's history, newest first, between two
+    # transaction_id bounds (see paging.clustering_bounds)
+    'select_transactions_page': StatementDef(
+        cql=f"""
+        SELECT {TRANSACTION_COLUMNS}
+        FROM bank_transactions
+        WHERE customer_id = ? AND transaction_id >= ? AND transaction_id < ?
+        LIMIT ?
+        """,
+        consistency_level=None,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    # A customer's whole history between two bounds, newest first, read page
+    # by page for exports
+    'select_transactions_range': StatementDef(
+        cql=f"""
+        SELECT {TRANSACTION_COLUMNS}
+        FROM bank_transactions
+        WHERE customer_id = ? AND transaction_id >= ? AND transaction_id < ?
+        """,
+        consistency_level=None,
+        fetch_size=1000,
+        idempotent=True,
+    ),
+    'select_transaction': StatementDef(
+        cql=f"""
+        SELECT {TRANSACTION_COLUMNS}
+        FROM bank_transactions
+        WHERE customer_id = ? AND transaction_id = ?
+        """,
+        consistency_level=None,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    'select_balance_rows': StatementDef(
+        cql="""
+        SELECT transaction_id, amount, transaction_type, currency
+        FROM bank_transactions
+        WHERE customer_id = ?
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=5000,
+        idempotent=True,
+    ),
+    'select_all_balance_rows': StatementDef(
+        cql="""
+        SELECT customer_id, transaction_id, amount, transaction_type, currency
+        FROM bank_transactions
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=5000,
+        idempotent=True,
+    ),
+    'select_balance': StatementDef(
+        cql="""
+        SELECT balance, currency, last_transaction_id
+        FROM customer_balances
+        WHERE customer_id = ?
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    'upsert_balance': StatementDef(
+        cql="""
+        INSERT INTO customer_balances (
+            customer_id, balance, currency, last_transaction_id, updated_at
+        ) VALUES (?, ?, ?, ?, ?)
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    # Used by balances.py --fix: the balance is only replaced if no
+    # transaction was written since it was read
+    'update_balance_if_unchanged': StatementDef(
+        cql="""
+        UPDATE customer_balances
+        SET balance = ?, currency = ?, last_transaction_id = ?, updated_at = ?
+        WHERE customer_id = ?
+        IF last_transaction_id = ?
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+    ),
+    # Only used to seed a balance computed from history, so it can't
+    # overwrite a balance written concurrently by a new transaction
+    'insert_balance_if_missing': StatementDef(
+        cql="""
+        INSERT INTO customer_balances (
+            customer_id, balance, currency, last_transaction_id, updated_at
+        ) VALUES (?, ?, ?, ?, ?)
+        IF NOT EXISTS
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+    ),
+    # Columns rollups are computed from, per customer and for the whole table
+    'select_rollup_source_rows': StatementDef(
+        cql="""
+        SELECT amount, transaction_type, merchant_name, transaction_timestamp, transaction_id
+        FROM bank_transactions
+        WHERE customer_id = ?
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=5000,
+        idempotent=True,
+    ),
+    'select_all_rollup_source_rows': StatementDef(
+        cql="""
+        SELECT customer_id, amount, transaction_type, merchant_name, transaction_timestamp, transaction_id
+        FROM bank_transactions
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=5000,
+        idempotent=True,
+    ),
+    # Periods are ISO strings ('2024-05' or '2024-05-17'), so a period range
+    # is a clustering slice within one granularity
+    'select_rollups': StatementDef(
+        cql="""
+        SELECT period, merchant_name, transaction_type, total, txn_count
+        FROM spending_rollups
+        WHERE customer_id = ? AND granularity = ? AND period >= ? AND period <= ?
+        """,
+        consistency_level=None,
+        fetch_size=5000,
+        idempotent=True,
+    ),
+    'select_rollup': StatementDef(
+        cql="""
+        SELECT total, txn_count
+        FROM spending_rollups
+        WHERE customer_id = ? AND granularity = ? AND period = ?
+          AND merchant_name = ? AND transaction_type = ?
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    'upsert_rollup': StatementDef(
+        cql="""
+        INSERT INTO spending_rollups (
+            customer_id, granularity, period, merchant_name, transaction_type, total, txn_count
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    'insert_transaction': StatementDef(
+        cql=f"""
+        INSERT INTO bank_transactions (
+            {TRANSACTION_COLUMNS}
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    # Bucketed layout. Months are 'YYYY-MM' strings, so a month range is a
+    # clustering slice of transaction_buckets.
+    'select_buckets': StatementDef(
+        cql="""
+        SELECT month
+        FROM transaction_buckets
+        WHERE customer_id = ? AND month >= ? AND month <= ?
+        """,
+        consistency_level=None,
+        fetch_size=5000,
+        idempotent=True,
+    ),
+    'select_bucket_page': StatementDef(
+        cql=f"""
+        SELECT {TRANSACTION_COLUMNS}
+        FROM bank_transactions_by_month
+        WHERE customer_id = ? AND month = ? AND transaction_id >= ? AND transaction_id < ?
+        LIMIT ?
+        """,
+        consistency_level=None,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    'select_bucket_range': StatementDef(
+        cql=f"""
+        SELECT {TRANSACTION_COLUMNS}
+        FROM bank_transactions_by_month
+        WHERE customer_id = ? AND month = ? AND transaction_id >= ? AND transaction_id < ?
+        """,
+        consistency_level=None,
+        fetch_size=1000,
+        idempotent=True,
+    ),
+    'select_bucket_transaction': StatementDef(
+        cql=f"""
+        SELECT {TRANSACTION_COLUMNS}
+        FROM bank_transactions_by_month
+        WHERE customer_id = ? AND month = ? AND transaction_id = ?
+        """,
+        consistency_level=None,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    # Parameters are the insert_transaction ones followed by the month
+    'insert_bucket_transaction': StatementDef(
+        cql=f"""
+        INSERT INTO bank_transactions_by_month (
+            {TRANSACTION_COLUMNS}, month
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    'insert_bucket': StatementDef(
+        cql="""
+        INSERT INTO transaction_buckets (customer_id, month)
+        VALUES (?, ?)
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    # Migration to the bucketed layout: the old table is copied one token
+    # range at a time and finished ranges are recorded so a run can resume
+    'select_transactions_in_token_range': StatementDef(
+        cql=f"""
+        SELECT {TRANSACTION_COLUMNS}
+        FROM bank_transactions
+        WHERE token(customer_id) > ? AND token(customer_id) <= ?
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=5000,
+        idempotent=True,
+    ),
+    'select_migration_progress': StatementDef(
+        cql="""
+        SELECT segment, rows_copied
+        FROM migration_progress
+        WHERE migration = ?
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=5000,
+        idempotent=True,
+    ),
+    'insert_migration_progress': StatementDef(
+        cql="""
+        INSERT INTO migration_progress (migration, segment, rows_copied, completed_at)
+        VALUES (?, ?, ?, ?)
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    'upsert_api_instance': StatementDef(
+        cql="""
+        INSERT INTO api_instances (instance_id, started_at, heartbeat_at)
+        VALUES (?, ?, ?)
+        USING TTL ?
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    'delete_api_instance': StatementDef(
+        cql="""
+        DELETE FROM api_instances
+        WHERE instance_id = ?
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+        idempotent=True,
+    ),
+    'select_api_instances': StatementDef(
+        cql="""
+        SELECT instance_id, started_at, heartbeat_at
+        FROM api_instances
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=100,
+        idempotent=True,
+    ),
+    'delete_migration_progress': StatementDef(
+        cql="""
+        DELETE FROM migration_progress
+        WHERE migration = ?
+        """,
+        consistency_level=ConsistencyLevel.LOCAL_QUORUM,
+        fetch_size=None,
+        idempotent=True,
+    ),
+}
+
+
+def search_statement(filters, bucketed=False):
+    """Name and definition of the search using the given SEARCH_PREDICATES keys.
+
+    Parameters are customer_id (and month when bucketed), the transaction_id
+    bounds, the filter values and the limit.
+    """
+    table = 'bank_transactions_by_month' if bucketed else 'bank_transactions'
+    partition = 'customer_id = ? AND month = ?' if bucketed else 'customer_id = ?'
+    predicates = ''.join(f' AND {SEARCH_PREDICATES[f]}' for f in filters)
+    definition = StatementDef(
+        cql=f"""
+        SELECT {TRANSACTION_COLUMNS}
+        FROM {table}
+        WHERE {partition} AND transaction_id >= ? AND transaction_id < ?{predicates}
+        LIMIT ?
+        """,
+        consistency_level=None,
+        fetch_size=None,
+        idempotent=True,
+    )
+    return search_statement_name(filters, bucketed), definition
+
+
+def search_statement_name(filters, bucketed=False):
+    # filters in SEARCH_PREDICATES order
+    return f"search_{'bucket_' if bucketed else ''}transactions[{','.join(filters)}]"
+
+
+# One statement per non-empty combination of filters on each layout (63 per
+# table), registered with the others so prepare_all() prepares them during
+# the warmup and a search never prepares on the request path
+STATEMENTS.update(
+    search_statement(filters, bucketed)
+    for bucketed in (False, True)
+    for count in range(1, len(SEARCH_PREDICATES) + 1)
+    for filters in combinations(SEARCH_PREDICATES, count)
+)
+
+
+_UNCHANGED = object()
+
+
+class StatementRegistry:
+    """Named prepared statements for one session.
+
+    Statements are prepared lazily on first use, or all at once (optionally
+    in parallel) with ``prepare_all()``. Consistency level and fetch size come from the
+    statement definition and can be changed per statement with ``configure()``.
+    """
+
+    def __init__(self, session, definitions=None):
+        self.session = session
+        self.definitions = dict(definitions if definitions is not None else STATEMENTS)
+        self._prepared = {}
+        # Threads needing the same unprepared statement share one prepare
+        self.flights = SyncSingleFlight()
+
+    def register(self, name, cql, consistency_level=None, fetch_size=None, idempotent=False):
+        self.definitions[name] = StatementDef(cql, consistency_level, fetch_size, idempotent)
+        self._prepared.pop(name, None)
+
+    def configure(self, name, consistency_level=_UNCHANGED, fetch_size=None):
+        # consistency_level=None hands it to the execution profile
+        definition = self.definitions[name]
+        if consistency_level is not _UNCHANGED:
+            definition = definition._replace(consistency_level=consistency_level)
+        if fetch_size is not None:
+            definition = definition._replace(fetch_size=fetch_size)
+        self.definitions[name] = definition
+        prepared = self._prepared.get(name)
+        if prepared is not None:
+            self._apply_options(prepared, definition)
+
+    def prepare_all(self, names=None, parallelism=1):
+        # session.prepare() blocks for a round trip (more with
+        # prepare_on_all_hosts), so startup prepares on several threads
+        names = list(names or self.definitions)
+        if parallelism <= 1:
+            for name in names:
+                self.get(name)
+            return
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            list(pool.map(self.get, names))
+
+    def get(self, name):
+        prepared = self._prepared.get(name)
+        if prepared is None:
+            prepared = self.flights.do(('prepare', name), lambda: self._prepare(name))
+        return prepared
+
+    def _prepare(self, name):
+        prepared = self._prepared.get(name)
+        if prepared is None:
+            definition = self.definitions[name]
+            prepared = self.session.prepare(definition.cql)
+            self._apply_options(prepared, definition)
+            self._prepared[name] = prepared
+        return prepared
+
+    def bind(self, name, params=()):
+        return self.get(name).bind(params)
+
+    def execute(self, name, params=(), **kwargs):
+        return self.session.execute(self.bind(name, params), **kwargs)
+
+    def batch(self, entries, batch_type=BatchType.LOGGED):
+        # entries is a sequence of (name, params) pairs
+        batch = BatchStatement(batch_type=batch_type)
+        for name, params in entries:
+            batch.add(self.bind(name, params))
+            consistency_level = self.definitions[name].consistency_level
+            if consistency_level is not None:
+                batch.consistency_level = consistency_level
+        return batch
+
+    @staticmethod
+    def _apply_options(prepared, definition):
+        # Bound statements inherit these from the prepared statement
+        prepared.consistency_level = definition.consistency_level
+        if definition.fetch_size is not None:
+            prepared.fetch_size = definition.fetch_size
+        prepared.is_idempotent = definition.idempotent
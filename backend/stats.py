@@ -0,0 +1,45 @@
+import random
+import threading
+
+
+class LatencyRecorder:
+    """Thread-safe latency sample with percentiles.
+
+    Keeps a uniform reservoir of at most ``max_samples`` values so memory stays
+    bounded no matter how many operations are recorded.
+    """
+
+    def __init__(self, max_samples=100000):
+        self.max_samples = max_samples
+        self.count = 0
+        self.total = 0.0
+        self._samples = []
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            if len(self._samples) < self.max_samples:
+                self._samples.append(seconds)
+            else:
+                i = random.randrange(self.count)
+                if i < self.max_samples:
+                    self._samples[i] = seconds
+
+    def percentile(self, p):
+        return self.percentiles((p,))[p]
+
+    def percentiles(self, ps=(50, 95, 99)):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {p: 0.0 for p in ps}
+        return {
+            p: samples[min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))]
+            for p in ps
+        }
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
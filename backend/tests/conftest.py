@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules are flat scripts importing each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('CACHE_BACKEND', 'local')
+
+
+@pytest.fixture
+def api():
+    import api
+    from singleflight import SingleFlight
+
+    # A fresh in-memory store, cache and sequencer for every test
+    api.repository = None
+    api.cache = None
+    api.sequencer = None
+    api.flights = SingleFlight()
+    api.warmup_task = None
+    api.ready = False
+    yield api
+    api.repository = None
+    api.cache = None
+    api.sequencer = None
+
+
+@pytest.fixture
+def seed(api):
+    """seed(customer_id, *transactions) loads history into the in-memory store.
+
+    Each transaction is a dict with 'at' (a UTC datetime) and optionally
+    amount, transaction_type, merchant_name, description and status.
+    """
+    from datetime import timezone
+    from decimal import Decimal
+
+    from cassandra.util import uuid_from_time
+
+    def seed(customer_id, *transactions):
+        balance = Decimal(0)
+        rows = []
+        for t in sorted(transactions, key=lambda t: t['at']):
+            amount = Decimal(t.get('amount', '10.00'))
+            t_type = t.get('transaction_type', 'CREDIT')
+            balance += amount if t_type == 'CREDIT' else -amount
+            at = t['at'].replace(tzinfo=timezone.utc)
+            rows.append((
+                customer_id, uuid_from_time(at), amount, 'USD', t_type,
+                t.get('merchant_name', 'Shop'), t.get('description', 'Purchase'),
+                t.get('status', 'COMPLETED'), balance, t['at'],
+            ))
+        api.get_repository().bulk_load(rows)
+        return [row[1] for row in rows]
+
+    return seed
@@ -0,0 +1,335 @@
+import asyncio
+import gzip
+import json
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+
+TRANSACTION = {
+    'amount': '25.00', 'currency': 'USD', 'transaction_type': 'CREDIT',
+    'merchant_name': 'Payroll', 'description': 'Salary', 'status': 'COMPLETED',
+}
+
+
+def run(api, scenario):
+    async def main():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            try:
+                return await scenario(client)
+            finally:
+                if api.sequencer:
+                    await api.sequencer.close()
+    return asyncio.run(main())
+
+
+def test_balance_read_racing_a_write_is_not_cached(api):
+    customer_id = uuid.uuid4()
+    repository = api.get_repository()
+    load_balance = repository.load_balance
+    read = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_load_balance(cid):
+        # Reads the old balance, then stalls until the write has committed
+        state = await load_balance(cid)
+        read.set()
+        await release.wait()
+        return state
+
+    async def scenario(client):
+        repository.load_balance = slow_load_balance
+        stale = asyncio.create_task(client.get(f'/customers/{customer_id}/balance'))
+        await read.wait()
+        repository.load_balance = load_balance
+        assert (await client.post(f'/customers/{customer_id}/transactions', json=TRANSACTION)).status_code == 200
+        release.set()
+        before = await stale
+        after = await client.get(f'/customers/{customer_id}/balance')
+        return before, after
+
+    before, after = run(api, scenario)
+    assert before.json()['balance'] == '0'
+    assert after.json()['balance'] == '25.00'
+    assert after.headers['ETag'] != before.headers['ETag']
+
+
+def test_requests_during_warmup_wait_then_get_503(api, monkeypatch):
+    warm_up = api.warm_up
+    started = []
+
+    def slow_warm_up():
+        started.append(1)
+        time.sleep(0.5)
+        warm_up()
+
+    monkeypatch.setattr(api, 'warm_up', slow_warm_up)
+    monkeypatch.setattr(api, 'STARTUP_WAIT_SECONDS', 0.1)
+
+    async def scenario(client):
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        early = await client.get(f'/customers/{uuid.uuid4()}/balance')
+        ticker.cancel()
+        await api.warmup_task
+        later = await client.get(f'/customers/{uuid.uuid4()}/balance')
+        return early, later, ticks
+
+    early, later, ticks = run(api, scenario)
+    assert early.status_code == 503
+    assert early.headers['Retry-After'] == str(api.RETRY_AFTER_SECONDS)
+    # The event loop kept running while the request waited
+    assert ticks >= 5
+    assert later.status_code == 200
+    assert started == [1]
+
+
+def test_restarted_app_warms_up_again(api):
+    from fastapi.testclient import TestClient
+
+    for _ in range(2):
+        with TestClient(api.app) as client:
+            assert client.get(f'/customers/{uuid.uuid4()}/balance').status_code == 200
+        assert api.repository is None and api.sequencer is None and not api.ready
+
+
+def test_conditional_get_of_a_transaction(api):
+    customer_id = uuid.uuid4()
+
+    async def scenario(client):
+        created = (await client.post(f'/customers/{customer_id}/transactions', json=TRANSACTION)).json()
+        path = f"/customers/{customer_id}/transactions/{created['transaction_id']}"
+        first = await client.get(path)
+        tag = first.headers['ETag']
+        return (
+            first,
+            await client.get(path, headers={'If-None-Match': tag}),
+            await client.get(path, headers={'If-None-Match': '"other"'}),
+            await client.get(f"/customers/{uuid.uuid4()}/transactions/{created['transaction_id']}",
+                             headers={'If-None-Match': tag}),
+            await client.get(f'/customers/{customer_id}/transactions/{uuid.uuid1()}', headers={'If-None-Match': '*'}),
+        )
+
+    first, matching, other, wrong_customer, missing = run(api, scenario)
+    assert first.status_code == 200
+    assert matching.status_code == 304 and matching.headers['ETag'] == first.headers['ETag']
+    assert other.status_code == 200 and other.json() == first.json()
+    # Existence and ownership are checked before the tag
+    assert wrong_customer.status_code == 404
+    assert missing.status_code == 404
+
+
+def test_balance_tag_from_a_read_racing_a_write_is_not_revalidated(api):
+    customer_id = uuid.uuid4()
+    repository = api.get_repository()
+    load_balance = repository.load_balance
+    read = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_load_balance(cid):
+        state = await load_balance(cid)
+        read.set()
+        await release.wait()
+        return state
+
+    async def scenario(client):
+        path = f'/customers/{customer_id}/balance'
+        repository.load_balance = slow_load_balance
+        stale = asyncio.create_task(client.get(path))
+        await read.wait()
+        repository.load_balance = load_balance
+        await client.post(f'/customers/{customer_id}/transactions', json=TRANSACTION)
+        release.set()
+        stale_tag = (await stale).headers['ETag']
+        revalidated = await client.get(path, headers={'If-None-Match': stale_tag})
+        current = await client.get(path, headers={'If-None-Match': revalidated.headers['ETag']})
+        return revalidated, current
+
+    revalidated, current = run(api, scenario)
+    assert revalidated.status_code == 200
+    assert revalidated.json()['balance'] == '25.00'
+    assert current.status_code == 304
+
+
+def test_list_pages_with_a_cursor_and_a_time_range(api, seed):
+    customer_id = uuid.uuid4()
+    ids = seed(customer_id, *({'at': datetime(2024, 1, day, 12)} for day in range(1, 6)))
+
+    async def scenario(client):
+        path = f'/customers/{customer_id}/transactions'
+        pages = []
+        params = {'limit': 2}
+        while True:
+            response = await client.get(path, params=params)
+            pages.append([t['transaction_id'] for t in response.json()])
+            if 'X-Next-Cursor' not in response.headers:
+                break
+            params = {'limit': 2, 'cursor': response.headers['X-Next-Cursor']}
+        ranged = await client.get(path, params={'since': '2024-01-02T00:00:00Z', 'until': '2024-01-04T00:00:00Z'})
+        invalid = await client.get(path, params={'cursor': 'not-a-cursor'})
+        return pages, ranged, invalid
+
+    pages, ranged, invalid = run(api, scenario)
+    newest_first = [str(i) for i in reversed(ids)]
+    assert pages == [newest_first[0:2], newest_first[2:4], newest_first[4:]]
+    assert [t['transaction_id'] for t in ranged.json()] == [str(ids[2]), str(ids[1])]
+    assert invalid.status_code == 400
+
+
+def test_batch_reports_items_after_a_failed_chunk(api, monkeypatch):
+    customer_id = uuid.uuid4()
+    monkeypatch.setattr(api, 'BATCH_CHUNK_SIZE', 2)
+    repository = api.get_repository()
+    insert_many = repository.insert_many
+    calls = []
+
+    async def failing_insert_many(rows, currency):
+        # The second chunk never reaches the store
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise RuntimeError('write timed out')
+        await insert_many(rows, currency)
+
+    monkeypatch.setattr(repository, 'insert_many', failing_insert_many)
+
+    async def scenario(client):
+        created = await client.post(
+            f'/customers/{customer_id}/transactions/batch', json={'transactions': [TRANSACTION] * 5}
+        )
+        balance = await client.get(f'/customers/{customer_id}/balance')
+        return created, balance
+
+    created, balance = run(api, scenario)
+    body = created.json()
+    assert created.status_code == 200
+    assert calls == [2, 2]
+    assert (body['created'], body['failed'], body['balance']) == (2, 3, '50.00')
+    assert [r['status'] for r in body['results']] == ['created'] * 2 + ['failed'] * 3
+    assert [r['transaction']['balance_snapshot'] for r in body['results'][:2]] == ['25.00', '50.00']
+    assert body['results'][2]['error'] == 'RuntimeError: write timed out'
+    assert balance.json()['balance'] == '50.00'
+
+
+def test_export_streams_every_page_as_ndjson_csv_and_gzip(api, seed):
+    first, second = uuid.uuid4(), uuid.uuid4()
+    first_ids = seed(first, *({'at': datetime(2024, 1, day, 12)} for day in range(1, 6)))
+    second_ids = seed(second, {'at': datetime(2024, 2, 1, 12)})
+    # Several pages per customer
+    api.get_repository().page_size = 2
+
+    async def scenario(client):
+        ndjson = await client.get('/export', params={'customer_id': [str(first), str(second)]})
+        csv = await client.get(f'/customers/{first}/export', params={'format': 'csv', 'since': '2024-01-04T00:00:00Z'})
+        compressed = await client.get(f'/customers/{first}/export', params={'gzip': 'true'})
+        return ndjson, csv, compressed
+
+    ndjson, csv, compressed = run(api, scenario)
+    lines = [json.loads(line) for line in ndjson.text.splitlines()]
+    assert ndjson.headers['content-type'] == 'application/x-ndjson'
+    assert [line['transaction_id'] for line in lines] == [str(i) for i in [*reversed(first_ids), *second_ids]]
+    assert lines[0]['balance_snapshot'] == '50.00'
+
+    csv_lines = csv.text.splitlines()
+    assert csv_lines[0].split(',')[:2] == ['customer_id', 'transaction_id']
+    assert [line.split(',')[1] for line in csv_lines[1:]] == [str(first_ids[4]), str(first_ids[3])]
+
+    assert compressed.headers['content-type'] == 'application/gzip'
+    assert 'filename="transactions-' in compressed.headers['content-disposition']
+    assert gzip.decompress(compressed.content).splitlines() == ndjson.content.splitlines()[:5]
+
+
+def test_search_filters_match_like_the_indexes(api, seed):
+    customer_id = uuid.uuid4()
+    coffee, rent, refund, pending = seed(
+        customer_id,
+        {'at': datetime(2024, 1, 1, 12), 'amount': '4.50', 'transaction_type': 'DEBIT',
+         'merchant_name': 'Blue Bottle', 'description': 'Morning coffee'},
+        {'at': datetime(2024, 1, 2, 12), 'amount': '1200.00', 'transaction_type': 'DEBIT',
+         'merchant_name': 'Landlord', 'description': 'January rent'},
+        {'at': datetime(2024, 1, 3, 12), 'amount': '4.50',
+         'merchant_name': 'Blue Bottle', 'description': 'Coffee refund'},
+        {'at': datetime(2024, 1, 4, 12), 'amount': '30.00', 'transaction_type': 'DEBIT',
+         'merchant_name': 'Grocer', 'description': 'Weekly shop', 'status': 'PENDING'},
+    )
+    searches = {
+        'merchant=blue bottle': [refund, coffee],
+        'description=COFFEE morning': [coffee],
+        'status=pending': [pending],
+        'transaction_type=credit': [refund],
+        'merchant=Blue Bottle&transaction_type=DEBIT': [coffee],
+        'min_amount=10&max_amount=100': [pending],
+        'min_amount=10&since=2024-01-03T00:00:00Z': [pending],
+        'description=coffee&limit=1': [refund],
+    }
+
+    async def scenario(client):
+        return {
+            query: await client.get(f'/customers/{customer_id}/transactions/search?{query}')
+            for query in searches
+        }
+
+    responses = run(api, scenario)
+    for query, expected in searches.items():
+        assert [t['transaction_id'] for t in responses[query].json()] == [str(i) for i in expected], query
+
+
+def test_summary_totals_history_and_new_transactions(api, seed):
+    customer_id = uuid.uuid4()
+    seed(
+        customer_id,
+        {'at': datetime(2024, 1, 5, 12), 'amount': '1000.00', 'merchant_name': 'Payroll'},
+        {'at': datetime(2024, 1, 6, 12), 'amount': '40.00', 'transaction_type': 'DEBIT', 'merchant_name': 'Grocer'},
+        {'at': datetime(2024, 1, 20, 12), 'amount': '60.00', 'transaction_type': 'DEBIT', 'merchant_name': 'Grocer'},
+        {'at': datetime(2024, 2, 2, 12), 'amount': '15.00', 'transaction_type': 'DEBIT', 'merchant_name': 'Cafe'},
+    )
+
+    async def scenario(client):
+        path = f'/customers/{customer_id}/summary'
+        months = await client.get(path, params={'since': '2024-01-15', 'until': '2024-02-01'})
+        days = await client.get(path, params={'granularity': 'day', 'merchant': 'Grocer'})
+        await client.post(f'/customers/{customer_id}/transactions', json=TRANSACTION)
+        everything = await client.get(path)
+        return months, days, everything
+
+    months, days, everything = run(api, scenario)
+    assert months.json()['totals'] == [
+        {'period': '2024-01', 'merchant_name': 'Grocer', 'transaction_type': 'DEBIT', 'total': '100.00', 'count': 2},
+        {'period': '2024-01', 'merchant_name': 'Payroll', 'transaction_type': 'CREDIT', 'total': '1000.00', 'count': 1},
+        {'period': '2024-02', 'merchant_name': 'Cafe', 'transaction_type': 'DEBIT', 'total': '15.00', 'count': 1},
+    ]
+    assert (months.json()['total_credits'], months.json()['total_debits']) == ('1000.00', '115.00')
+    assert [(t['period'], t['total']) for t in days.json()['totals']] == [('2024-01-06', '40.00'), ('2024-01-20', '60.00')]
+    # The new transaction is counted without a backfill
+    assert (everything.json()['total_credits'], everything.json()['total_debits']) == ('1025.00', '115.00')
+
+
+def test_metrics_label_requests_by_route_template(api):
+    from metrics import REQUEST_LATENCY
+
+    customer_ids = [uuid.uuid4(), uuid.uuid4()]
+    labels = ('GET', '/customers/{customer_id}/balance', 200)
+    _, before = REQUEST_LATENCY.totals().get(labels, (0.0, 0))
+
+    async def scenario(client):
+        for customer_id in customer_ids:
+            await client.get(f'/customers/{customer_id}/balance')
+        return await client.get('/metrics')
+
+    response = run(api, scenario)
+    _, after = REQUEST_LATENCY.totals()[labels]
+    assert after - before == 2
+    assert response.headers['content-type'].startswith('text/plain')
+    assert '# TYPE bank_api_request_duration_seconds histogram' in response.text
+    series = 'bank_api_request_duration_seconds_count{method="GET",route="/customers/{customer_id}/balance",status="200"}'
+    assert f'{series} {after}' in response.text.splitlines()
+    assert 'bank_api_request_stage_duration_seconds_count{route="/customers/{customer_id}/balance",stage="framework"}' in response.text
+    assert not any(str(customer_id) in response.text for customer_id in customer_ids)
@@ -0,0 +1,86 @@
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+from types import SimpleNamespace
+
+import balances
+
+Stored = namedtuple('Stored', ['balance', 'currency', 'last_transaction_id'])
+
+
+class FakeCluster:
+    """customer_balances in memory, answering the statements _check_chunk runs."""
+
+    def __init__(self, stored):
+        self.stored = stored
+        self.writes = []
+
+    def execute_concurrent_with_args(self, session, name, params, concurrency, raise_on_first_error, results_generator=False):
+        results = []
+        for args in params:
+            if name == 'select_balance':
+                row = self.stored.get(args[0])
+                results.append((True, SimpleNamespace(one=lambda row=row: row)))
+                continue
+            self.writes.append((name, args))
+            if name == 'insert_balance_if_missing':
+                applied = args[0] not in self.stored
+            else:
+                applied = self.stored[args[4]].last_transaction_id == args[5]
+            results.append((True, SimpleNamespace(was_applied=applied)))
+        return results
+
+
+def check(monkeypatch, stored, chunk, fix=True):
+    cluster = FakeCluster(stored)
+    monkeypatch.setattr(balances, 'execute_concurrent_with_args', cluster.execute_concurrent_with_args)
+    statements = SimpleNamespace(session=None, get=lambda name: name)
+    report = []
+    skipped = balances._check_chunk(statements, chunk, fix, 10, report)
+    return report, skipped, cluster.writes
+
+
+def test_matching_balance_is_not_reported(monkeypatch):
+    customer_id, head = uuid.uuid4(), uuid.uuid1()
+    report, skipped, writes = check(
+        monkeypatch, {customer_id: Stored(Decimal(5), 'USD', head)},
+        [(customer_id, (Decimal(5), 'USD', head))]
+    )
+    assert (report, skipped, writes) == ([], 0, [])
+
+
+def test_stale_last_transaction_id_is_drift_and_fixed_conditionally(monkeypatch):
+    customer_id, old, head = uuid.uuid4(), uuid.uuid1(), uuid.uuid1()
+    report, skipped, writes = check(
+        monkeypatch, {customer_id: Stored(Decimal(5), 'USD', old)},
+        [(customer_id, (Decimal(5), 'USD', head))]
+    )
+    assert [(drift.customer_id, drift.fixed) for drift in report] == [(customer_id, True)]
+    assert [(name, args[-1]) for name, args in writes] == [('update_balance_if_unchanged', old)]
+
+
+def test_customer_written_after_the_scan_is_skipped(monkeypatch):
+    customer_id, head = uuid.uuid4(), uuid.uuid1()
+    newer = uuid.uuid1()
+    report, skipped, writes = check(
+        monkeypatch, {customer_id: Stored(Decimal(9), 'USD', newer)},
+        [(customer_id, (Decimal(5), 'USD', head))]
+    )
+    assert (report, skipped, writes) == ([], 1, [])
+
+
+def test_missing_balance_is_inserted_only_if_still_missing(monkeypatch):
+    customer_id, head = uuid.uuid4(), uuid.uuid1()
+    report, skipped, writes = check(monkeypatch, {}, [(customer_id, (Decimal(5), 'USD', head))])
+    assert report[0].stored is None and report[0].fixed
+    assert [name for name, _ in writes] == ['insert_balance_if_missing']
+
+
+def test_report_only_writes_nothing(monkeypatch):
+    customer_id, head = uuid.uuid4(), uuid.uuid1()
+    report, skipped, writes = check(
+        monkeypatch, {customer_id: Stored(Decimal(4), 'USD', head)},
+        [(customer_id, (Decimal(5), 'USD', head))], fix=False
+    )
+    assert [(drift.stored, drift.computed, drift.fixed) for drift in report] == [(Decimal(4), Decimal(5), False)]
+    assert writes == []
@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+from cache import LRUCache, NullCache, ReadCache
+
+
+def test_lru_evicts_least_recently_used():
+    async def scenario():
+        backend = LRUCache(max_entries=2)
+        await backend.set('a', 1, 30)
+        await backend.set('b', 2, 30)
+        await backend.get('a')
+        await backend.set('c', 3, 30)
+        return backend, [await backend.get(key) for key in 'abc']
+
+    backend, results = asyncio.run(scenario())
+    assert results == [(True, 1), (False, None), (True, 3)]
+    assert backend.stats()['evictions'] == 1
+
+
+def test_lru_entries_expire():
+    async def scenario():
+        backend = LRUCache()
+        await backend.set('a', 1, 0.01)
+        time.sleep(0.02)
+        return backend, await backend.get('a')
+
+    backend, result = asyncio.run(scenario())
+    assert result == (False, None)
+    assert backend.stats()['expirations'] == 1
+
+
+def test_add_keeps_the_existing_value():
+    async def scenario():
+        backend = LRUCache()
+        first = await backend.add('a', 1, 30)
+        second = await backend.add('a', 2, 30)
+        return first, second, await backend.get('a')
+
+    assert asyncio.run(scenario()) == (1, 1, (True, 1))
+
+
+def test_write_makes_lists_stale_and_replaces_the_balance():
+    async def scenario():
+        cache = ReadCache(LRUCache())
+        key, hit, _ = await cache.get_list('c', (10,))
+        assert not hit
+        await cache.set(key, ['page'])
+        assert (await cache.get_list('c', (10,)))[1:] == (True, ['page'])
+
+        await cache.customer_written('c', ('5', 'USD', 't2'), [('t2', b'{}')])
+        return await cache.get_list('c', (10,)), await cache.get_balance('c'), await cache.get_transaction('c', 't2')
+
+    listed, balance, transaction = asyncio.run(scenario())
+    assert listed[1] is False
+    assert balance[1:] == (True, ('5', 'USD', 't2'))
+    assert transaction == (True, b'{}')
+
+
+def test_balance_read_before_a_write_is_not_served_after_it():
+    async def scenario():
+        cache = ReadCache(LRUCache())
+        key, hit, _ = await cache.get_balance('c')
+        assert not hit
+        # The write commits while the read is still in flight
+        await cache.customer_written('c', ('5', 'USD', 't2'))
+        await cache.set(key, ('0', 'USD', None))
+        return await cache.get_balance('c')
+
+    assert asyncio.run(scenario())[1:] == (True, ('5', 'USD', 't2'))
+
+
+def test_invalidated_customer_misses():
+    async def scenario():
+        cache = ReadCache(LRUCache())
+        await cache.customer_written('c', ('5', 'USD', 't2'))
+        await cache.customer_invalidated('c')
+        return await cache.get_balance('c')
+
+    assert asyncio.run(scenario())[1] is False
+
+
+def test_null_cache_always_misses():
+    async def scenario():
+        cache = ReadCache(NullCache())
+        await cache.customer_written('c', ('5', 'USD', 't2'))
+        key, _, _ = await cache.get_balance('c')
+        await cache.set(key, ('5', 'USD', 't2'))
+        return await cache.get_balance('c')
+
+    assert asyncio.run(scenario())[1] is False
@@ -0,0 +1,58 @@
+import importlib
+import sys
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import encoding
+from api import Transaction
+from repository import TRANSACTION_FIELDS, TransactionRow
+
+ROWS = [
+    TransactionRow(
+        uuid.uuid4(), uuid.uuid1(), Decimal('25.00'), 'USD', 'CREDIT', 'Café Zoë', 'Tip "thanks"\n',
+        'COMPLETED', Decimal('1E+2'), datetime(2024, 1, 2, 3, 4, 5, 6000),
+    ),
+    TransactionRow(
+        uuid.uuid4(), uuid.uuid1(), Decimal('0.1'), 'EUR', 'DEBIT', 'Shop', '', 'PENDING', Decimal('-3.50'), None,
+    ),
+    TransactionRow(
+        uuid.uuid4(), uuid.uuid1(), Decimal('7'), 'USD', 'DEBIT', 'Shop', 'x', 'COMPLETED', Decimal('0'),
+        datetime(2024, 1, 2, 3, 4, 5),
+    ),
+]
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def encoder(request, monkeypatch):
+    if request.param == 'json':
+        # Reimported without orjson to get the standard-library fallback
+        monkeypatch.setitem(sys.modules, 'orjson', None)
+        yield importlib.reload(encoding)
+        monkeypatch.undo()
+        importlib.reload(encoding)
+    else:
+        if encoding.orjson is None:
+            pytest.skip("orjson is not installed")
+        yield encoding
+
+
+def pydantic_body(rows):
+    # What FastAPI sends for the same rows through the response model
+    app = FastAPI()
+
+    @app.get('/', response_model=List[Transaction])
+    def transactions():
+        return [Transaction(**dict(zip(TRANSACTION_FIELDS, row))) for row in rows]
+
+    return TestClient(app).get('/').content
+
+
+def test_encoded_transactions_match_the_response_model(encoder):
+    assert encoder.encode_transactions(ROWS) == pydantic_body(ROWS)
+    assert encoder.encode_transaction(ROWS[0]) == pydantic_body(ROWS[:1])[1:-1]
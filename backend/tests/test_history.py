@@ -0,0 +1,25 @@
+import uuid
+from types import SimpleNamespace
+
+import history
+
+
+def test_customer_scan_streams_in_chunks(monkeypatch):
+    calls = []
+
+    def execute_concurrent_with_args(session, statement, params, concurrency, raise_on_first_error, results_generator=False):
+        calls.append((statement, len(params), results_generator))
+        return ((True, [params[i][0]]) for i in range(len(params)))
+
+    monkeypatch.setattr(history, 'execute_concurrent_with_args', execute_concurrent_with_args)
+    statements = SimpleNamespace(session=None, get=lambda name: name)
+    customer_ids = [uuid.uuid4() for _ in range(5)]
+    scanned = list(history.scan_histories(statements, 'all', 'one', len, customer_ids, 10, scan_chunk=2))
+    assert scanned == [(customer_id, 1) for customer_id in customer_ids]
+    assert calls == [('one', 2, True), ('one', 2, True), ('one', 1, True)]
+
+
+def test_table_scan_groups_contiguous_partitions():
+    rows = [SimpleNamespace(customer_id=customer_id) for customer_id in 'aabccc']
+    statements = SimpleNamespace(execute=lambda name: rows if name == 'all' else [])
+    assert list(history.scan_histories(statements, 'all', 'one', len)) == [('a', 2), ('b', 1), ('c', 3)]
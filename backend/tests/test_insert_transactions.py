@@ -0,0 +1,15 @@
+import pytest
+
+import insert_transactions
+
+
+@pytest.mark.parametrize('layout', ['customer', 'both'])
+def test_tools_run_while_bank_transactions_is_written(monkeypatch, layout):
+    monkeypatch.setattr(insert_transactions, 'WRITE_LAYOUT', layout)
+    insert_transactions.require_customer_layout()
+
+
+def test_tools_refuse_after_the_month_cutover(monkeypatch):
+    monkeypatch.setattr(insert_transactions, 'WRITE_LAYOUT', 'month')
+    with pytest.raises(SystemExit):
+        insert_transactions.require_customer_layout()
@@ -0,0 +1,22 @@
+from metrics import Counter, Histogram
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('latency_seconds', "Latency.", ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, '/a')
+    assert histogram.render() == [
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1.0"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 4.25',
+        'latency_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = Counter('errors_total', "Errors.", ('error',))
+    counter.inc('say "hi"\n')
+    assert counter.render()[-1] == 'errors_total{error="say \\"hi\\"\\n"} 1'
@@ -0,0 +1,38 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+from paging import clustering_bounds
+from repository import CassandraRepository
+
+
+class FakeDB:
+    # Serves select_buckets and select_bucket_page from {month: [rows]}
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.calls = []
+
+    async def fetch_all(self, name, params, execution_profile=None):
+        self.calls.append((name, params[1:]))
+        _, low, high = params
+        return [(month,) for month in sorted(self.buckets, reverse=True) if low <= month <= high]
+
+    async def execute(self, name, params, execution_profile=None):
+        _, month, _, _, limit = params
+        self.calls.append((name, month, limit))
+        return self.buckets[month][:limit]
+
+
+def test_month_layout_page_spans_buckets_and_stops_when_full():
+    db = FakeDB({'2024-03': ['m1', 'm2'], '2024-02': [], '2024-01': ['j1', 'j2', 'j3'], '2023-12': ['d1']})
+    repository = CassandraRepository(db, read_layout='month', write_layout='month')
+    lower, upper = clustering_bounds(datetime(2024, 1, 1), datetime(2024, 3, 31), None)
+
+    rows = asyncio.run(repository.list_page(uuid.uuid4(), lower, upper, 4))
+    assert rows == ['m1', 'm2', 'j1', 'j2']
+    assert db.calls == [
+        ('select_buckets', ('2024-01', '2024-03')),
+        ('select_bucket_page', '2024-03', 4),
+        ('select_bucket_page', '2024-02', 2),
+        ('select_bucket_page', '2024-01', 2),
+    ]
@@ -0,0 +1,39 @@
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from cassandra.util import uuid_from_time
+
+from repository import TransactionRow
+from rollups import compute_rollups
+
+
+def row(at, amount, transaction_type, merchant_name, timestamp=True):
+    return TransactionRow(
+        uuid.UUID(int=1), uuid_from_time(at.replace(tzinfo=timezone.utc)), Decimal(amount), 'USD',
+        transaction_type, merchant_name, None, 'COMPLETED', Decimal(0), at if timestamp else None
+    )
+
+
+def test_rows_add_to_their_day_and_month_cells():
+    rows = [
+        row(datetime(2024, 1, 31, 23), '10.00', 'DEBIT', 'Grocer'),
+        row(datetime(2024, 1, 31, 8), '2.50', 'debit', 'Grocer'),
+        row(datetime(2024, 2, 1, 9), '100.00', None, None),
+        # No transaction_timestamp: the TIMEUUID's time is used
+        row(datetime(2024, 2, 1, 10), '5.00', 'DEBIT', 'Grocer', timestamp=False),
+    ]
+    assert compute_rollups(rows) == {
+        ('day', '2024-01-31', 'Grocer', 'DEBIT'): [Decimal('12.50'), 2],
+        ('month', '2024-01', 'Grocer', 'DEBIT'): [Decimal('12.50'), 2],
+        ('day', '2024-02-01', '', 'CREDIT'): [Decimal('100.00'), 1],
+        ('month', '2024-02', '', 'CREDIT'): [Decimal('100.00'), 1],
+        ('day', '2024-02-01', 'Grocer', 'DEBIT'): [Decimal('5.00'), 1],
+        ('month', '2024-02', 'Grocer', 'DEBIT'): [Decimal('5.00'), 1],
+    }
+
+
+def test_existing_totals_are_added_to():
+    rollups = {('month', '2024-01', 'Grocer', 'DEBIT'): [Decimal('1.00'), 1]}
+    compute_rollups([row(datetime(2024, 1, 5), '2.00', 'DEBIT', 'Grocer')], rollups)
+    assert rollups[('month', '2024-01', 'Grocer', 'DEBIT')] == [Decimal('3.00'), 2]
@@ -0,0 +1,159 @@
+import asyncio
+import uuid
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from async_db import Saturated
+from repository import InMemoryRepository
+from sequencer import WriteSequencer
+
+
+def credit(amount):
+    return SimpleNamespace(
+        amount=Decimal(amount), currency='USD', transaction_type='credit',
+        merchant_name='Payroll', description='Salary', status='COMPLETED',
+    )
+
+
+class RecordingRepository(InMemoryRepository):
+    def __init__(self):
+        super().__init__()
+        self.balance_reads = 0
+        self.batches = []
+        self.fail_after = None
+        self.gate = None
+
+    async def load_balance(self, customer_id, for_write=False):
+        # Only reads the sequencer makes, which must ask for a write's consistency
+        if for_write:
+            self.balance_reads += 1
+        return await super().load_balance(customer_id)
+
+    async def insert_many(self, rows, currency):
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail_after is not None and len(self.batches) >= self.fail_after:
+            raise RuntimeError("write timed out")
+        self.batches.append(len(rows))
+        await super().insert_many(rows, currency)
+
+
+def run(sequencer, scenario):
+    async def main():
+        try:
+            return await scenario()
+        finally:
+            await sequencer.close()
+    return asyncio.run(main())
+
+
+def test_concurrent_writes_chain_their_snapshots():
+    repository = RecordingRepository()
+    sequencer = WriteSequencer(repository, shards=4)
+    customer_id = uuid.uuid4()
+
+    async def scenario():
+        return await asyncio.gather(*(sequencer.submit(customer_id, [credit(1)]) for _ in range(20)))
+
+    results = run(sequencer, scenario)
+    snapshots = sorted(result.rows[0].balance_snapshot for result in results)
+    assert snapshots == [Decimal(i) for i in range(1, 21)]
+    assert asyncio.run(repository.load_balance(customer_id))[0] == Decimal(20)
+
+
+def test_writes_queued_during_a_commit_are_grouped():
+    repository = RecordingRepository()
+    sequencer = WriteSequencer(repository, shards=1, chunk_size=100)
+    customer_id = uuid.uuid4()
+
+    async def scenario():
+        repository.gate = asyncio.Event()
+        first = asyncio.create_task(sequencer.submit(customer_id, [credit(1)]))
+        await asyncio.sleep(0.01)
+        queued = [asyncio.create_task(sequencer.submit(customer_id, [credit(1)])) for _ in range(10)]
+        await asyncio.sleep(0.01)
+        repository.gate.set()
+        return await asyncio.gather(first, *queued)
+
+    results = run(sequencer, scenario)
+    assert repository.batches == [1, 10]
+    assert repository.balance_reads == 1
+    assert all(result.error is None for result in results)
+
+
+def test_failed_chunk_reports_partial_write_and_rereads_balance():
+    repository = RecordingRepository()
+    failures = []
+
+    async def on_failure(customer_id):
+        failures.append(customer_id)
+
+    sequencer = WriteSequencer(repository, shards=1, chunk_size=2, on_failure=on_failure)
+    customer_id = uuid.uuid4()
+
+    async def scenario():
+        await sequencer.submit(customer_id, [credit(1)])
+        repository.fail_after = 2
+        partial = await sequencer.submit(customer_id, [credit(1) for _ in range(5)])
+        repository.fail_after = None
+        after = await sequencer.submit(customer_id, [credit(1)])
+        return partial, after
+
+    partial, after = run(sequencer, scenario)
+    assert partial.written == 2
+    assert isinstance(partial.error, RuntimeError)
+    assert failures == [customer_id]
+    # The balance is read back after the failure instead of taken from memory
+    assert repository.balance_reads == 2
+    assert after.rows[0].balance_snapshot == Decimal(4)
+
+
+def test_remembered_balance_expires():
+    repository = RecordingRepository()
+    sequencer = WriteSequencer(repository, shards=1, balance_ttl=0.05)
+    customer_id = uuid.uuid4()
+
+    async def scenario():
+        await sequencer.submit(customer_id, [credit(10)])
+        reused = await sequencer.submit(customer_id, [credit(1)])
+        # Corrected behind the sequencer's back, e.g. by balances.py --fix
+        repository._balances[customer_id] = (Decimal(100), 'USD', reused.rows[0].transaction_id)
+        await asyncio.sleep(0.1)
+        return reused, await sequencer.submit(customer_id, [credit(1)])
+
+    reused, reloaded = run(sequencer, scenario)
+    assert reused.rows[0].balance_snapshot == Decimal(11)
+    assert reloaded.rows[0].balance_snapshot == Decimal(101)
+    assert repository.balance_reads == 2
+
+
+def test_write_error_fails_the_request_when_nothing_was_stored():
+    repository = RecordingRepository()
+    repository.fail_after = 0
+    sequencer = WriteSequencer(repository, shards=1)
+
+    with pytest.raises(RuntimeError):
+        run(sequencer, lambda: sequencer.submit(uuid.uuid4(), [credit(1)]))
+
+
+def test_full_queue_is_saturated():
+    repository = RecordingRepository()
+    sequencer = WriteSequencer(repository, shards=1, max_queued=2, retry_after=3)
+    customer_id = uuid.uuid4()
+
+    async def scenario():
+        repository.gate = asyncio.Event()
+        # The first job is taken off the queue by the worker and blocks on the gate
+        first = asyncio.create_task(sequencer.submit(customer_id, [credit(1)]))
+        await asyncio.sleep(0.01)
+        queued = [asyncio.create_task(sequencer.submit(customer_id, [credit(1)])) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(Saturated) as excinfo:
+            await sequencer.submit(customer_id, [credit(1)])
+        repository.gate.set()
+        await asyncio.gather(first, *queued)
+        return excinfo.value.retry_after
+
+    assert run(sequencer, scenario) == 3
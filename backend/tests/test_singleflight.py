@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight, SyncSingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    flights = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'value'
+
+    async def scenario():
+        return await asyncio.gather(*(flights.do(('balance', 1), load) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ['value'] * 5
+    assert calls == [1]
+    assert flights.stats() == {('balance', 'leader'): 1, ('balance', 'merged'): 4}
+
+
+def test_failure_reaches_every_waiter_and_is_not_kept():
+    flights = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("read failed")
+
+    async def scenario():
+        results = await asyncio.gather(*(flights.do(('balance', 1), load) for _ in range(3)), return_exceptions=True)
+        with pytest.raises(ValueError):
+            await flights.do(('balance', 1), load)
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert calls == [1, 1]
+
+
+def test_cancelled_waiter_does_not_cancel_the_call():
+    flights = SingleFlight()
+
+    async def load():
+        await asyncio.sleep(0.02)
+        return 'value'
+
+    async def scenario():
+        first = asyncio.create_task(flights.do(('balance', 1), load))
+        second = asyncio.create_task(flights.do(('balance', 1), load))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == 'value'
+
+
+def test_forget_starts_a_new_call_for_later_callers():
+    flights = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        call = len(calls)
+        await asyncio.sleep(0.01)
+        return call
+
+    async def scenario():
+        before = asyncio.create_task(flights.do(('balance', 1), load))
+        await asyncio.sleep(0)
+        flights.forget(lambda key: key[1] == 1)
+        after = await flights.do(('balance', 1), load)
+        return await before, after
+
+    assert asyncio.run(scenario()) == (1, 2)
+
+
+def test_sync_calls_across_threads_share_one_result():
+    flights = SyncSingleFlight()
+    calls = []
+    results = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'prepared'
+
+    threads = [threading.Thread(target=lambda: results.append(flights.do(('prepare', 'q'), load))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['prepared'] * 4
+    assert calls == [1]
@@ -0,0 +1,13 @@
+from itertools import combinations
+
+from statements import SEARCH_PREDICATES, STATEMENTS, StatementRegistry, search_statement_name
+
+
+def test_every_search_is_registered_for_the_warmup():
+    for bucketed in (False, True):
+        for count in range(1, len(SEARCH_PREDICATES) + 1):
+            for filters in combinations(SEARCH_PREDICATES, count):
+                definition = STATEMENTS[search_statement_name(filters, bucketed)]
+                # partition key(s), the two bounds, one per filter and the limit
+                assert definition.cql.count('?') == (2 if bucketed else 1) + 2 + count + 1
+    assert search_statement_name(['merchant_name'], True) in StatementRegistry(None).definitions
@@ -0,0 +1,14 @@
+from update_schema import MAX_TOKEN, MIN_TOKEN, token_segments
+
+
+def test_token_segments_cover_the_ring_without_overlap():
+    segments = token_segments(7)
+    assert len(segments) == 7
+    assert segments[0][0] == MIN_TOKEN
+    assert segments[-1][1] == MAX_TOKEN
+    assert all(end == next_start for (_, end), (next_start, _) in zip(segments, segments[1:]))
+    assert all(start < end for start, end in segments)
+
+
+def test_single_segment_is_the_whole_ring():
+    assert token_segments(1) == [(MIN_TOKEN, MAX_TOKEN)]
@@ -1,11 +1,23 @@
+import argparse
 import os
+import threading
+import time
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from cassandra.cluster import Cluster
 from cassandra.auth import PlainTextAuthProvider
+from cassandra.concurrent import execute_concurrent_with_args
+
+from paging import bucket_of
+from statements import SCHEMA, StatementRegistry
 
 # Configuration
 def load_config():
     config_path = os.path.join(os.path.dirname(__file__), 'env_vars.yaml')
+    # Missing config is allowed so the migration helpers can be imported on their own
+    if not os.path.exists(config_path):
+        return {}
     with open(config_path, 'r') as f:
         return yaml.safe_load(f)
 
@@ -15,25 +27,136 @@ CLIENT_ID = config.get('ASTRA_CLIENT_ID')
 CLIENT_SECRET = config.get('ASTRA_CLIENT_SECRET')
 KEYSPACE = 'default'
 
-def update_schema():
+# Murmur3Partitioner token range
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+
+def connect():
     cloud_config = {
         'secure_connect_bundle': SECURE_CONNECT_BUNDLE
     }
     auth_provider = PlainTextAuthProvider(CLIENT_ID, CLIENT_SECRET)
     cluster = Cluster(cloud=cloud_config, auth_provider=auth_provider)
     session = cluster.connect()
-    
+
     print(f"Connecting to keyspace '{KEYSPACE}'...")
     session.set_keyspace(KEYSPACE)
-    
+    return cluster, session
+
+def update_schema(session):
+    for create_table_query in SCHEMA:
+        session.execute(create_table_query)
+
     try:
         print("Attempting to add transaction_timestamp column...")
         session.execute("ALTER TABLE bank_transactions ADD transaction_timestamp timestamp")
         print("Column added successfully.")
     except Exception as e:
         print(f"Error adding column (it might already exist): {e}")
-        
-    cluster.shutdown()
+
+    # Preparing every API statement fails fast if the schema does not match the queries
+    print("Verifying statements against the schema...")
+    StatementRegistry(session).prepare_all()
+    print("All statements prepared successfully.")
+
+def token_segments(segments):
+    # (start, end] token ranges covering the whole ring
+    step = (MAX_TOKEN - MIN_TOKEN) // segments
+    bounds = [MIN_TOKEN + i * step for i in range(segments)] + [MAX_TOKEN]
+    return list(zip(bounds, bounds[1:]))
+
+def _copy_segment(statements, start, end, concurrency, chunk_size):
+    copied = 0
+    params = []
+    buckets = set()
+
+    def flush():
+        execute_concurrent_with_args(
+            statements.session, statements.get('insert_bucket_transaction'), params,
+            concurrency=concurrency, raise_on_first_error=True
+        )
+
+    for row in statements.execute('select_transactions_in_token_range', (start, end)):
+        month = bucket_of(row.transaction_id)
+        params.append(tuple(row) + (month,))
+        buckets.add((row.customer_id, month))
+        if len(params) >= chunk_size:
+            flush()
+            copied += len(params)
+            params = []
+    if params:
+        flush()
+        copied += len(params)
+
+    # Buckets last, so a bucket is never listed before its rows are readable
+    execute_concurrent_with_args(
+        statements.session, statements.get('insert_bucket'), list(buckets),
+        concurrency=concurrency, raise_on_first_error=True
+    )
+    return copied
+
+def migrate_to_buckets(session, segments=1024, workers=8, concurrency=50, chunk_size=1000, restart=False):
+    """Copy bank_transactions into the bucketed layout.
+
+    The token ring is split into ``segments`` ranges copied ``workers`` at a
+    time. Each finished range is recorded in migration_progress, so running
+    again resumes where an interrupted run stopped (with the same number of
+    segments); ``restart`` copies everything again. Copies are plain upserts
+    of immutable rows, so re-copying a range, or copying rows the API is
+    dual-writing at the same time, is harmless.
+    """
+    statements = StatementRegistry(session)
+    statements.prepare_all([
+        'select_transactions_in_token_range', 'insert_bucket_transaction', 'insert_bucket',
+        'select_migration_progress', 'insert_migration_progress', 'delete_migration_progress',
+    ])
+    migration = f'bank_transactions_by_month/{segments}'
+    if restart:
+        statements.execute('delete_migration_progress', (migration,))
+
+    done = {row.segment: row.rows_copied for row in statements.execute('select_migration_progress', (migration,))}
+    todo = [(i, start, end) for i, (start, end) in enumerate(token_segments(segments)) if i not in done]
+    print(f"Migrating to the bucketed layout: {len(done)} of {segments} segments already copied, "
+          f"{len(todo)} to go with {workers} workers...")
+
+    lock = threading.Lock()
+    totals = {'segments': len(done), 'rows': 0}
+    started = time.perf_counter()
+
+    def copy(segment):
+        i, start, end = segment
+        copied = _copy_segment(statements, start, end, concurrency, chunk_size)
+        statements.execute('insert_migration_progress', (migration, i, copied, datetime.now()))
+        with lock:
+            totals['segments'] += 1
+            totals['rows'] += copied
+            elapsed = time.perf_counter() - started
+            print(f"Segment {i} copied ({copied} rows). {totals['segments']}/{segments} done, "
+                  f"{totals['rows']} rows in {elapsed:.0f}s ({totals['rows'] / elapsed:.0f} rows/sec)")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() re-raises the first failure; finished segments stay recorded
+        list(pool.map(copy, todo))
+
+    print(f"Migration complete: {totals['rows'] + sum(done.values())} rows in {segments} segments.")
 
 if __name__ == "__main__":
-    update_schema()
+    parser = argparse.ArgumentParser(description="Create or update the schema, and migrate to the bucketed layout.")
+    parser.add_argument('--migrate-buckets', action='store_true',
+                        help="Copy bank_transactions into bank_transactions_by_month (resumable).")
+    parser.add_argument('--segments', type=int, default=1024, help="Token ranges the copy is split into.")
+    parser.add_argument('--workers', type=int, default=8, help="Token ranges copied at once.")
+    parser.add_argument('--concurrency', type=int, default=50, help="Writes in flight per worker.")
+    parser.add_argument('--restart', action='store_true', help="Ignore recorded progress and copy everything again.")
+    args = parser.parse_args()
+
+    cluster, session = connect()
+    try:
+        update_schema(session)
+        if args.migrate_buckets:
+            migrate_to_buckets(
+                session, segments=args.segments, workers=args.workers,
+                concurrency=args.concurrency, restart=args.restart
+            )
+    finally:
+        cluster.shutdown()
@@ -1,8 +1,19 @@
 from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.pdfgen import canvas
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+import argparse
+import hashlib
+import json
 import os
 
+# Bump when the page layout changes so every PDF is regenerated
+LAYOUT_VERSION = 1
+MANIFEST_NAME = ".manifest.json"
+
 # 1. Define the Data for 10 Financial Products
+# (the default catalog; pass --catalog to render products from a file instead)
 products = [
     {
         "filename": "01_US_Treasury_Bond_Fund.pdf",
@@ -86,81 +97,170 @@ products = [
     }
 ]
 
-def generate_pdfs():
-    # Create a directory for the files
-    output_dir = "financial_products_pdf"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+def load_catalog(path):
+    # A JSON list of product entries, or JSON Lines with one entry per line
+    with open(path, "r") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
 
-    print(f"Generating 10 PDFs in folder: {output_dir}/...")
+def product_hash(p):
+    # Content hash of a product entry; an unchanged hash means an unchanged PDF
+    payload = json.dumps({"layout": LAYOUT_VERSION, "product": p}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    for p in products:
-        file_path = os.path.join(output_dir, p["filename"])
-        c = canvas.Canvas(file_path, pagesize=letter)
-        width, height = letter
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
 
-        # --- Header Section ---
-        c.setFont("Helvetica-Bold", 24)
-        c.drawString(50, height - 50, p["name"])
-        
-        c.setLineWidth(1)
-        c.line(50, height - 60, width - 50, height - 60)
-
-        # --- Risk Profile Badge ---
-        # Color coding based on profile
-        if "Conservative" in p["profile"]:
-            c.setFillColorRGB(0.2, 0.6, 0.2) # Green
-        elif "Moderate" in p["profile"]:
-            c.setFillColorRGB(0.9, 0.6, 0.1) # Orange
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+@lru_cache(maxsize=None)
+def word_width(word, font_name):
+    # Width at 1000 pt: glyph widths are integers in font units, so widths of
+    # consecutive pieces add up exactly and can be scaled to any size
+    return stringWidth(word, font_name, 1000)
+
+@lru_cache(maxsize=4096)
+def wrap_text(text, font_name, font_size, max_width):
+    # Same greedy wrap as measuring each candidate line with stringWidth, but
+    # each word is measured once instead of re-measuring the whole line
+    space = word_width(" ", font_name)
+    lines = []
+    line = ""
+    line_width = 0
+    for word in text.split():
+        if (line_width + word_width(word, font_name)) * font_size / 1000 < max_width:
+            line += word + " "
+            line_width += word_width(word, font_name) + space
         else:
-            c.setFillColorRGB(0.8, 0.2, 0.2) # Red
-            
-        c.setFont("Helvetica-Bold", 16)
-        c.drawString(50, height - 100, f"Investor Profile: {p['profile']}")
-        
-        # Reset color to black for text
-        c.setFillColorRGB(0, 0, 0)
+            lines.append(line)
+            line = word + " "
+            line_width = word_width(word, font_name) + space
+    lines.append(line)
+    return tuple(lines)
+
+def render_pdf(p, file_path):
+    c = canvas.Canvas(file_path, pagesize=letter)
+    width, height = letter
 
-        # --- Product Type ---
-        c.setFont("Helvetica-Oblique", 14)
-        c.drawString(50, height - 125, f"Asset Class: {p['type']}")
+    # --- Header Section ---
+    c.setFont("Helvetica-Bold", 24)
+    c.drawString(50, height - 50, p["name"])
+    
+    c.setLineWidth(1)
+    c.line(50, height - 60, width - 50, height - 60)
 
-        # --- Description Section ---
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, height - 170, "Product Description:")
+    # --- Risk Profile Badge ---
+    # Color coding based on profile
+    if "Conservative" in p["profile"]:
+        c.setFillColorRGB(0.2, 0.6, 0.2) # Green
+    elif "Moderate" in p["profile"]:
+        c.setFillColorRGB(0.9, 0.6, 0.1) # Orange
+    else:
+        c.setFillColorRGB(0.8, 0.2, 0.2) # Red
         
-        c.setFont("Helvetica", 12)
-        # Simple text wrapping (manual for this example, usually reportlab Platypus is used for complex text)
-        text_y = height - 190
-        words = p["description"].split()
-        line = ""
-        for word in words:
-            if c.stringWidth(line + word, "Helvetica", 12) < 450:
-                line += word + " "
-            else:
-                c.drawString(60, text_y, line)
-                line = word + " "
-                text_y -= 15
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(50, height - 100, f"Investor Profile: {p['profile']}")
+    
+    # Reset color to black for text
+    c.setFillColorRGB(0, 0, 0)
+
+    # --- Product Type ---
+    c.setFont("Helvetica-Oblique", 14)
+    c.drawString(50, height - 125, f"Asset Class: {p['type']}")
+
+    # --- Description Section ---
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, height - 170, "Product Description:")
+    
+    c.setFont("Helvetica", 12)
+    # Simple text wrapping (manual for this example, usually reportlab Platypus is used for complex text)
+    text_y = height - 190
+    lines = wrap_text(p["description"], "Helvetica", 12, 450)
+    for line in lines[:-1]:
         c.drawString(60, text_y, line)
+        text_y -= 15
+    c.drawString(60, text_y, lines[-1])
 
-        # --- Key Financial Details ---
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, text_y - 40, "Key Financial Details:")
-        
-        c.setFont("Helvetica", 12)
-        detail_y = text_y - 60
-        for detail in p["details"]:
-            c.drawString(70, detail_y, f"• {detail}")
-            detail_y -= 20
+    # --- Key Financial Details ---
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, text_y - 40, "Key Financial Details:")
+    
+    c.setFont("Helvetica", 12)
+    detail_y = text_y - 60
+    for detail in p["details"]:
+        c.drawString(70, detail_y, f"• {detail}")
+        detail_y -= 20
+
+    # --- Footer ---
+    c.setFont("Helvetica-Oblique", 10)
+    c.setFillColorRGB(0.5, 0.5, 0.5)
+    c.drawString(50, 50, "Generated for simulation purposes only. Not financial advice.")
+    c.drawRightString(width - 50, 50, "Page 1 of 1")
+
+    c.save()
 
-        # --- Footer ---
-        c.setFont("Helvetica-Oblique", 10)
-        c.setFillColorRGB(0.5, 0.5, 0.5)
-        c.drawString(50, 50, "Generated for simulation purposes only. Not financial advice.")
-        c.drawRightString(width - 50, 50, "Page 1 of 1")
+def render_product(p, output_dir):
+    # Runs in a worker process. Rendered to a temporary name first so an
+    # interrupted run never leaves a truncated PDF behind.
+    file_path = os.path.join(output_dir, p["filename"])
+    render_pdf(p, file_path + ".tmp")
+    os.replace(file_path + ".tmp", file_path)
+    return p["filename"]
 
-        c.save()
-        print(f"Created: {p['filename']}")
+def generate_pdfs(catalog=products, output_dir="financial_products_pdf", workers=None, force=False):
+    # Create a directory for the files
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Only products whose entry changed since the last run (or whose PDF is
+    # missing) are rendered, so unchanged documents aren't re-ingested
+    manifest = {} if force else load_manifest(output_dir)
+    hashes = {p["filename"]: product_hash(p) for p in catalog}
+    pending = [
+        p for p in catalog
+        if manifest.get(p["filename"]) != hashes[p["filename"]]
+        or not os.path.exists(os.path.join(output_dir, p["filename"]))
+    ]
+
+    print(f"Generating {len(pending)} of {len(catalog)} PDFs in folder: {output_dir}/...")
+
+    failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(render_product, p, output_dir): p["filename"] for p in pending}
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed += 1
+                    manifest.pop(filename, None)
+                    print(f"Failed: {filename}: {e}")
+                    continue
+                manifest[filename] = hashes[filename]
+                print(f"Created: {filename}")
+    finally:
+        # Saved even when interrupted so finished PDFs aren't rendered again
+        save_manifest(output_dir, manifest)
+
+    print(f"Done: {len(pending) - failed} created, {len(catalog) - len(pending)} unchanged, {failed} failed.")
 
 if __name__ == "__main__":
-    generate_pdfs()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate the financial product PDFs.")
+    parser.add_argument("--catalog", help="JSON (list) or .jsonl file with product entries. Defaults to the built-in products.")
+    parser.add_argument("--output-dir", default="financial_products_pdf")
+    parser.add_argument("--workers", type=int, help="Rendering processes (defaults to the CPU count).")
+    parser.add_argument("--force", action="store_true", help="Regenerate every PDF, even unchanged ones.")
+    args = parser.parse_args()
+
+    catalog = load_catalog(args.catalog) if args.catalog else products
+    generate_pdfs(catalog, args.output_dir, workers=args.workers, force=args.force)